@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+"""
+cpu benchmark of per-step cfg denoiser work: list based conditioning assembly and combine vs precomputed index tensors and cached conditioning
+uses stub model so only assembly, reconstruct and combine overhead is measured
+"""
+import os
+import sys
+import time
+import torch
+from rich import print # pylint: disable=redefined-builtin
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from modules import prompt_parser, sd_samplers_common # pylint: disable=wrong-import-position
+
+
+def stub_model(x_in, sigma_in, cond):
+    return x_in * (1 / (sigma_in.view(-1, 1, 1, 1) + 1)) + cond[0][:, :1, :4].mean() # cheap stand-in for unet so overhead dominates
+
+
+def make_conds(batch, ands, steps):
+    schedule = lambda text: [prompt_parser.ScheduledPromptConditioning(steps // 2, torch.randn(77, 768)), prompt_parser.ScheduledPromptConditioning(steps, torch.randn(77, 768))] # pylint: disable=unnecessary-lambda-assignment
+    c = prompt_parser.MulticondLearnedConditioning(shape=(batch,), batch=[[prompt_parser.ComposableScheduledPromptConditioning(schedule(i), 1.0 / (j + 1)) for j in range(ands)] for i in range(batch)])
+    uc = prompt_parser.ScheduledConditioningBatch(schedule(i) for i in range(batch))
+    return c, uc
+
+
+def legacy_reconstruct_cond_batch(c, current_step):
+    param = c[0][0].cond
+    res = torch.zeros((len(c),) + param.shape, device=param.device, dtype=param.dtype)
+    for i, cond_schedule in enumerate(c):
+        target_index = 0
+        for current, (end_at, _cond) in enumerate(cond_schedule):
+            if current_step <= end_at:
+                target_index = current
+                break
+        res[i] = cond_schedule[target_index].cond
+    return res
+
+
+def legacy_reconstruct_multicond_batch(c, current_step):
+    tensors = []
+    conds_list = []
+    for composable_prompts in c.batch:
+        conds_for_batch = []
+        for composable_prompt in composable_prompts:
+            target_index = 0
+            for current, entry in enumerate(composable_prompt.schedules):
+                if current_step <= entry.end_at_step:
+                    target_index = current
+                    break
+            conds_for_batch.append((len(tensors), composable_prompt.weight))
+            tensors.append(composable_prompt.schedules[target_index].cond)
+        conds_list.append(conds_for_batch)
+    return conds_list, torch.stack(tensors)
+
+
+def legacy_step(x, sigma, image_cond, c, uc, step, cond_scale):
+    conds_list, tensor = legacy_reconstruct_multicond_batch(c, step)
+    uncond = legacy_reconstruct_cond_batch(uc, step)
+    repeats = [len(conds_list[i]) for i in range(len(conds_list))]
+    x_in = torch.cat([torch.stack([x[i] for _ in range(n)]) for i, n in enumerate(repeats)] + [x])
+    sigma_in = torch.cat([torch.stack([sigma[i] for _ in range(n)]) for i, n in enumerate(repeats)] + [sigma])
+    _image_cond_in = torch.cat([torch.stack([image_cond[i] for _ in range(n)]) for i, n in enumerate(repeats)] + [image_cond])
+    x_out = stub_model(x_in, sigma_in, [torch.cat([tensor, uncond])])
+    denoised_uncond = x_out[-uncond.shape[0]:]
+    denoised = torch.clone(denoised_uncond)
+    for i, conds in enumerate(conds_list):
+        for cond_index, weight in conds:
+            denoised[i] += (x_out[cond_index] - denoised_uncond[i]) * (weight * cond_scale)
+    return denoised
+
+
+def vectorized_step(x, sigma, image_cond, c, uc, step, cond_scale, cached):
+    conds_list, tensor = prompt_parser.reconstruct_multicond_batch(c, step)
+    uncond = prompt_parser.reconstruct_cond_batch(uc, step)
+    cond_batch = sd_samplers_common.CondBatch.get(cached, conds_list, x.device)
+    x_in = torch.cat([cond_batch.repeat(x), x])
+    sigma_in = torch.cat([cond_batch.repeat(sigma), sigma])
+    _image_cond_in = torch.cat([cond_batch.repeat(image_cond), image_cond])
+    x_out = stub_model(x_in, sigma_in, [torch.cat([tensor, uncond])])
+    return cond_batch.combine(x_out, uncond, cond_scale), cond_batch
+
+
+def vectorized(step, x, sigma, image_cond, c, uc, state):
+    denoised, state['cond_batch'] = vectorized_step(x, sigma, image_cond, c, uc, step, 7.0, state['cond_batch'])
+    return denoised
+
+
+def legacy(step, x, sigma, image_cond, c, uc, _state):
+    return legacy_step(x, sigma, image_cond, c, uc, step, 7.0)
+
+
+def run(fn, steps, args):
+    t0 = time.perf_counter()
+    for step in range(steps):
+        fn(step, *args)
+    return time.perf_counter() - t0
+
+
+def main():
+    steps = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    torch.manual_seed(0)
+    for batch, ands in [(1, 1), (4, 1), (4, 3), (8, 4)]:
+        c, uc = make_conds(batch, ands, steps)
+        x = torch.randn(batch, 4, 64, 64)
+        sigma = torch.rand(batch)
+        image_cond = torch.randn(batch, 5, 1, 1)
+        args = (x, sigma, image_cond, c, uc, { 'cond_batch': None })
+        for step in [0, steps - 1]:
+            diff = (legacy(step, *args) - vectorized(step, *args)).abs().max().item()
+            assert diff < 1e-4, f'output mismatch: batch={batch} ands={ands} step={step} diff={diff}'
+        t_legacy = run(legacy, steps, args)
+        t_vectorized = run(vectorized, steps, args)
+        print(f'cfg denoiser: batch={batch} ands={ands} steps={steps} legacy={t_legacy / steps * 1000:.3f}ms vectorized={t_vectorized / steps * 1000:.3f}ms speedup={t_legacy / max(t_vectorized, 1e-9):.2f}x')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+"""
+cpu benchmark of deepcache unet feature reuse using tiny randomly initialized unet and ddim scheduler
+reports speedup over full compute and ssim of final latents against full compute
+"""
+import os
+import sys
+import time
+import torch
+import torch.nn.functional as F
+from rich import print # pylint: disable=redefined-builtin
+from diffusers import UNet2DConditionModel, DDIMScheduler
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from modules.sd_hijack_deepcache import DeepCache # pylint: disable=wrong-import-position
+
+
+def tiny_unet():
+    torch.manual_seed(0)
+    return UNet2DConditionModel(
+        sample_size=32,
+        in_channels=4,
+        out_channels=4,
+        layers_per_block=1,
+        block_out_channels=(32, 64, 64, 64),
+        down_block_types=('CrossAttnDownBlock2D', 'CrossAttnDownBlock2D', 'CrossAttnDownBlock2D', 'DownBlock2D'),
+        up_block_types=('UpBlock2D', 'CrossAttnUpBlock2D', 'CrossAttnUpBlock2D', 'CrossAttnUpBlock2D'),
+        cross_attention_dim=32,
+        attention_head_dim=8,
+        norm_num_groups=8,
+    ).eval()
+
+
+def ssim(a, b, window=7, sigma=1.5):
+    """mean structural similarity of two batches of images with values normalized jointly to 0..1"""
+    lo, hi = torch.min(torch.min(a), torch.min(b)), torch.max(torch.max(a), torch.max(b))
+    a, b = (a - lo) / (hi - lo + 1e-8), (b - lo) / (hi - lo + 1e-8)
+    coords = torch.arange(window, dtype=torch.float32) - window // 2
+    gauss = torch.exp(-coords ** 2 / (2 * sigma ** 2))
+    gauss = gauss / gauss.sum()
+    kernel = (gauss[:, None] * gauss[None, :]).expand(a.shape[1], 1, window, window)
+    blur = lambda x: F.conv2d(x, kernel, groups=a.shape[1]) # pylint: disable=unnecessary-lambda-assignment
+    mu_a, mu_b = blur(a), blur(b)
+    var_a, var_b, cov = blur(a * a) - mu_a ** 2, blur(b * b) - mu_b ** 2, blur(a * b) - mu_a * mu_b
+    c1, c2 = 0.01 ** 2, 0.03 ** 2
+    return (((2 * mu_a * mu_b + c1) * (2 * cov + c2)) / ((mu_a ** 2 + mu_b ** 2 + c1) * (var_a + var_b + c2))).mean().item()
+
+
+def denoise(unet, scheduler, latents, cond, steps, guidance=7.0):
+    scheduler.set_timesteps(steps)
+    for t in scheduler.timesteps:
+        x_in = torch.cat([latents] * 2)
+        noise_uncond, noise_cond = unet(x_in, t, encoder_hidden_states=cond).sample.chunk(2)
+        noise = noise_uncond + guidance * (noise_cond - noise_uncond)
+        latents = scheduler.step(noise, t, latents).prev_sample
+    return latents
+
+
+def run(unet, scheduler, latents, cond, steps, cache=None):
+    if cache is not None:
+        cache.apply()
+    try:
+        t0 = time.perf_counter()
+        with torch.no_grad():
+            result = denoise(unet, scheduler, latents, cond, steps)
+        return time.perf_counter() - t0, result
+    finally:
+        if cache is not None:
+            cache.remove()
+
+
+def main():
+    steps = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else 64
+    unet = tiny_unet()
+    scheduler = DDIMScheduler()
+    torch.manual_seed(1)
+    latents = torch.randn(1, 4, size, size)
+    cond = torch.randn(2, 8, 32)
+    run(unet, scheduler, latents, cond, 2) # warmup
+    t_full, full = run(unet, scheduler, latents, cond, steps)
+    print(f'deepcache: steps={steps} latent={size}x{size} full={t_full:.2f}s')
+    for interval in [2, 3, 5]:
+        for depth in [1, 2]:
+            cache = DeepCache(unet, interval=interval, depth=depth)
+            t_cached, cached = run(unet, scheduler, latents, cond, steps, cache)
+            print(f'deepcache: {cache.stats()} time={t_cached:.2f}s speedup={t_full / max(t_cached, 1e-9):.2f}x ssim={ssim(full, cached):.4f}')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+"""
+microbenchmark of lora key conversion: per-key regex/bisect conversion vs precomputed conversion table lookups
+uses synthetic sdxl layer names so no model needs to be loaded
+"""
+import os
+import sys
+import time
+import bisect
+from rich import print # pylint: disable=redefined-builtin
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'extensions-builtin', 'Lora'))
+import lora_convert # pylint: disable=wrong-import-position
+
+
+suffixes = ['', '_proj_in', '_proj_out', '_transformer_blocks_0_attn1_to_q', '_transformer_blocks_0_attn1_to_k', '_transformer_blocks_0_attn1_to_v', '_transformer_blocks_0_attn1_to_out_0', '_transformer_blocks_0_attn2_to_q', '_transformer_blocks_0_ff_net_0_proj', '_transformer_blocks_0_ff_net_2']
+
+
+def convert_legacy(conversion_map, mapping, key):
+    map_keys = list(conversion_map.keys())
+    map_keys.sort()
+    search_key = key.replace("lora_unet_", "")
+    position = bisect.bisect_right(map_keys, search_key)
+    map_key = map_keys[position - 1]
+    if search_key.startswith(map_key):
+        key = key.replace(map_key, conversion_map[map_key])
+    return mapping.get(key, None)
+
+
+def main():
+    conversion_map = lora_convert.make_unet_conversion_map()
+    mapping = {}
+    keys = []
+    for sd, hf in conversion_map.items():
+        for suffix in suffixes:
+            mapping[f'lora_unet_{hf}{suffix}'] = True
+            keys.append(f'lora_unet_{sd}{suffix}')
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    print(f'lora keys: layers={len(mapping)} keys={len(keys)} repeats={repeats}')
+
+    t0 = time.perf_counter()
+    for _i in range(repeats):
+        legacy = [convert_legacy(conversion_map, mapping, key) for key in keys]
+    t1 = time.perf_counter()
+    table = lora_convert.build_conversion_table(mapping, is_sdxl=True)
+    t2 = time.perf_counter()
+    for _i in range(repeats):
+        lookup = [mapping.get(table.get(key, [None])[0], None) for key in keys]
+    t3 = time.perf_counter()
+    matched = sum(1 for a, b in zip(legacy, lookup) if a == b)
+    print(f'legacy: total={t1 - t0:.3f} per-load={(t1 - t0) / repeats * 1000:.2f}ms')
+    print(f'table: build={(t2 - t1) * 1000:.2f}ms total={t3 - t2:.3f} per-load={(t3 - t2) / repeats * 1000:.2f}ms')
+    print(f'speedup={(t1 - t0) / max(t3 - t2, 1e-9):.1f}x identical={matched}/{len(keys)}')
+
+
+if __name__ == "__main__":
+    main()
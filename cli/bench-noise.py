@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+"""
+benchmark of initial noise generation: per-image global seeding vs batched noise with reusable generators
+verifies that noise, sampler noises and resulting global rng state are identical for batch sizes up to 64
+"""
+import os
+import sys
+import time
+from types import SimpleNamespace
+import torch
+from rich import print # pylint: disable=redefined-builtin
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from modules import shared, processing_helpers # pylint: disable=wrong-import-position
+
+
+class StubSampler:
+    sampler_noises = None
+
+    def number_of_needed_noises(self, _p):
+        return 2
+
+
+def generate(fn, batch, subseed_strength, resize, ensd):
+    shared.opts.data['eta_noise_seed_delta'] = ensd
+    p = SimpleNamespace(sampler=StubSampler())
+    seeds = [1000 + i for i in range(batch)]
+    subseeds = [2000 + i for i in range(batch)]
+    t0 = time.perf_counter()
+    x = fn([4, 64, 64], seeds=seeds, subseeds=subseeds, subseed_strength=subseed_strength, seed_resize_from_h=384 if resize else 0, seed_resize_from_w=448 if resize else 0, p=p)
+    if x.device.type == 'cuda':
+        torch.cuda.synchronize()
+    t = time.perf_counter() - t0
+    after = torch.randn(8, device=x.device) # depends on global rng state left behind
+    return t, x, p.sampler.sampler_noises, after
+
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    shared.opts.data['enable_batch_seeds'] = True
+    for subseed_strength, resize, ensd in [(0.0, False, 0), (0.3, False, 0), (0.0, True, 0), (0.0, False, 31337)]:
+        for batch in [1, 4, 16, 64]:
+            t_legacy, t_batched = 0, 0
+            for _i in range(repeats):
+                t, x_legacy, noises_legacy, after_legacy = generate(processing_helpers.create_random_tensors_legacy, batch, subseed_strength, resize, ensd)
+                t_legacy += t
+                t, x_batched, noises_batched, after_batched = generate(processing_helpers.create_random_tensors, batch, subseed_strength, resize, ensd)
+                t_batched += t
+            assert torch.equal(x_legacy, x_batched), f'noise mismatch: batch={batch}'
+            assert (noises_legacy is None and noises_batched is None) or all(torch.equal(a, b) for a, b in zip(noises_legacy, noises_batched)), f'sampler noise mismatch: batch={batch}'
+            assert torch.equal(after_legacy, after_batched), f'global rng state mismatch: batch={batch}'
+            print(f'noise: device={x_batched.device} batch={batch} subseed={subseed_strength} resize={resize} ensd={ensd} legacy={1000 * t_legacy / repeats:.2f}ms batched={1000 * t_batched / repeats:.2f}ms speedup={t_legacy / max(t_batched, 1e-9):.2f}x')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+"""
+cpu benchmark of latent-to-image postprocessing: per-image quantize, color correction and overlay vs batched equivalents
+reports cpu time per image for batch sizes 1-16 and verifies that batched results match per-image results
+"""
+import os
+import sys
+import time
+import numpy as np
+import torch
+from PIL import Image
+from rich import print # pylint: disable=redefined-builtin
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from modules import shared, processing_helpers # pylint: disable=wrong-import-position
+
+
+def make_batch(rng, batch, size):
+    shape = (batch, 3, size, size) if shared.backend == shared.Backend.ORIGINAL else (batch, size, size, 3)
+    samples = torch.rand(shape) if shared.backend == shared.Backend.ORIGINAL else rng.random(shape, dtype=np.float32)
+    corrections = [processing_helpers.setup_color_correction(Image.fromarray(rng.integers(0, 256, (size, size, 3), dtype=np.uint8))) for _i in range(batch)]
+    overlays = []
+    for _i in range(batch):
+        overlay = rng.integers(0, 256, (size, size, 4), dtype=np.uint8)
+        overlay[:size // 2, :, 3] = 0 # masked area is transparent as in inpaint overlays
+        overlays.append(Image.fromarray(overlay, 'RGBA'))
+    return samples, corrections, overlays
+
+
+def legacy(samples, corrections, overlays):
+    results = []
+    for i, sample in enumerate(samples):
+        image = Image.fromarray(processing_helpers.validate_sample(sample))
+        image = processing_helpers.apply_color_correction(corrections[i], image)
+        image = processing_helpers.apply_overlay(image, None, i, overlays)
+        results.append(image)
+    return results
+
+
+def batched(samples, corrections, overlays):
+    arrays = processing_helpers.validate_samples(samples)
+    arrays = processing_helpers.apply_color_correction_batch(corrections, arrays)
+    arrays = processing_helpers.apply_overlay_batch(arrays, None, overlays)
+    return [processing_helpers.to_image(array) for array in arrays]
+
+
+def measure(fn, args, repeats):
+    t0 = time.process_time()
+    for _i in range(repeats):
+        results = fn(*args)
+    return time.process_time() - t0, results
+
+
+def per_image(t, repeats, batch):
+    return t / repeats / batch * 1000
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 512
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    rng = np.random.default_rng(0)
+    torch.manual_seed(0)
+    for batch in [1, 2, 4, 8, 16]:
+        args = make_batch(rng, batch, size)
+        t_legacy, res_legacy = measure(legacy, args, repeats)
+        t_batched, res_batched = measure(batched, args, repeats)
+        for a, b in zip(res_legacy, res_batched):
+            diff = np.abs(np.asarray(a.convert('RGB'), dtype=np.int16) - np.asarray(b.convert('RGB'), dtype=np.int16)).max()
+            assert diff == 0, f'output mismatch: batch={batch} diff={diff}'
+        print(f'postprocess: batch={batch} size={size} legacy={per_image(t_legacy, repeats, batch):.2f}ms/image batched={per_image(t_batched, repeats, batch):.2f}ms/image speedup={t_legacy / max(t_batched, 1e-9):.2f}x')
+
+
+if __name__ == "__main__":
+    main()
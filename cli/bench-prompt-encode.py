@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+"""
+cpu benchmark of diffusers prompt encoding: fresh embedding providers and empty prompt encode on every call vs cached per pipeline
+uses tiny randomly initialized clip text encoder and synthetic tokenizer so no model needs to be downloaded
+"""
+import os
+import sys
+import json
+import time
+import string
+import tempfile
+import torch
+import transformers
+from rich import print # pylint: disable=redefined-builtin
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from modules import shared, devices, prompt_parser_diffusers # pylint: disable=wrong-import-position
+
+
+class StableDiffusionBenchPipeline:
+    def __init__(self, folder, layers):
+        chars = list(string.ascii_lowercase + string.digits + ',.')
+        vocab = {'<|startoftext|>': 0, '<|endoftext|>': 1}
+        for c in chars:
+            vocab[c] = len(vocab)
+            vocab[f'{c}</w>'] = len(vocab)
+        with open(os.path.join(folder, 'vocab.json'), 'w', encoding='utf8') as f:
+            json.dump(vocab, f)
+        with open(os.path.join(folder, 'merges.txt'), 'w', encoding='utf8') as f:
+            f.write('#version: 0.2\n')
+        self.tokenizer = transformers.CLIPTokenizer(os.path.join(folder, 'vocab.json'), os.path.join(folder, 'merges.txt'), pad_token='<|endoftext|>')
+        config = transformers.CLIPTextConfig(vocab_size=len(vocab), hidden_size=256, intermediate_size=1024, num_hidden_layers=layers, num_attention_heads=4, max_position_embeddings=77, bos_token_id=0, eos_token_id=1, pad_token_id=1)
+        self.text_encoder = transformers.CLIPTextModel(config).eval()
+        self.device = devices.cpu
+
+    def encode_prompt(self, prompt, device=None, num_images_per_prompt=1, do_classifier_free_guidance=False): # pylint: disable=unused-argument
+        ids = self.tokenizer(prompt, padding='max_length', max_length=77, return_tensors='pt').input_ids
+        return (self.text_encoder(ids)[0], None)
+
+
+def run(pipe, prompts, cached):
+    t0 = time.perf_counter()
+    with torch.inference_mode():
+        for prompt in prompts:
+            if not cached:
+                pipe.embedding_providers = None
+                pipe.empty_embeds = None
+            prompt_parser_diffusers.get_weighted_text_embeddings(pipe, prompt, '', clip_skip=1)
+    return time.perf_counter() - t0
+
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    layers = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    torch.manual_seed(0)
+    shared.opts.prompt_cache = 0 # measure encode path only
+    shared.backend = shared.Backend.DIFFUSERS
+    with tempfile.TemporaryDirectory() as folder:
+        pipe = StableDiffusionBenchPipeline(folder, layers)
+        shared.sd_model = pipe
+        short = 'a photo of a cat sitting on a chair'
+        long = ', '.join([short] * 12) # longer than one chunk so padding with empty prompt is needed
+        prompts = [short, long] * repeats
+        run(pipe, prompts[:2], cached=False) # warmup
+        t_uncached = run(pipe, prompts, cached=False)
+        t_cached = run(pipe, prompts, cached=True)
+    print(f'prompt encode: prompts={len(prompts)} layers={layers} threads={torch.get_num_threads()}')
+    print(f'uncached: total={t_uncached:.3f} per-prompt={t_uncached / len(prompts) * 1000:.2f}ms')
+    print(f'cached: total={t_cached:.3f} per-prompt={t_cached / len(prompts) * 1000:.2f}ms')
+    print(f'speedup={t_uncached / max(t_cached, 1e-9):.2f}x')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+"""
+microbenchmark of prompt schedule and attention parsing: parsing on every call vs memoized results
+"""
+import os
+import sys
+import time
+from rich import print # pylint: disable=redefined-builtin
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from modules import prompt_parser # pylint: disable=wrong-import-position
+
+
+prompts = [
+    'fantasy landscape with a [mountain:lake:0.25] and [an oak:a christmas tree:0.75][ in foreground::0.6][ in background:0.25] [shoddy:masterful:0.5]',
+    'a (((house:1.3)) [on] a (hill:0.5), sun, (((sky))), [red|green|blue] flowers, [cat:dog:10] sitting on a (wooden:1.2) chair BREAK highly detailed, 8k',
+    '(masterpiece:1.2), best quality, [portrait|close-up] of a [young:old:0.3] woman, (freckles:0.8), [[soft]] light, [bokeh::0.8], film grain',
+]
+
+
+def parse(steps):
+    for schedule in prompt_parser.get_learned_conditioning_prompt_schedules(prompts, steps):
+        for _end_at_step, text in schedule:
+            prompt_parser.parse_prompt_attention(text)
+
+
+def run(repeats, steps, cached):
+    t0 = time.perf_counter()
+    for _i in range(repeats):
+        if not cached:
+            prompt_parser.get_schedule.cache_clear()
+            prompt_parser.parse_attention.cache_clear()
+        parse(steps)
+    return time.perf_counter() - t0
+
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    steps = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    parse(steps) # warmup
+    t_uncached = run(repeats, steps, cached=False)
+    t_cached = run(repeats, steps, cached=True)
+    print(f'prompt parse: prompts={len(prompts)} steps={steps} repeats={repeats}')
+    print(f'uncached: total={t_uncached:.3f} per-request={t_uncached / repeats * 1000:.2f}ms')
+    print(f'cached: total={t_cached:.3f} per-request={t_cached / repeats * 1000:.3f}ms')
+    print(f'speedup={t_uncached / max(t_cached, 1e-9):.1f}x schedules={prompt_parser.get_schedule.cache_info()} attention={prompt_parser.parse_attention.cache_info()}')
+
+
+if __name__ == "__main__":
+    main()
@@ -14,6 +14,9 @@ class ExtraNetworkLora(extra_networks.ExtraNetwork):
 
         """mapping of network names to the number of errors the network had during operation"""
 
+    def prefetch(self, params_list):
+        networks.prefetch_networks([params.positional[0] for params in params_list if len(params.positional) > 0])
+
     def activate(self, p, params_list):
         t0 = time.time()
         additional = shared.opts.sd_lora
@@ -77,7 +80,7 @@ class ExtraNetworkLora(extra_networks.ExtraNetwork):
             if networks.debug:
                 shared.log.debug("LoRA deactivate")
         if self.active and networks.debug:
-            shared.log.debug(f"LoRA end: load={networks.timer['load']:.2f} apply={networks.timer['apply']:.2f} restore={networks.timer['restore']:.2f}")
+            shared.log.debug(f"LoRA end: load={networks.timer['load']:.2f} apply={networks.timer['apply']:.2f} restore={networks.timer['restore']:.2f} batch={{collect={networks.timer['collect']:.2f} compute={networks.timer['compute']:.2f} fuse={networks.timer['fuse']:.2f}}} cache={{hits={networks.lora_cache.hits} misses={networks.lora_cache.misses} evictions={networks.lora_cache.evictions}}}")
         if self.errors:
             p.comment("Networks with errors: " + ", ".join(f"{k} ({v})" for k, v in self.errors.items()))
             for k, v in self.errors.items():
@@ -0,0 +1,105 @@
+import time
+import concurrent.futures
+import torch
+import network_lora
+from modules import shared, devices
+
+
+max_batch_elements = 64 * 1024 * 1024 # limit size of single batched matmul output
+
+
+def enabled():
+    if not shared.opts.lora_batch_apply:
+        return False
+    if shared.cmd_opts.lowvram or shared.cmd_opts.medvram or shared.opts.diffusers_model_cpu_offload or shared.opts.diffusers_seq_cpu_offload:
+        return False # weights are moved by offload hooks so they are applied lazily during forward instead
+    return True
+
+
+def collect(loaded_networks):
+    """
+    collect layers whose applied networks differ from wanted set
+    and lora modules for those layers that can be calculated together in batched matmul
+    """
+    import networks
+    wanted_names = tuple((x.name, x.te_multiplier, x.unet_multiplier, x.dyn_dim) for x in loaded_networks)
+    layers = {}
+    groups = {}
+    for net in loaded_networks:
+        for module in net.modules.values():
+            layer = module.sd_module
+            layer_name = getattr(layer, 'network_layer_name', None)
+            weight = getattr(layer, 'weight', None)
+            if layer_name is None or weight is None or getattr(layer, 'network_current_names', ()) == wanted_names:
+                continue
+            layers[id(layer)] = layer
+            if type(module) is not network_lora.NetworkModuleLora or module.mid_model is not None or module.bias is not None or isinstance(layer, torch.nn.MultiheadAttention):
+                continue # calculated individually during apply
+            key = networks.delta_key(net) + (layer_name,)
+            if key in networks.delta_cache.items:
+                continue
+            up = module.up_model.weight
+            down = module.down_model.weight
+            up = up.reshape(up.size(0), -1)
+            down = down.reshape(down.size(0), -1)
+            if net.dyn_dim is not None:
+                up = up[:, :net.dyn_dim]
+                down = down[:net.dyn_dim, :]
+            group = (tuple(up.shape), tuple(down.shape), weight.device, weight.dtype)
+            groups.setdefault(group, []).append((key, module, weight, up, down))
+    return list(layers.values()), groups
+
+
+def compute(group, items):
+    """calculate deltas for lora modules with same shapes using single transfer and batched matmul per chunk"""
+    _up_shape, _down_shape, device, dtype = group
+    results = {}
+    chunk = max(1, max_batch_elements // (group[0][0] * group[1][1]))
+    for i in range(0, len(items), chunk):
+        batch = items[i:i + chunk]
+        ups = torch.stack([item[3] for item in batch]).to(device, dtype=dtype)
+        downs = torch.stack([item[4] for item in batch]).to(device, dtype=dtype)
+        updowns = torch.bmm(ups, downs)
+        for (key, module, weight, _up, _down), updown in zip(batch, updowns):
+            output_shape = [module.up_model.weight.size(0), module.down_model.weight.size(1)]
+            if len(module.down_model.weight.shape) == 4:
+                output_shape += module.down_model.weight.shape[2:]
+            results[key] = module.finalize_updown(updown.reshape(output_shape), weight, output_shape)
+    return results
+
+
+def apply(loaded_networks, timer):
+    """
+    apply wanted networks to all affected layers at once instead of lazily in each layer forward
+    deltas of plain lora modules are grouped by shape and device and calculated in batches, cpu groups run in parallel threads
+    """
+    import networks
+    t0 = time.time()
+    layers, groups = collect(loaded_networks)
+    t1 = time.time()
+    with devices.inference_context():
+        cpu_groups = [(group, items) for group, items in groups.items() if group[2].type == 'cpu']
+        if len(cpu_groups) > 1:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=shared.max_workers) as executor:
+                for results in executor.map(lambda x: compute(*x), cpu_groups):
+                    networks.precomputed_deltas.update(results)
+        else:
+            for group, items in cpu_groups:
+                networks.precomputed_deltas.update(compute(group, items))
+        for group, items in groups.items():
+            if group[2].type != 'cpu':
+                networks.precomputed_deltas.update(compute(group, items))
+    t2 = time.time()
+    if networks.checkpoint_restore.enabled():
+        networks.checkpoint_restore.prefetch([layer for layer in layers if getattr(layer, 'network_applied', None) is None or shared.opts.lora_delta_cache == 0])
+    for layer in layers:
+        networks.network_apply_weights(layer)
+    networks.precomputed_deltas.clear()
+    networks.checkpoint_restore.pending.clear()
+    t3 = time.time()
+    timer['collect'] += t1 - t0
+    timer['compute'] += t2 - t1
+    timer['fuse'] += t3 - t2
+    if networks.debug:
+        shared.log.debug(f'LoRA batch apply: layers={len(layers)} groups={len(groups)} modules={sum(len(x) for x in groups.values())} collect={t1 - t0:.2f} compute={t2 - t1:.2f} fuse={t3 - t2:.2f}')
+
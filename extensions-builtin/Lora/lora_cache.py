@@ -0,0 +1,170 @@
+from collections import OrderedDict
+import torch
+import network
+from modules import shared
+
+
+skip_attrs = ['sd_module', 'org_module', 'network'] # references to model layers, not owned by network
+
+
+def tensor_size(item) -> int:
+    if isinstance(item, torch.Tensor):
+        return item.numel() * item.element_size()
+    if isinstance(item, torch.nn.Module):
+        return sum(p.numel() * p.element_size() for p in item.parameters()) + sum(b.numel() * b.element_size() for b in item.buffers())
+    return 0
+
+
+def network_size(net: network.Network) -> int:
+    size = 0
+    for module in net.modules.values():
+        for k, v in vars(module).items():
+            if k not in skip_attrs:
+                size += tensor_size(v)
+    return size
+
+
+class LoraCache:
+    """
+    LRU cache of parsed networks limited by number of entries and total tensor size
+    pinned networks are never evicted
+    """
+    def __init__(self):
+        self.items: OrderedDict[str, network.Network] = OrderedDict()
+        self.sizes = {}
+        self.pinned = set()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __contains__(self, name):
+        return name in self.items
+
+    def get(self, name, default=None):
+        net = self.items.get(name, None)
+        if net is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self.items.move_to_end(name)
+        return net
+
+    def put(self, name, net: network.Network):
+        self.items[name] = net
+        self.items.move_to_end(name)
+        self.sizes[name] = network_size(net)
+
+    def pop(self, name, default=None):
+        self.sizes.pop(name, None)
+        return self.items.pop(name, default)
+
+    def clear(self):
+        self.items.clear()
+        self.sizes.clear()
+
+    def pin(self, name):
+        self.pinned.add(name)
+
+    def unpin(self, name):
+        self.pinned.discard(name)
+
+    def is_pinned(self, name):
+        return name in self.pinned or name in self.opts_pinned()
+
+    def opts_pinned(self):
+        return [x.strip() for x in shared.opts.lora_cache_pinned.split(',') if len(x.strip()) > 0]
+
+    def total_size(self):
+        return sum(self.sizes.values())
+
+    def over_limit(self):
+        unpinned = [name for name in self.items if not self.is_pinned(name)]
+        if len(unpinned) > shared.opts.lora_in_memory_limit:
+            return True
+        budget = shared.opts.lora_cache_budget * 1024 * 1024
+        return budget > 0 and len(unpinned) > 0 and self.total_size() > budget
+
+    def trim(self) -> int:
+        """evict least recently used unpinned networks until cache fits count and memory limits, returns number of evicted networks"""
+        evicted = 0
+        while self.over_limit():
+            name = next(name for name in self.items if not self.is_pinned(name)) # oldest first
+            self.pop(name)
+            evicted += 1
+        self.evictions += evicted
+        return evicted
+
+    def stats(self):
+        return {
+            'items': len(self.items),
+            'size': round(self.total_size() / 1024 / 1024, 2),
+            'budget': shared.opts.lora_cache_budget,
+            'limit': shared.opts.lora_in_memory_limit,
+            'pinned': [name for name in self.items if self.is_pinned(name)],
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'networks': {name: round(self.sizes.get(name, 0) / 1024 / 1024, 2) for name in self.items},
+        }
+
+
+class DeltaCache:
+    """
+    LRU cache of calculated per-layer weight deltas limited by total tensor size
+    each entry is stored together with multiplier it was calculated with so it can be rescaled at apply time
+    """
+    def __init__(self):
+        self.items = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.items)
+
+    def budget(self):
+        return shared.opts.lora_delta_cache * 1024 * 1024
+
+    def get(self, key):
+        item = self.items.get(key, None)
+        if item is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.items.move_to_end(key)
+        return item
+
+    def put(self, key, updown, ex_bias, multiplier):
+        size = tensor_size(updown) + tensor_size(ex_bias)
+        if size > self.budget():
+            return
+        self.pop(key)
+        self.items[key] = (updown, ex_bias, multiplier)
+        self.size += size
+        while self.size > self.budget():
+            self.pop(next(iter(self.items)))
+
+    def pop(self, key):
+        item = self.items.pop(key, None)
+        if item is not None:
+            self.size -= tensor_size(item[0]) + tensor_size(item[1])
+        return item
+
+    def clear(self):
+        self.items.clear()
+        self.size = 0
+
+    def stats(self):
+        return {
+            'items': len(self.items),
+            'size': round(self.size / 1024 / 1024, 2),
+            'budget': shared.opts.lora_delta_cache,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
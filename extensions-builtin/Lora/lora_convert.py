@@ -1,5 +1,6 @@
 import os
 import re
+import time
 import bisect
 from typing import Dict
 from modules import shared
@@ -20,6 +21,9 @@ suffix_conversion = {
 re_digits = re.compile(r"\d+")
 re_x_proj = re.compile(r"(.*)_([qkv]_proj)$")
 re_compiled = {}
+unet_conversion_map = None
+unet_conversion_keys = None
+conversion_tables = {} # per model type map of network keys to model layer names
 
 
 def make_unet_conversion_map() -> Dict[str, str]:
@@ -104,22 +108,65 @@ def make_unet_conversion_map() -> Dict[str, str]:
     return sd_hf_conversion_map
 
 
+def get_unet_conversion_map():
+    global unet_conversion_map, unet_conversion_keys # pylint: disable=global-statement
+    if unet_conversion_map is None:
+        unet_conversion_map = make_unet_conversion_map()
+        unet_conversion_keys = sorted(unet_conversion_map.keys()) # prefix of U-Net modules
+    return unet_conversion_map, unet_conversion_keys
+
+
+def build_conversion_table(mapping, is_sdxl: bool):
+    """
+    precompute map of network keys to model layer names: each layer maps to itself
+    and for sdxl diffusers also from its compvis-style name so most keys resolve with a single lookup
+    segmoe experts are not precomputed and resolved by converter instead
+    """
+    table = {}
+    conversion_map, _keys = get_unet_conversion_map()
+    hf_to_sd = {hf: sd for sd, hf in conversion_map.items()}
+    for layer in mapping.keys():
+        if '_experts_' in layer or f'{layer}_experts_0' in mapping:
+            continue
+        table[layer] = [layer]
+        if is_sdxl and layer.startswith("lora_unet_"):
+            name = layer[len("lora_unet_"):]
+            for i, c in enumerate(name):
+                if c != '_':
+                    continue
+                sd = hf_to_sd.get(name[:i], None)
+                if sd is not None:
+                    table.setdefault(f"lora_unet_{sd}{name[i:]}", [layer])
+            if name in hf_to_sd:
+                table.setdefault(f"lora_unet_{hf_to_sd[name]}", [layer])
+    return table
+
+
 class KeyConvert:
     def __init__(self):
+        mapping = shared.sd_model.network_layer_mapping
         if shared.backend == shared.Backend.ORIGINAL:
             self.converter = self.original
-            self.is_sd2 = 'model_transformer_resblocks' in shared.sd_model.network_layer_mapping
-
+            self.is_sd2 = 'model_transformer_resblocks' in mapping
+            model_type = ('original', shared.sd_model_type, self.is_sd2, len(mapping))
         else:
             self.converter = self.diffusers
             self.is_sdxl = True if shared.sd_model_type == "sdxl" else False
-            self.UNET_CONVERSION_MAP = make_unet_conversion_map() if self.is_sdxl else None
+            self.UNET_CONVERSION_MAP, self.UNET_CONVERSION_KEYS = get_unet_conversion_map() if self.is_sdxl else (None, None)
             self.LORA_PREFIX_UNET = "lora_unet_"
             self.LORA_PREFIX_TEXT_ENCODER = "lora_te_"
             self.OFT_PREFIX_UNET = "oft_unet_"
             # SDXL: must starts with LORA_PREFIX_TEXT_ENCODER
             self.LORA_PREFIX_TEXT_ENCODER1 = "lora_te1_"
             self.LORA_PREFIX_TEXT_ENCODER2 = "lora_te2_"
+            model_type = ('diffusers', shared.sd_model_type, self.is_sdxl, len(mapping))
+        self.table = conversion_tables.get(model_type, None)
+        if self.table is None:
+            t0 = time.time()
+            self.table = build_conversion_table(mapping, is_sdxl=model_type[2] and model_type[0] == 'diffusers')
+            conversion_tables[model_type] = self.table
+            if debug:
+                shared.log.debug(f'LoRA conversion table: type={model_type} keys={len(self.table)} time={time.time() - t0:.2f}')
 
     def original(self, key):
         key = convert_diffusers_name_to_compvis(key, self.is_sd2)
@@ -165,8 +212,7 @@ class KeyConvert:
 
     def diffusers(self, key):
         if self.is_sdxl:
-            map_keys = list(self.UNET_CONVERSION_MAP.keys())  # prefix of U-Net modules
-            map_keys.sort()
+            map_keys = self.UNET_CONVERSION_KEYS
             search_key = key.replace(self.LORA_PREFIX_UNET, "").replace(self.OFT_PREFIX_UNET, "").replace(self.LORA_PREFIX_TEXT_ENCODER1, "").replace(self.LORA_PREFIX_TEXT_ENCODER2, "")
             position = bisect.bisect_right(map_keys, search_key)
             map_key = map_keys[position - 1]
@@ -199,7 +245,13 @@ class KeyConvert:
         return key, sd_module
 
     def __call__(self, key):
-        return self.converter(key)
+        keys = self.table.get(key, None) # precomputed or previously resolved
+        if keys is not None:
+            mapping = shared.sd_model.network_layer_mapping
+            return keys, [mapping.get(k, None) for k in keys]
+        keys, sd_modules = self.converter(key)
+        self.table[key] = keys
+        return keys, sd_modules
 
 
 def convert_diffusers_name_to_compvis(key, is_sd2):
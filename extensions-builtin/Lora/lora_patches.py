@@ -30,9 +30,8 @@ class LoraPatches:
         self.LayerNorm_load_state_dict = patches.patch(__name__, torch.nn.LayerNorm, '_load_from_state_dict', networks.network_LayerNorm_load_state_dict)
         self.MultiheadAttention_forward = patches.patch(__name__, torch.nn.MultiheadAttention, 'forward', networks.network_MultiheadAttention_forward)
         self.MultiheadAttention_load_state_dict = patches.patch(__name__, torch.nn.MultiheadAttention, '_load_from_state_dict', networks.network_MultiheadAttention_load_state_dict)
-        networks.timer['load'] = 0
-        networks.timer['apply'] = 0
-        networks.timer['restore'] = 0
+        for k in networks.timer:
+            networks.timer[k] = 0
         self.active = True
 
     def undo(self):
@@ -0,0 +1,138 @@
+import os
+import time
+import concurrent.futures
+import torch
+import safetensors
+from modules import shared
+
+
+class CheckpointRestore:
+    """
+    restores original layer weights by reading them from memory-mapped base model safetensors instead of keeping host copies
+    layers which cannot be found in checkpoint with matching shapes fall back to regular weights backup
+    """
+    def __init__(self):
+        self.path = None
+        self.handles = {} # component -> list of safe_open handles
+        self.index = {} # component -> {key: handle}
+        self.layers = {} # network_layer_name -> (handle, weight_key, bias_key) or None if layer cannot be restored from checkpoint
+        self.pending = {} # network_layer_name -> (weight, bias) read in advance
+        self.reads = 0
+        self.fallbacks = 0
+        self.time = 0
+
+    def reset(self, sd_model=None): # pylint: disable=unused-argument
+        self.path = None
+        self.handles.clear()
+        self.index.clear()
+        self.layers.clear()
+        self.pending.clear()
+
+    def enabled(self):
+        return shared.opts.lora_restore_mode == 'checkpoint'
+
+    def checkpoint_path(self):
+        checkpoint_info = getattr(shared.sd_model, 'sd_checkpoint_info', None)
+        return getattr(checkpoint_info, 'path', None)
+
+    def open(self, component):
+        path = self.checkpoint_path()
+        if path != self.path:
+            self.reset()
+            self.path = path
+        if component in self.index:
+            return self.index[component]
+        self.index[component] = {}
+        self.handles[component] = []
+        if path is None:
+            return self.index[component]
+        if os.path.isfile(path) and component == '' and path.lower().endswith('.safetensors'):
+            files = [path]
+        elif os.path.isdir(path) and component != '':
+            folder = os.path.join(path, component)
+            files = [os.path.join(folder, f) for f in sorted(os.listdir(folder)) if f.endswith('.safetensors')] if os.path.isdir(folder) else []
+        else:
+            files = []
+        for fn in files:
+            try:
+                handle = safetensors.safe_open(fn, framework="pt", device="cpu")
+                self.handles[component].append(handle)
+                for key in handle.keys():
+                    self.index[component].setdefault(key, handle) # with multiple variants present first one wins
+            except Exception as e:
+                shared.log.error(f'LoRA restore: file="{fn}" {e}')
+        if len(files) > 0:
+            shared.log.debug(f'LoRA restore: checkpoint="{path}" component="{component}" files={len(files)} tensors={len(self.index[component])}')
+        return self.index[component]
+
+    def lookup(self, layer):
+        """find checkpoint tensors for layer and verify their shapes, result is cached per layer name"""
+        layer_name = getattr(layer, 'network_layer_name', None)
+        if layer_name in self.layers:
+            return self.layers[layer_name]
+        self.layers[layer_name] = None
+        checkpoint_key = getattr(layer, 'network_checkpoint_key', None)
+        if checkpoint_key is None or isinstance(layer, torch.nn.MultiheadAttention) or getattr(layer, 'weight', None) is None:
+            return None
+        component, _sep, name = checkpoint_key.rpartition('/')
+        index = self.open(component)
+        weight_key = f'{name}.weight'
+        bias_key = f'{name}.bias' if getattr(layer, 'bias', None) is not None else None
+        handle = index.get(weight_key, None)
+        if handle is None or (bias_key is not None and index.get(bias_key, None) is not handle):
+            return None
+        if list(handle.get_slice(weight_key).get_shape()) != list(layer.weight.shape):
+            return None
+        if bias_key is not None and list(handle.get_slice(bias_key).get_shape()) != list(layer.bias.shape):
+            return None
+        self.layers[layer_name] = (handle, weight_key, bias_key)
+        return self.layers[layer_name]
+
+    def available(self, layer):
+        return self.enabled() and self.lookup(layer) is not None
+
+    def read(self, layer):
+        layer_name = getattr(layer, 'network_layer_name', None)
+        if layer_name in self.pending:
+            return self.pending.pop(layer_name)
+        handle, weight_key, bias_key = self.layers[layer_name]
+        weight = handle.get_tensor(weight_key)
+        bias = handle.get_tensor(bias_key) if bias_key is not None else None
+        return weight, bias
+
+    def prefetch(self, layers):
+        """read original tensors for multiple layers in parallel so restore during apply does not wait on disk"""
+        layers = [layer for layer in layers if getattr(layer, 'network_current_names', ()) != () and self.available(layer)]
+        if len(layers) < 2:
+            return
+        t0 = time.time()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=shared.max_workers) as executor:
+            for layer, tensors in zip(layers, executor.map(self.read, layers)):
+                self.pending[layer.network_layer_name] = tensors
+        self.time += time.time() - t0
+
+    def restore(self, layer) -> bool:
+        """copy original weights into layer, returns False if layer must be restored from backup instead"""
+        if self.lookup(layer) is None: # not checking enabled so layers modified before mode change can still be restored
+            self.fallbacks += 1
+            return False
+        t0 = time.time()
+        weight, bias = self.read(layer)
+        layer.weight.copy_(weight)
+        if bias is not None:
+            layer.bias.copy_(bias)
+        else:
+            layer.bias = None # bias could be created by network
+        self.reads += 1
+        self.time += time.time() - t0
+        return True
+
+    def stats(self):
+        return {
+            'mode': shared.opts.lora_restore_mode,
+            'checkpoint': self.path,
+            'layers': len([x for x in self.layers.values() if x is not None]),
+            'reads': self.reads,
+            'fallbacks': self.fallbacks,
+            'time': round(self.time, 2),
+        }
@@ -14,6 +14,7 @@ class NetworkModuleIa3(network.NetworkModule):
         super().__init__(net, weights)
         self.w = weights.w["weight"]
         self.on_input = weights.w["on_input"].item()
+        self.static_updown = False
 
     def calc_updown(self, target):
         w = self.w.to(target.device, dtype=target.dtype)
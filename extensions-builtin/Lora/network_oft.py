@@ -22,6 +22,7 @@ class NetworkModuleOFT(network.NetworkModule):
         self.org_module: list[torch.Module] = [self.sd_module]
 
         self.scale = 1.0
+        self.static_updown = False
 
         # kohya-ss
         if "oft_blocks" in weights.w.keys():
@@ -2,7 +2,9 @@ from typing import Union, List
 import os
 import re
 import time
-import concurrent
+import threading
+import concurrent.futures
+from collections import deque
 import lora_patches
 import network
 import network_lora
@@ -14,7 +16,11 @@ import network_full
 import network_norm
 import network_glora
 import lora_convert
+import lora_batch
+from lora_cache import LoraCache, DeltaCache, network_size
+from lora_restore import CheckpointRestore
 import torch
+import safetensors
 import diffusers.models.lora
 from modules import shared, devices, sd_models, sd_models_compile, errors, scripts, files_cache
 
@@ -25,10 +31,20 @@ extra_network_lora = None
 available_networks = {}
 available_network_aliases = {}
 loaded_networks: List[network.Network] = []
-timer = { 'load': 0, 'apply': 0, 'restore': 0 }
+timer = { 'load': 0, 'apply': 0, 'restore': 0, 'collect': 0, 'compute': 0, 'fuse': 0 }
 # networks_in_memory = {}
-lora_cache = {}
+lora_cache = LoraCache()
+delta_cache = DeltaCache()
+precomputed_deltas = {} # deltas calculated ahead of apply by batched fusion
+checkpoint_restore = CheckpointRestore()
+lora_mode = 'fuse' # effective apply mode: fuse deltas into weights or run low-rank projections at runtime
+mode_history = deque(maxlen=8) # recently requested network sets used to select mode automatically
 available_network_hash_lookup = {}
+prefetch_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='lora-prefetch')
+prefetched = {} # name: (model id, future) of networks being loaded ahead of request
+prefetch_lock = threading.Lock() # prefetch runs from api and ui threads while prefetched networks complete on executor thread
+prefetch_stats = { 'submitted': 0, 'hits': 0, 'misses': 0, 'discarded': 0 }
+max_prefetched = 8
 forbidden_network_aliases = {}
 re_network_name = re.compile(r"(.*)\s*\([0-9a-fA-F]+\)")
 module_types = [
@@ -54,15 +70,18 @@ def assign_network_names_to_compvis_modules(sd_model):
             network_name = prefix + name.replace(".", "_")
             network_layer_mapping[network_name] = module
             module.network_layer_name = network_name
+            module.network_checkpoint_key = "text_encoder/" + name
         if shared.sd_model_type == "sdxl":
             for name, module in shared.sd_model.text_encoder_2.named_modules():
                 network_name = "lora_te2_" + name.replace(".", "_")
                 network_layer_mapping[network_name] = module
                 module.network_layer_name = network_name
+                module.network_checkpoint_key = "text_encoder_2/" + name
         for name, module in shared.sd_model.unet.named_modules():
             network_name = "lora_unet_" + name.replace(".", "_")
             network_layer_mapping[network_name] = module
             module.network_layer_name = network_name
+            module.network_checkpoint_key = "unet/" + name
     else:
         if not hasattr(shared.sd_model, 'cond_stage_model'):
             return
@@ -70,10 +89,12 @@ def assign_network_names_to_compvis_modules(sd_model):
             network_name = name.replace(".", "_")
             network_layer_mapping[network_name] = module
             module.network_layer_name = network_name
+            module.network_checkpoint_key = "cond_stage_model." + name
         for name, module in shared.sd_model.model.named_modules():
             network_name = name.replace(".", "_")
             network_layer_mapping[network_name] = module
             module.network_layer_name = network_name
+            module.network_checkpoint_key = "model." + name
     sd_model.network_layer_mapping = network_layer_mapping
 
 
@@ -91,41 +112,52 @@ def load_diffusers(name, network_on_disk, lora_scale=1.0) -> network.Network:
         shared.sd_model.fuse_lora(lora_scale=lora_scale)
     net = network.Network(name, network_on_disk)
     net.mtime = os.path.getmtime(network_on_disk.filename)
-    lora_cache[name] = net
+    lora_cache.put(name, net)
     t1 = time.time()
     timer['load'] += t1 - t0
     return net
 
 
-def load_network(name, network_on_disk) -> network.Network:
-    t0 = time.time()
-    cached = lora_cache.get(name, None)
-    if debug:
-        shared.log.debug(f'LoRA load: name="{name}" file="{network_on_disk.filename}" type=lora {"cached" if cached else ""}')
-    if cached is not None:
-        return cached
+def parse_key(key_network):
+    parts = key_network.split('.')
+    if len(parts) > 5: # messy handler for diffusers peft lora
+        key_network_without_network_parts = '_'.join(parts[:-2])
+        if not key_network_without_network_parts.startswith('lora_'):
+            key_network_without_network_parts = 'lora_' + key_network_without_network_parts
+        network_part = '.'.join(parts[-2:]).replace('lora_A', 'lora_down').replace('lora_B', 'lora_up')
+    else:
+        key_network_without_network_parts, network_part = key_network.split(".", 1)
+    return key_network_without_network_parts, network_part
+
+
+def cast_weight(weight: torch.Tensor):
+    if weight.is_floating_point() and weight.dim() > 0: # keep scalars such as alpha in original precision
+        return weight.to(dtype=devices.dtype)
+    return weight
+
+
+def create_network(name, network_on_disk) -> network.Network:
     net = network.Network(name, network_on_disk)
     net.mtime = os.path.getmtime(network_on_disk.filename)
-    sd = sd_models.read_state_dict(network_on_disk.filename)
+    if network_on_disk.is_safetensors: # lazy memory-mapped access so only matched tensors are read
+        f = safetensors.safe_open(network_on_disk.filename, framework="pt", device="cpu")
+        network_keys, get_tensor = list(f.keys()), f.get_tensor
+    else:
+        sd = sd_models.read_state_dict(network_on_disk.filename)
+        network_keys, get_tensor = list(sd.keys()), sd.get
     assign_network_names_to_compvis_modules(shared.sd_model) # this should not be needed but is here as an emergency fix for an unknown error people are experiencing in 1.2.0
     keys_failed_to_match = {}
     matched_networks = {}
     convert = lora_convert.KeyConvert()
-    for key_network, weight in sd.items():
-        parts = key_network.split('.')
-        if len(parts) > 5: # messy handler for diffusers peft lora
-            key_network_without_network_parts = '_'.join(parts[:-2])
-            if not key_network_without_network_parts.startswith('lora_'):
-                key_network_without_network_parts = 'lora_' + key_network_without_network_parts
-            network_part = '.'.join(parts[-2:]).replace('lora_A', 'lora_down').replace('lora_B', 'lora_up')
-        else:
-            key_network_without_network_parts, network_part = key_network.split(".", 1)
+    for key_network in network_keys:
+        key_network_without_network_parts, network_part = parse_key(key_network)
         # if debug:
         #     shared.log.debug(f'LoRA load: name="{name}" full={key_network} network={network_part} key={key_network_without_network_parts}')
         key, sd_module = convert(key_network_without_network_parts)  # Now returns lists
         if sd_module[0] is None:
             keys_failed_to_match[key_network] = key
             continue
+        weight = cast_weight(get_tensor(key_network))
         for k, module in zip(key, sd_module):
             if k not in matched_networks:
                 matched_networks[k] = network.NetworkWeights(network_key=key_network, sd_key=k, w={}, sd_module=module)
@@ -146,12 +178,92 @@ def load_network(name, network_on_disk) -> network.Network:
             shared.log.debug(f"LoRA file={network_on_disk.filename} unmatched={keys_failed_to_match}")
     elif debug:
         shared.log.debug(f"LoRA file={network_on_disk.filename} unmatched={len(keys_failed_to_match)} matched={len(matched_networks)}")
-    lora_cache[name] = net
+    return net
+
+
+def load_network(name, network_on_disk) -> network.Network:
+    t0 = time.time()
+    cached = lora_cache.get(name, None)
+    if debug:
+        shared.log.debug(f'LoRA load: name="{name}" file="{network_on_disk.filename}" type=lora {"cached" if cached else ""}')
+    if cached is not None:
+        return cached
+    net = load_prefetched(name)
+    if net is None:
+        net = create_network(name, network_on_disk)
+    lora_cache.put(name, net)
     t1 = time.time()
     timer['load'] += t1 - t0
     return net
 
 
+def current_model_id():
+    model = sd_models.model_data.sd_model
+    return id(model) if model is not None and hasattr(model, 'network_layer_mapping') else None
+
+
+def prefetch_networks(names):
+    """
+    Start loading networks mentioned in a queued request on a background thread so that
+    file reads, key mapping and module creation are done before request acquires the queue lock.
+    """
+    model_id = current_model_id()
+    if model_id is None or shared.opts.lora_force_diffusers or not shared.opts.lora_prefetch:
+        return
+    for name in names:
+        network_on_disk = available_network_aliases.get(name, None)
+        if network_on_disk is None or name in lora_cache:
+            continue
+        with prefetch_lock:
+            if name in prefetched:
+                continue
+            trim_prefetched(reserve=1)
+            if debug:
+                shared.log.debug(f'LoRA prefetch: name="{name}" file="{network_on_disk.filename}"')
+            future = prefetch_executor.submit(create_network, name, network_on_disk)
+            prefetched[name] = (model_id, future)
+            prefetch_stats['submitted'] += 1
+        future.add_done_callback(prefetch_done) # outside of lock since callback runs immediately if future is already done
+
+
+def prefetched_size():
+    return sum(network_size(future.result()) for _model_id, future in prefetched.values() if future.done() and not future.cancelled() and future.exception() is None)
+
+
+def trim_prefetched(reserve=0):
+    """drop oldest unused prefetched networks while over count limit or while loaded ones do not fit lora cache budget, caller must hold prefetch_lock"""
+    budget = shared.opts.lora_cache_budget * 1024 * 1024
+    while len(prefetched) > 0 and (len(prefetched) + reserve > max_prefetched or (budget > 0 and lora_cache.total_size() + prefetched_size() > budget)):
+        _model_id, future = prefetched.pop(next(iter(prefetched)))
+        future.cancel() # no-op if already running or done
+        prefetch_stats['discarded'] += 1
+
+
+def prefetch_done(_future):
+    with prefetch_lock:
+        trim_prefetched()
+
+
+def load_prefetched(name) -> network.Network:
+    with prefetch_lock:
+        item = prefetched.pop(name, None)
+    if item is None:
+        prefetch_stats['misses'] += 1
+        return None
+    model_id, future = item
+    if model_id != current_model_id(): # model changed since prefetch so modules would point to wrong layers
+        prefetch_stats['discarded'] += 1
+        return None
+    try:
+        net = future.result()
+    except Exception as e:
+        shared.log.warning(f'LoRA prefetch failed: name="{name}" {e}')
+        prefetch_stats['discarded'] += 1
+        return None
+    prefetch_stats['hits'] += 1
+    return net
+
+
 def load_networks(names, te_multipliers=None, unet_multipliers=None, dyn_dims=None):
     networks_on_disk = [available_network_aliases.get(name, None) for name in names]
     if any(x is None for x in networks_on_disk):
@@ -216,11 +328,12 @@ def load_networks(names, te_multipliers=None, unet_multipliers=None, dyn_dims=No
         net.dyn_dim = dyn_dims[i] if dyn_dims else 1.0
         loaded_networks.append(net)
 
-    while len(lora_cache) > shared.opts.lora_in_memory_limit:
-        name = next(iter(lora_cache))
-        lora_cache.pop(name, None)
+    lora_cache.trim()
+    select_mode()
+    if lora_mode == 'fuse' and len(loaded_networks) > 0 and lora_batch.enabled() and not (shared.opts.lora_force_diffusers and shared.backend == shared.Backend.DIFFUSERS):
+        lora_batch.apply(loaded_networks, timer)
     if len(loaded_networks) > 0 and debug:
-        shared.log.debug(f'LoRA loaded={len(loaded_networks)} cache={list(lora_cache)}')
+        shared.log.debug(f'LoRA loaded={len(loaded_networks)} cache={list(lora_cache)} size={lora_cache.total_size() / 1024 / 1024:.2f}MB')
     devices.torch_gc()
 
     if recompile_model:
@@ -230,11 +343,67 @@ def load_networks(names, te_multipliers=None, unet_multipliers=None, dyn_dims=No
         shared.compiled_model_state.lora_model = backup_lora_model
 
 
+def runtime_supported():
+    """runtime forward only implements plain up/down projection, anything else calc_updown handles must be fused"""
+    for net in loaded_networks:
+        if net.dyn_dim not in (None, 1.0):
+            return False
+        for module in net.modules.values():
+            if type(module).forward is network.NetworkModule.forward or isinstance(module.sd_module, torch.nn.MultiheadAttention):
+                return False
+            if getattr(module, 'mid_model', None) is not None or getattr(module, 'bias', None) is not None:
+                return False
+            weight = getattr(module.sd_module, 'weight', None)
+            if weight is not None and len(weight.shape) == 4 and weight.shape[1] == 9: # inpaint models require zero padded updown
+                return False
+    return True
+
+
+def backup_size():
+    layers = {}
+    for net in loaded_networks:
+        for module in net.modules.values():
+            weight = getattr(module.sd_module, 'weight', None)
+            if weight is not None:
+                layers[id(module.sd_module)] = weight.numel() * weight.element_size()
+    return sum(layers.values())
+
+
+def select_mode():
+    """
+    Selects between fusing network weights into model and applying them at runtime during forward.
+    Fusing is faster per step but requires weights backup and restore on every change of networks,
+    so in auto mode runtime is selected when set of networks changes frequently between requests.
+    """
+    global lora_mode # pylint: disable=global-statement
+    wanted_names = tuple((x.name, x.te_multiplier, str(x.unet_multiplier), x.dyn_dim) for x in loaded_networks)
+    changes = sum(1 for a, b in zip(mode_history, list(mode_history)[1:] + [wanted_names]) if a != b)
+    change_rate = changes / len(mode_history) if len(mode_history) > 0 else 0
+    if len(loaded_networks) == 0: # requests without networks do not require restore so they do not count as change
+        return
+    mode_history.append(wanted_names)
+    mode = 'runtime' if shared.opts.lora_functional else shared.opts.lora_apply_mode
+    if mode == 'auto':
+        mode = 'runtime' if change_rate >= 0.5 else 'fuse'
+    if mode == 'runtime' and not runtime_supported():
+        if shared.opts.lora_apply_mode == 'runtime':
+            shared.log.warning('LoRA runtime mode not supported by loaded networks: using fuse')
+        mode = 'fuse'
+    size = backup_size() / 1024 / 1024
+    if mode != lora_mode:
+        shared.log.info(f'LoRA mode: {mode} changes={change_rate:.2f} {"backup-saved" if mode == "runtime" else "backup"}={size:.2f}MB')
+    elif debug:
+        shared.log.debug(f'LoRA mode: {mode} changes={change_rate:.2f} backup={size:.2f}MB')
+    lora_mode = mode
+
+
 def network_restore_weights_from_backup(self: Union[torch.nn.Conv2d, torch.nn.Linear, torch.nn.GroupNorm, torch.nn.LayerNorm, torch.nn.MultiheadAttention, diffusers.models.lora.LoRACompatibleLinear, diffusers.models.lora.LoRACompatibleConv]):
     t0 = time.time()
     weights_backup = getattr(self, "network_weights_backup", None)
     bias_backup = getattr(self, "network_bias_backup", None)
     if weights_backup is None and bias_backup is None:
+        if getattr(self, "network_current_names", ()) != () and checkpoint_restore.restore(self): # pylint: disable=C1803
+            timer['restore'] += time.time() - t0
         return
     # if debug:
     #     shared.log.debug('LoRA restore weights')
@@ -258,11 +427,111 @@ def network_restore_weights_from_backup(self: Union[torch.nn.Conv2d, torch.nn.Li
     timer['restore'] += t1 - t0
 
 
+def delta_key(net: network.Network):
+    return (net.name, net.mtime, net.dyn_dim)
+
+
+def clear_delta_cache(sd_model): # pylint: disable=unused-argument
+    delta_cache.clear()
+
+
+def te_state():
+    """state of loaded networks that affects text encoder outputs, used to invalidate cached prompt embeddings"""
+    return tuple((net.name, net.mtime, net.te_multiplier, net.dyn_dim) for net in loaded_networks)
+
+
+def network_calc_updown(self, net: network.Network, module: network.NetworkModule):
+    """
+    Calculates weight delta of network module for torch layer self.
+    Static deltas are cached per network and layer and rescaled to current multiplier on reuse.
+    """
+    key = delta_key(net) + (self.network_layer_name,)
+    multiplier = module.multiplier()
+    cached = delta_cache.get(key) if module.static_updown and shared.opts.lora_delta_cache > 0 else None
+    if cached is not None:
+        updown, ex_bias, cached_multiplier = cached
+        updown = updown.to(self.weight.device, dtype=self.weight.dtype)
+        ex_bias = ex_bias.to(self.weight.device, dtype=self.weight.dtype) if ex_bias is not None else None
+        if cached_multiplier == multiplier:
+            return updown, ex_bias
+        if cached_multiplier != 0:
+            scale = multiplier / cached_multiplier
+            return updown * scale, (ex_bias * scale if ex_bias is not None else None)
+    precomputed = precomputed_deltas.pop(key, None)
+    updown, ex_bias = precomputed if precomputed is not None else module.calc_updown(self.weight)
+    if len(self.weight.shape) == 4 and self.weight.shape[1] == 9:
+        # inpainting model. zero pad updown to make channel[1]  4 to 9
+        updown = torch.nn.functional.pad(updown, (0, 0, 0, 0, 0, 5)) # pylint: disable=not-callable
+    if module.static_updown and shared.opts.lora_delta_cache > 0:
+        delta_cache.put(key, updown, ex_bias, multiplier)
+    return updown, ex_bias
+
+
+def network_apply_incremental(self, network_layer_name) -> bool:
+    """
+    Applies only the difference between currently applied and wanted networks using cached deltas.
+    Returns False if layer cannot be updated incrementally and must be restored from backup instead.
+    """
+    applied = getattr(self, "network_applied", None)
+    if applied is None or shared.opts.lora_delta_cache == 0 or isinstance(self, torch.nn.MultiheadAttention) or not hasattr(self, 'weight'):
+        return False
+    wanted = {}
+    for net in loaded_networks:
+        module = net.modules.get(network_layer_name, None)
+        if module is None:
+            continue
+        if not module.static_updown or delta_key(net) in wanted:
+            return False
+        wanted[delta_key(net)] = (net, module, module.multiplier())
+    if len(wanted) == 0: # restore from backup is exact and avoids accumulating rounding errors
+        return False
+    removals = []
+    for key, multiplier in applied.items():
+        if key in wanted and wanted[key][2] == multiplier:
+            continue
+        cached = delta_cache.get(key + (network_layer_name,))
+        if cached is None or cached[2] == 0:
+            return False
+        removals.append((cached, multiplier))
+    try:
+        with devices.inference_context():
+            updown_total = None
+            bias_total = None
+            for (updown, ex_bias, cached_multiplier), multiplier in removals:
+                scale = -multiplier / cached_multiplier
+                updown = updown.to(self.weight.device, dtype=self.weight.dtype)
+                ex_bias = ex_bias.to(self.weight.device, dtype=self.weight.dtype) if ex_bias is not None else None
+                updown_total = updown * scale if updown_total is None else updown_total + updown * scale
+                if ex_bias is not None:
+                    bias_total = ex_bias * scale if bias_total is None else bias_total + ex_bias * scale
+            for key, (net, module, multiplier) in wanted.items():
+                if key in applied and applied[key] == multiplier:
+                    continue
+                updown, ex_bias = network_calc_updown(self, net, module)
+                updown_total = updown if updown_total is None else updown_total + updown
+                if ex_bias is not None:
+                    bias_total = ex_bias if bias_total is None else bias_total + ex_bias
+            if updown_total is not None:
+                self.weight = torch.nn.Parameter(self.weight + updown_total)
+            if bias_total is not None and hasattr(self, 'bias'):
+                if self.bias is None:
+                    self.bias = torch.nn.Parameter(bias_total.clone())
+                else:
+                    self.bias += bias_total
+    except RuntimeError as e:
+        if debug:
+            shared.log.debug(f"LoRA incremental apply layer={network_layer_name} {e}")
+        return False
+    self.network_applied = {key: multiplier for key, (_net, _module, multiplier) in wanted.items()}
+    return True
+
+
 def network_apply_weights(self: Union[torch.nn.Conv2d, torch.nn.Linear, torch.nn.GroupNorm, torch.nn.LayerNorm, torch.nn.MultiheadAttention, diffusers.models.lora.LoRACompatibleLinear, diffusers.models.lora.LoRACompatibleConv]):
     """
     Applies the currently selected set of networks to the weights of torch layer self.
     If weights already have this particular set of networks applied, does nothing.
-    If not, restores orginal weights from backup and alters weights according to networks.
+    If not, applies only changed networks using cached deltas when possible,
+    otherwise restores orginal weights from backup and alters weights according to networks.
     """
     network_layer_name = getattr(self, 'network_layer_name', None)
     if network_layer_name is None:
@@ -271,7 +540,8 @@ def network_apply_weights(self: Union[torch.nn.Conv2d, torch.nn.Linear, torch.nn
     current_names = getattr(self, "network_current_names", ())
     wanted_names = tuple((x.name, x.te_multiplier, x.unet_multiplier, x.dyn_dim) for x in loaded_networks)
     weights_backup = getattr(self, "network_weights_backup", None)
-    if weights_backup is None and wanted_names != (): # pylint: disable=C1803
+    from_checkpoint = weights_backup is None and (checkpoint_restore.available(self) or (current_names != () and checkpoint_restore.lookup(self) is not None)) # pylint: disable=C1803 # original weights can be read from checkpoint so no backup is needed
+    if weights_backup is None and wanted_names != () and not from_checkpoint: # pylint: disable=C1803
         if current_names != ():
             raise RuntimeError("no backup weights found and current weights are not unchanged")
         if isinstance(self, torch.nn.MultiheadAttention):
@@ -280,7 +550,7 @@ def network_apply_weights(self: Union[torch.nn.Conv2d, torch.nn.Linear, torch.nn
             weights_backup = self.weight.to(devices.cpu, copy=True)
         self.network_weights_backup = weights_backup
     bias_backup = getattr(self, "network_bias_backup", None)
-    if bias_backup is None:
+    if bias_backup is None and not from_checkpoint:
         if isinstance(self, torch.nn.MultiheadAttention) and self.out_proj.bias is not None:
             bias_backup = self.out_proj.bias.to(devices.cpu, copy=True)
         elif getattr(self, 'bias', None) is not None:
@@ -289,25 +559,30 @@ def network_apply_weights(self: Union[torch.nn.Conv2d, torch.nn.Linear, torch.nn
             bias_backup = None
         self.network_bias_backup = bias_backup
 
-    if current_names != wanted_names:
+    if current_names != wanted_names and network_apply_incremental(self, network_layer_name):
+        self.network_current_names = wanted_names
+    elif current_names != wanted_names:
         network_restore_weights_from_backup(self)
+        applied = {}
         for net in loaded_networks:
             # default workflow where module is known and has weights
             module = net.modules.get(network_layer_name, None)
             if module is not None and hasattr(self, 'weight'):
                 try:
                     with devices.inference_context():
-                        updown, ex_bias = module.calc_updown(self.weight)
-                        if len(self.weight.shape) == 4 and self.weight.shape[1] == 9:
-                            # inpainting model. zero pad updown to make channel[1]  4 to 9
-                            updown = torch.nn.functional.pad(updown, (0, 0, 0, 0, 0, 5)) # pylint: disable=not-callable
+                        updown, ex_bias = network_calc_updown(self, net, module)
                         self.weight = torch.nn.Parameter(self.weight + updown)
                         if ex_bias is not None and hasattr(self, 'bias'):
                             if self.bias is None:
-                                self.bias = torch.nn.Parameter(ex_bias)
+                                self.bias = torch.nn.Parameter(ex_bias.clone())
                             else:
                                 self.bias += ex_bias
+                    if applied is not None and module.static_updown and delta_key(net) not in applied:
+                        applied[delta_key(net)] = module.multiplier()
+                    else:
+                        applied = None
                 except RuntimeError as e:
+                    applied = None
                     extra_network_lora.errors[net.name] = extra_network_lora.errors.get(net.name, 0) + 1
                     if debug:
                         module_name = net.modules.get(network_layer_name, None)
@@ -321,6 +596,7 @@ def network_apply_weights(self: Union[torch.nn.Conv2d, torch.nn.Linear, torch.nn
             module_v = net.modules.get(network_layer_name + "_v_proj", None)
             module_out = net.modules.get(network_layer_name + "_out_proj", None)
             if isinstance(self, torch.nn.MultiheadAttention) and module_q and module_k and module_v and module_out:
+                applied = None
                 try:
                     with devices.inference_context():
                         updown_q, _ = module_q.calc_updown(self.in_proj_weight)
@@ -342,17 +618,19 @@ def network_apply_weights(self: Union[torch.nn.Conv2d, torch.nn.Linear, torch.nn
                 continue
             if module is None:
                 continue
+            applied = None
             shared.log.warning(f"LoRA network={net.name} layer={network_layer_name} unsupported operation")
             extra_network_lora.errors[net.name] = extra_network_lora.errors.get(net.name, 0) + 1
         self.network_current_names = wanted_names
+        self.network_applied = applied
     t1 = time.time()
     timer['apply'] += t1 - t0
 
 
 def network_forward(module, input, original_forward): # pylint: disable=W0622
     """
-    Old way of applying Lora by executing operations during layer's forward.
-    Stacking many loras this way results in big performance degradation.
+    Runtime way of applying Lora by executing low-rank operations during layer's forward without modifying weights.
+    Avoids weights backup and restore, but stacking many loras this way results in performance degradation.
     """
     if len(loaded_networks) == 0:
         return original_forward(module, input)
@@ -372,10 +650,12 @@ def network_forward(module, input, original_forward): # pylint: disable=W0622
 def network_reset_cached_weight(self: Union[torch.nn.Conv2d, torch.nn.Linear]):
     self.network_current_names = ()
     self.network_weights_backup = None
+    self.network_bias_backup = None # otherwise runtime forward would copy bias from backup on every call
+    self.network_applied = None
 
 
 def network_Linear_forward(self, input): # pylint: disable=W0622
-    if shared.opts.lora_functional:
+    if lora_mode == 'runtime':
         return network_forward(self, input, originals.Linear_forward)
     network_apply_weights(self)
     return originals.Linear_forward(self, input)
@@ -387,7 +667,7 @@ def network_Linear_load_state_dict(self, *args, **kwargs):
 
 
 def network_Conv2d_forward(self, input): # pylint: disable=W0622
-    if shared.opts.lora_functional:
+    if lora_mode == 'runtime':
         return network_forward(self, input, originals.Conv2d_forward)
     network_apply_weights(self)
     return originals.Conv2d_forward(self, input)
@@ -399,7 +679,7 @@ def network_Conv2d_load_state_dict(self, *args, **kwargs):
 
 
 def network_GroupNorm_forward(self, input): # pylint: disable=W0622
-    if shared.opts.lora_functional:
+    if lora_mode == 'runtime':
         return network_forward(self, input, originals.GroupNorm_forward)
     network_apply_weights(self)
     return originals.GroupNorm_forward(self, input)
@@ -411,7 +691,7 @@ def network_GroupNorm_load_state_dict(self, *args, **kwargs):
 
 
 def network_LayerNorm_forward(self, input): # pylint: disable=W0622
-    if shared.opts.lora_functional:
+    if lora_mode == 'runtime':
         return network_forward(self, input, originals.LayerNorm_forward)
     network_apply_weights(self)
     return originals.LayerNorm_forward(self, input)
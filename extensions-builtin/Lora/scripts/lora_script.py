@@ -4,7 +4,7 @@ import lora # noqa:F401 # pylint: disable=unused-import
 from network import NetworkOnDisk
 from ui_extra_networks_lora import ExtraNetworksPageLora
 from extra_networks_lora import ExtraNetworkLora
-from modules import script_callbacks, ui_extra_networks, extra_networks
+from modules import script_callbacks, ui_extra_networks, extra_networks, prompt_cache
 
 
 re_lora = re.compile("<lora:([^:]+):")
@@ -34,6 +34,10 @@ def api_networks(_, app):
     async def refresh_loras():
         return networks.list_available_networks()
 
+    @app.get("/sdapi/v1/lora-cache")
+    async def get_lora_cache():
+        return { **networks.lora_cache.stats(), 'deltas': networks.delta_cache.stats(), 'prefetch': networks.prefetch_stats, 'restore': networks.checkpoint_restore.stats() }
+
 
 def infotext_pasted(infotext, d): # pylint: disable=unused-argument
     hashes = d.get("Lora hashes", None)
@@ -58,5 +62,8 @@ def infotext_pasted(infotext, d): # pylint: disable=unused-argument
 script_callbacks.on_app_started(api_networks)
 script_callbacks.on_before_ui(before_ui)
 script_callbacks.on_model_loaded(networks.assign_network_names_to_compvis_modules)
+script_callbacks.on_model_loaded(networks.clear_delta_cache)
+script_callbacks.on_model_loaded(networks.checkpoint_restore.reset)
+prompt_cache.register_state('lora', networks.te_state)
 script_callbacks.on_infotext_pasted(networks.infotext_pasted)
 script_callbacks.on_infotext_pasted(infotext_pasted)
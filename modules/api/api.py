@@ -4,7 +4,7 @@ from secrets import compare_digest
 from fastapi import FastAPI, APIRouter, Depends, Request
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 from fastapi.exceptions import HTTPException
-from modules import errors, shared, scripts, ui, postprocessing
+from modules import errors, shared, scripts, ui, postprocessing, extra_networks
 from modules.api import models, endpoints, script, train, helpers, server, nvml
 from modules.processing import StableDiffusionProcessingTxt2Img, StableDiffusionProcessingImg2Img, process_images
 
@@ -65,6 +65,7 @@ class Api:
         self.add_api_route("/sdapi/v1/face-restorers", endpoints.get_face_restorers, methods=["GET"], response_model=List[models.ItemFaceRestorer])
         self.add_api_route("/sdapi/v1/prompt-styles", endpoints.get_prompt_styles, methods=["GET"], response_model=List[models.ItemStyle])
         self.add_api_route("/sdapi/v1/embeddings", endpoints.get_embeddings, methods=["GET"], response_model=models.ResEmbeddings)
+        self.add_api_route("/sdapi/v1/prompt-cache", endpoints.get_prompt_cache, methods=["GET"])
         self.add_api_route("/sdapi/v1/sd-vae", endpoints.get_sd_vaes, methods=["GET"], response_model=List[models.ItemVae])
         self.add_api_route("/sdapi/v1/extensions", endpoints.get_extensions_list, methods=["GET"], response_model=List[models.ItemExtension])
         self.add_api_route("/sdapi/v1/extra-networks", endpoints.get_extra_networks, methods=["GET"], response_model=List[models.ItemExtraNetwork])
@@ -175,6 +176,7 @@ class Api:
         send_images = args.pop('send_images', True)
         args.pop('save_images', None)
 
+        extra_networks.prefetch([args.get('prompt', ''), args.get('negative_prompt', '')])
         with self.queue_lock:
             p = StableDiffusionProcessingTxt2Img(sd_model=shared.sd_model, **args)
             p.scripts = script_runner
@@ -227,6 +229,7 @@ class Api:
         send_images = args.pop('send_images', True)
         args.pop('save_images', None)
 
+        extra_networks.prefetch([args.get('prompt', ''), args.get('negative_prompt', '')])
         with self.queue_lock:
             p = StableDiffusionProcessingImg2Img(sd_model=shared.sd_model, **args)
             p.init_images = [helpers.decode_base64_to_image(x) for x in init_images]
@@ -1,6 +1,6 @@
 from typing import Any, Dict
 from fastapi import Depends
-from modules import shared
+from modules import shared, live_preview
 from modules.api import models, helpers
 
 
@@ -64,6 +64,8 @@ def get_progress(req: models.ReqProgress = Depends()):
     import time
     if shared.state.job_count == 0:
         return models.ResProgress(progress=0, eta_relative=0, state=shared.state.dict(), textinfo=shared.state.textinfo)
+    if not req.skip_current_image:
+        live_preview.previewer.subscribe()
     shared.state.do_set_current_image()
     current_image = None
     if shared.state.current_image and not req.skip_current_image:
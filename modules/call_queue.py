@@ -2,7 +2,7 @@ import html
 import threading
 import time
 import cProfile
-from modules import shared, progress, errors
+from modules import shared, progress, errors, extra_networks
 
 queue_lock = threading.Lock()
 
@@ -24,6 +24,7 @@ def wrap_gradio_gpu_call(func, extra_outputs=None):
             progress.add_task_to_queue(id_task)
         else:
             id_task = None
+        extra_networks.prefetch([arg for arg in args if isinstance(arg, str)])
         with queue_lock:
             progress.start_task(id_task)
             res = [None, '', '', '']
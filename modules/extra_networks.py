@@ -61,6 +61,12 @@ class ExtraNetwork:
         """
         raise NotImplementedError
 
+    def prefetch(self, params_list):
+        """
+        Called when request is queued, before processing starts. Can be used to start loading networks mentioned in params_list in background.
+        Optional, default does nothing.
+        """
+
 
 def activate(p, extra_network_data):
     """call activate for extra networks in extra_network_data in specified order, then call activate for all remaining registered networks with an empty argument list"""
@@ -86,6 +92,25 @@ def activate(p, extra_network_data):
             errors.display(e, f"activating extra network: name={extra_network_name}")
 
 
+def prefetch(prompts):
+    """call prefetch for extra networks mentioned in any of the prompts so loading can start before request is processed"""
+    extra_network_data = defaultdict(list)
+    for prompt in prompts:
+        if not isinstance(prompt, str) or '<' not in prompt:
+            continue
+        _, parsed_extra_data = parse_prompt(prompt)
+        for extra_network_name, extra_network_args in parsed_extra_data.items():
+            extra_network_data[extra_network_name] += extra_network_args
+    for extra_network_name, extra_network_args in extra_network_data.items():
+        extra_network = extra_network_registry.get(extra_network_name, None)
+        if extra_network is None:
+            continue
+        try:
+            extra_network.prefetch(extra_network_args)
+        except Exception as e:
+            errors.display(e, f"prefetching extra network: name={extra_network_name} args:{extra_network_args}")
+
+
 def deactivate(p, extra_network_data):
     """call deactivate for extra networks in extra_network_data in specified order, then call deactivate for all remaining registered networks"""
     if extra_network_data is None:
@@ -714,6 +714,7 @@ Last saved image: {html.escape(last_saved_image)}<br/>
     finally:
         pbar.leave = False
         pbar.close()
+        shared.log.info(f'Hypernetwork Training: dataloader {dl.stats()}')
         hypernetwork.eval()
         #report_statistics(loss_dict)
         sd_hijack_checkpoint.remove()
@@ -0,0 +1,120 @@
+"""
+live preview decoder
+latents are decoded on background worker which always takes newest latent and drops stale ones
+previews are rate limited and skipped entirely while no client is polling progress
+"""
+import time
+import threading
+import torch
+from modules import shared, devices
+
+
+class Previewer:
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.pending = None # newest latent waiting for worker
+        self.thread = None
+        self.subscribed = 0 # time of last progress request
+        self.last = 0 # time of last accepted preview
+        self.reset()
+
+    def reset(self):
+        self.submitted = 0
+        self.dropped = 0 # replaced by newer latent before worker picked them up
+        self.skipped = 0 # rejected due to rate limit or no subscriber
+        self.decoded = 0
+        self.overhead = 0 # time spent by callers, includes inline decode
+        self.busy = 0 # time spent by worker
+
+    def subscribe(self):
+        self.subscribed = time.time()
+
+    def active(self):
+        timeout = max(5, 2 * shared.opts.live_preview_refresh_period / 1000)
+        return time.time() - self.subscribed < timeout
+
+    def accept(self, force=False):
+        """check subscriber and rate limit, force bypasses rate limit"""
+        if not self.active():
+            self.skipped += 1
+            return False
+        now = time.time()
+        rate = shared.opts.live_preview_max_rate
+        if not force and rate > 0 and now - self.last < 1 / rate:
+            self.skipped += 1
+            return False
+        self.last = now
+        return True
+
+    def submit(self, latent, step, force=False):
+        """queue latent for decode, returns immediately and returns whether latent was accepted"""
+        t0 = time.time()
+        if latent is None or not self.accept(force):
+            return False
+        latent = latent.detach().clone() # samplers may update latents in place
+        event = None
+        if latent.device.type == 'cuda':
+            event = torch.cuda.Event()
+            event.record() # worker stream must not read latent before copy is done
+        with self.condition:
+            if self.pending is not None:
+                self.dropped += 1
+            self.pending = (latent, step, event)
+            self.submitted += 1
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name='live-preview', daemon=True)
+                self.thread.start()
+            self.condition.notify()
+        self.overhead += time.time() - t0
+        return True
+
+    def decode_inline(self, latent):
+        """decode on calling thread for cases where models must not be used concurrently, returns None if preview is not accepted"""
+        t0 = time.time()
+        if latent is None or not self.accept():
+            return None
+        image = decode(latent)
+        self.decoded += 1
+        self.overhead += time.time() - t0
+        return image
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.pending is None:
+                    self.condition.wait()
+                latent, step, event = self.pending
+                self.pending = None
+            t0 = time.time()
+            try:
+                with devices.inference_context(): # grad mode is thread-local
+                    if event is not None:
+                        stream = torch.cuda.Stream(device=latent.device)
+                        stream.wait_event(event)
+                        with torch.cuda.stream(stream):
+                            image = decode(latent)
+                        stream.synchronize()
+                    else:
+                        image = decode(latent)
+                shared.state.assign_current_image(image)
+                self.decoded += 1
+            except Exception as e:
+                shared.log.debug(f'Live preview: step={step} {e}')
+            del latent
+            self.busy += time.time() - t0
+
+    def stats(self):
+        return f'submitted={self.submitted} decoded={self.decoded} dropped={self.dropped} skipped={self.skipped} overhead={self.overhead:.3f} decode={self.busy:.2f}'
+
+
+def decode(latent):
+    from modules import sd_samplers
+    return sd_samplers.samples_to_image_grid(latent) if shared.opts.show_progress_grid else sd_samplers.sample_to_image(latent)
+
+
+def enabled():
+    """background decode requires models to be usable while sampling continues"""
+    return shared.opts.live_preview_async and shared.parallel_processing_allowed and not shared.cmd_opts.lowvram
+
+
+previewer = Previewer()
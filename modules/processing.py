@@ -1,11 +1,13 @@
 import os
 import json
 import time
+import functools
 from contextlib import nullcontext
 import numpy as np
 from PIL import Image
-from modules import shared, devices, errors, images, scripts, memstats, lowvram, script_callbacks, extra_networks, face_restoration, sd_hijack_freeu, sd_models, sd_vae, processing_helpers
+from modules import shared, devices, errors, images, scripts, memstats, lowvram, script_callbacks, extra_networks, face_restoration, sd_hijack_freeu, sd_models, sd_vae, processing_helpers, processing_pipeline
 from modules.sd_hijack_hypertile import context_hypertile_vae, context_hypertile_unet
+from modules.sd_hijack_deepcache import context_deepcache
 from modules.processing_class import StableDiffusionProcessing, StableDiffusionProcessingTxt2Img, StableDiffusionProcessingImg2Img # pylint: disable=unused-import
 from modules.processing_info import create_infotext
 
@@ -169,7 +171,7 @@ def process_images(p: StableDiffusionProcessing) -> Processed:
             import cProfile
             profile_python = cProfile.Profile()
             profile_python.enable()
-            with context_hypertile_vae(p), context_hypertile_unet(p):
+            with context_hypertile_vae(p), context_hypertile_unet(p), context_deepcache(p):
                 import torch.profiler # pylint: disable=redefined-outer-name
                 activities=[torch.profiler.ProfilerActivity.CPU]
                 if torch.cuda.is_available():
@@ -183,7 +185,7 @@ def process_images(p: StableDiffusionProcessing) -> Processed:
                 errors.profile_torch(shared.profiler, 'Process')
             errors.profile(profile_python, 'Process')
         else:
-            with context_hypertile_vae(p), context_hypertile_unet(p):
+            with context_hypertile_vae(p), context_hypertile_unet(p), context_deepcache(p):
                 processed = process_images_inner(p)
 
     finally:
@@ -253,6 +255,86 @@ def process_images_inner(p: StableDiffusionProcessing) -> Processed:
     def infotext(_inxex=0): # dummy function overriden if there are iterations
         return ''
 
+    def finish_batch(p, n, x_samples_ddim, samples=None): # runs on main thread, with copy of p for the batch and samples quantized by worker if pipelined
+        if isinstance(x_samples_ddim, processing_pipeline.DeferredDecode):
+            x_samples_ddim = x_samples_ddim()
+        if not shared.opts.keep_incomplete and shared.state.interrupted:
+            x_samples_ddim = []
+            samples = None
+
+        if shared.backend == shared.Backend.ORIGINAL and (shared.cmd_opts.lowvram or shared.cmd_opts.medvram):
+            lowvram.send_everything_to_cpu()
+            devices.torch_gc()
+        if p.scripts is not None and isinstance(p.scripts, scripts.ScriptRunner):
+            p.scripts.postprocess_batch(p, x_samples_ddim, batch_number=n)
+        if p.scripts is not None and isinstance(p.scripts, scripts.ScriptRunner):
+            p.prompts = p.all_prompts[n * p.batch_size:(n + 1) * p.batch_size]
+            p.negative_prompts = p.all_negative_prompts[n * p.batch_size:(n + 1) * p.batch_size]
+            batch_params = scripts.PostprocessBatchListArgs(list(x_samples_ddim))
+            p.scripts.postprocess_batch_list(p, batch_params, batch_number=n)
+            x_samples_ddim = batch_params.images
+
+        def infotext(index):
+            return create_infotext(p, p.prompts, p.seeds, p.subseeds, index=index, all_negative_prompts=p.negative_prompts)
+
+        samples = samples if samples is not None else processing_helpers.validate_samples(x_samples_ddim) # denormalize and quantize entire batch at once
+        samples = samples if samples is not None else [x if isinstance(x, Image.Image) else validate_sample(x) for x in x_samples_ddim]
+        postprocess_image = p.scripts is not None and isinstance(p.scripts, scripts.ScriptRunner) and any(type(script).postprocess_image is not scripts.Script.postprocess_image for script in p.scripts.alwayson_scripts)
+        for i, x_sample in enumerate(samples): # per-image steps, samples stay arrays unless step requires image
+            p.batch_index = i
+            if p.restore_faces:
+                x_sample = np.array(x_sample) if isinstance(x_sample, Image.Image) else x_sample
+                if not p.do_not_save_samples and shared.opts.save_images_before_face_restoration:
+                    orig = p.restore_faces
+                    p.restore_faces = False
+                    info = infotext(i)
+                    p.restore_faces = orig
+                    images.save_image(Image.fromarray(x_sample), path=p.outpath_samples, basename="", seed=p.seeds[i], prompt=p.prompts[i], extension=shared.opts.samples_format, info=info, p=p, suffix="-before-face-restore")
+                p.ops.append('face')
+                x_sample = face_restoration.restore_faces(x_sample)
+            if postprocess_image:
+                pp = scripts.PostprocessImageArgs(processing_helpers.to_image(x_sample))
+                p.scripts.postprocess_image(p, pp)
+                x_sample = pp.image
+            samples[i] = x_sample
+        if p.color_corrections is not None: # batch steps
+            corrected = min(len(p.color_corrections), len(samples))
+            for i in range(corrected):
+                p.batch_index = i
+                if not p.do_not_save_samples and shared.opts.save_images_before_color_correction:
+                    orig = p.color_corrections
+                    p.color_corrections = None
+                    info = infotext(i)
+                    p.color_corrections = orig
+                    image_without_cc = apply_overlay(processing_helpers.to_image(samples[i]), p.paste_to, i, p.overlay_images)
+                    images.save_image(image_without_cc, path=p.outpath_samples, basename="", seed=p.seeds[i], prompt=p.prompts[i], extension=shared.opts.samples_format, info=info, p=p, suffix="-before-color-correct")
+                p.ops.append('color')
+            samples[:corrected] = processing_helpers.apply_color_correction_batch(p.color_corrections[:corrected], samples[:corrected])
+        if shared.opts.mask_apply_overlay:
+            samples = processing_helpers.apply_overlay_batch(samples, p.paste_to, p.overlay_images)
+        for i, x_sample in enumerate(samples): # images are created only for outputs
+            p.batch_index = i
+            image = processing_helpers.to_image(x_sample)
+            text = infotext(i)
+            infotexts.append(text)
+            image.info["parameters"] = text
+            output_images.append(image)
+            if shared.opts.samples_save and not p.do_not_save_samples:
+                images.save_image(image, p.outpath_samples, "", p.seeds[i], p.prompts[i], shared.opts.samples_format, info=text, p=p) # main save image
+            if hasattr(p, 'mask_for_overlay') and p.mask_for_overlay and any([shared.opts.save_mask, shared.opts.save_mask_composite, shared.opts.return_mask, shared.opts.return_mask_composite]):
+                image_mask = p.mask_for_overlay.convert('RGB')
+                image_mask_composite = Image.composite(image.convert('RGBA').convert('RGBa'), Image.new('RGBa', image.size), images.resize_image(3, p.mask_for_overlay, image.width, image.height).convert('L')).convert('RGBA')
+                if shared.opts.save_mask:
+                    images.save_image(image_mask, p.outpath_samples, "", p.seeds[i], p.prompts[i], shared.opts.samples_format, info=text, p=p, suffix="-mask")
+                if shared.opts.save_mask_composite:
+                    images.save_image(image_mask_composite, p.outpath_samples, "", p.seeds[i], p.prompts[i], shared.opts.samples_format, info=text, p=p, suffix="-mask-composite")
+                if shared.opts.return_mask:
+                    output_images.append(image_mask)
+                if shared.opts.return_mask_composite:
+                    output_images.append(image_mask_composite)
+        del x_samples_ddim
+        devices.torch_gc()
+
     ema_scope_context = p.sd_model.ema_scope if shared.backend == shared.Backend.ORIGINAL else nullcontext
     shared.state.job_count = p.n_iter
     with devices.inference_context(), ema_scope_context():
@@ -261,117 +343,65 @@ def process_images_inner(p: StableDiffusionProcessing) -> Processed:
             p.init(p.all_prompts, p.all_seeds, p.all_subseeds)
         extra_network_data = None
         debug(f'Processing inner: args={vars(p)}')
-        for n in range(p.n_iter):
-            p.iteration = n
-            if shared.state.skipped:
-                shared.log.debug(f'Process skipped: {n}/{p.n_iter}')
-                shared.state.skipped = False
-                continue
-            if shared.state.interrupted:
-                shared.log.debug(f'Process interrupted: {n}/{p.n_iter}')
-                break
-            p.prompts = p.all_prompts[n * p.batch_size:(n + 1) * p.batch_size]
-            p.negative_prompts = p.all_negative_prompts[n * p.batch_size:(n + 1) * p.batch_size]
-            p.seeds = p.all_seeds[n * p.batch_size:(n + 1) * p.batch_size]
-            p.subseeds = p.all_subseeds[n * p.batch_size:(n + 1) * p.batch_size]
-            if p.scripts is not None and isinstance(p.scripts, scripts.ScriptRunner):
-                p.scripts.before_process_batch(p, batch_number=n, prompts=p.prompts, seeds=p.seeds, subseeds=p.subseeds)
-            if len(p.prompts) == 0:
-                break
-            p.prompts, extra_network_data = extra_networks.parse_prompts(p.prompts)
-            if not p.disable_extra_networks:
-                with devices.autocast():
-                    extra_networks.activate(p, extra_network_data)
-            if p.scripts is not None and isinstance(p.scripts, scripts.ScriptRunner):
-                p.scripts.process_batch(p, batch_number=n, prompts=p.prompts, seeds=p.seeds, subseeds=p.subseeds)
-
-            x_samples_ddim = None
-            if p.scripts is not None and isinstance(p.scripts, scripts.ScriptRunner):
-                x_samples_ddim = p.scripts.process_images(p)
-            if x_samples_ddim is None:
-                if shared.backend == shared.Backend.ORIGINAL:
-                    from modules.processing_original import process_original
-                    x_samples_ddim = process_original(p)
-                elif shared.backend == shared.Backend.DIFFUSERS:
-                    from modules.processing_diffusers import process_diffusers
-                    x_samples_ddim = process_diffusers(p)
-                else:
-                    raise ValueError(f"Unknown backend {shared.backend}")
-
-            if not shared.opts.keep_incomplete and shared.state.interrupted:
-                x_samples_ddim = []
-
-            if shared.backend == shared.Backend.ORIGINAL and (shared.cmd_opts.lowvram or shared.cmd_opts.medvram):
-                lowvram.send_everything_to_cpu()
-                devices.torch_gc()
-            if p.scripts is not None and isinstance(p.scripts, scripts.ScriptRunner):
-                p.scripts.postprocess_batch(p, x_samples_ddim, batch_number=n)
-            if p.scripts is not None and isinstance(p.scripts, scripts.ScriptRunner):
+        pipeline = processing_pipeline.Pipeline() if processing_pipeline.enabled(p) else None
+        p.defer_decode = pipeline is not None
+        try:
+            for n in range(p.n_iter):
+                p.iteration = n
+                if shared.state.skipped:
+                    shared.log.debug(f'Process skipped: {n}/{p.n_iter}')
+                    shared.state.skipped = False
+                    continue
+                if shared.state.interrupted:
+                    shared.log.debug(f'Process interrupted: {n}/{p.n_iter}')
+                    break
                 p.prompts = p.all_prompts[n * p.batch_size:(n + 1) * p.batch_size]
                 p.negative_prompts = p.all_negative_prompts[n * p.batch_size:(n + 1) * p.batch_size]
-                batch_params = scripts.PostprocessBatchListArgs(list(x_samples_ddim))
-                p.scripts.postprocess_batch_list(p, batch_params, batch_number=n)
-                x_samples_ddim = batch_params.images
-
-            def infotext(index): # pylint: disable=function-redefined # noqa: F811
-                return create_infotext(p, p.prompts, p.seeds, p.subseeds, index=index, all_negative_prompts=p.negative_prompts)
+                p.seeds = p.all_seeds[n * p.batch_size:(n + 1) * p.batch_size]
+                p.subseeds = p.all_subseeds[n * p.batch_size:(n + 1) * p.batch_size]
+                if p.scripts is not None and isinstance(p.scripts, scripts.ScriptRunner):
+                    p.scripts.before_process_batch(p, batch_number=n, prompts=p.prompts, seeds=p.seeds, subseeds=p.subseeds)
+                if len(p.prompts) == 0:
+                    break
+                p.prompts, extra_network_data = extra_networks.parse_prompts(p.prompts)
+                if not p.disable_extra_networks:
+                    with devices.autocast():
+                        extra_networks.activate(p, extra_network_data)
+                if p.scripts is not None and isinstance(p.scripts, scripts.ScriptRunner):
+                    p.scripts.process_batch(p, batch_number=n, prompts=p.prompts, seeds=p.seeds, subseeds=p.subseeds)
 
-            for i, x_sample in enumerate(x_samples_ddim):
-                p.batch_index = i
-                if type(x_sample) == Image.Image:
-                    image = x_sample
-                    x_sample = np.array(x_sample)
-                else:
-                    x_sample = validate_sample(x_sample)
-                    image = Image.fromarray(x_sample)
-                if p.restore_faces:
-                    if not p.do_not_save_samples and shared.opts.save_images_before_face_restoration:
-                        orig = p.restore_faces
-                        p.restore_faces = False
-                        info = infotext(i)
-                        p.restore_faces = orig
-                        images.save_image(Image.fromarray(x_sample), path=p.outpath_samples, basename="", seed=p.seeds[i], prompt=p.prompts[i], extension=shared.opts.samples_format, info=info, p=p, suffix="-before-face-restore")
-                    p.ops.append('face')
-                    x_sample = face_restoration.restore_faces(x_sample)
-                    image = Image.fromarray(x_sample)
+                x_samples_ddim = None
                 if p.scripts is not None and isinstance(p.scripts, scripts.ScriptRunner):
-                    pp = scripts.PostprocessImageArgs(image)
-                    p.scripts.postprocess_image(p, pp)
-                    image = pp.image
-                if p.color_corrections is not None and i < len(p.color_corrections):
-                    if not p.do_not_save_samples and shared.opts.save_images_before_color_correction:
-                        orig = p.color_corrections
-                        p.color_corrections = None
-                        info = infotext(i)
-                        p.color_corrections = orig
-                        image_without_cc = apply_overlay(image, p.paste_to, i, p.overlay_images)
-                        images.save_image(image_without_cc, path=p.outpath_samples, basename="", seed=p.seeds[i], prompt=p.prompts[i], extension=shared.opts.samples_format, info=info, p=p, suffix="-before-color-correct")
-                    p.ops.append('color')
-                    image = apply_color_correction(p.color_corrections[i], image)
-                if shared.opts.mask_apply_overlay:
-                    image = apply_overlay(image, p.paste_to, i, p.overlay_images)
-                text = infotext(i)
-                infotexts.append(text)
-                image.info["parameters"] = text
-                output_images.append(image)
-                if shared.opts.samples_save and not p.do_not_save_samples:
-                    images.save_image(image, p.outpath_samples, "", p.seeds[i], p.prompts[i], shared.opts.samples_format, info=text, p=p) # main save image
-                if hasattr(p, 'mask_for_overlay') and p.mask_for_overlay and any([shared.opts.save_mask, shared.opts.save_mask_composite, shared.opts.return_mask, shared.opts.return_mask_composite]):
-                    image_mask = p.mask_for_overlay.convert('RGB')
-                    image_mask_composite = Image.composite(image.convert('RGBA').convert('RGBa'), Image.new('RGBa', image.size), images.resize_image(3, p.mask_for_overlay, image.width, image.height).convert('L')).convert('RGBA')
-                    if shared.opts.save_mask:
-                        images.save_image(image_mask, p.outpath_samples, "", p.seeds[i], p.prompts[i], shared.opts.samples_format, info=text, p=p, suffix="-mask")
-                    if shared.opts.save_mask_composite:
-                        images.save_image(image_mask_composite, p.outpath_samples, "", p.seeds[i], p.prompts[i], shared.opts.samples_format, info=text, p=p, suffix="-mask-composite")
-                    if shared.opts.return_mask:
-                        output_images.append(image_mask)
-                    if shared.opts.return_mask_composite:
-                        output_images.append(image_mask_composite)
-            del x_samples_ddim
-            devices.torch_gc()
+                    x_samples_ddim = p.scripts.process_images(p)
+                if x_samples_ddim is None:
+                    if shared.backend == shared.Backend.ORIGINAL:
+                        from modules.processing_original import process_original
+                        x_samples_ddim = process_original(p)
+                    elif shared.backend == shared.Backend.DIFFUSERS:
+                        from modules.processing_diffusers import process_diffusers
+                        x_samples_ddim = process_diffusers(p)
+                    else:
+                        raise ValueError(f"Unknown backend {shared.backend}")
+
+                if pipeline is not None and isinstance(x_samples_ddim, processing_pipeline.DeferredDecode):
+                    quantize = not processing_pipeline.overrides(p, 'postprocess_batch', 'postprocess_batch_list') # hooks may modify decoded batch before quantize
+                    pipeline.submit(processing_pipeline.decode, functools.partial(finish_batch, processing_pipeline.snapshot(p), n), x_samples_ddim, quantize)
+                else:
+                    if pipeline is not None:
+                        pipeline.join()
+                    finish_batch(p, n, x_samples_ddim)
+
+                def infotext(index): # pylint: disable=function-redefined # noqa: F811
+                    return create_infotext(p, p.prompts, p.seeds, p.subseeds, index=index, all_negative_prompts=p.negative_prompts)
+        finally:
+            p.defer_decode = False
+            if pipeline is not None:
+                pipeline.close()
 
         t1 = time.time()
         shared.log.info(f'Processed: images={len(output_images)} time={t1 - t0:.2f} its={(p.steps * len(output_images)) / (t1 - t0):.2f} memory={memstats.memory_stats()}')
+        if pipeline is not None:
+            shared.log.info(f'Processed pipeline: {pipeline.stats()}')
 
         p.color_corrections = None
         index_of_first_image = 0
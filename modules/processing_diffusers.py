@@ -7,7 +7,7 @@ import numpy as np
 import torch
 import torchvision.transforms.functional as TF
 import diffusers
-from modules import shared, devices, processing, sd_samplers, sd_models, images, errors, masking, prompt_parser_diffusers, sd_hijack_hypertile, processing_correction, processing_vae
+from modules import shared, devices, processing, sd_samplers, sd_models, images, errors, masking, prompt_parser_diffusers, sd_hijack_hypertile, processing_correction, processing_vae, processing_pipeline
 from modules.processing_helpers import resize_init_images, resize_hires, fix_prompts, calculate_base_steps, calculate_hires_steps, calculate_refiner_steps
 from modules.onnx_impl import preprocess_pipeline as preprocess_onnx_pipeline, check_parameters_changed as olive_check_parameters_changed
 
@@ -576,7 +576,10 @@ def process_diffusers(p: processing.StableDiffusionProcessing):
             if not hasattr(output, 'images') and hasattr(output, 'frames'):
                 shared.log.debug(f'Generated: frames={len(output.frames[0])}')
                 output.images = output.frames[0]
-            if output.images is not None and len(output.images) > 0:
+            if output.images is not None and len(output.images) > 0 and getattr(p, 'defer_decode', False) and torch.is_tensor(output.images):
+                latents, model, full_quality = output.images, shared.sd_model, p.full_quality
+                results = processing_pipeline.DeferredDecode(lambda: processing_vae.vae_decode(latents=latents, model=model, full_quality=full_quality))
+            elif output.images is not None and len(output.images) > 0:
                 results = processing_vae.vae_decode(latents=output.images, model=shared.sd_model, full_quality=p.full_quality)
             else:
                 shared.log.warning('Processing returned no results')
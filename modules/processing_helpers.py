@@ -9,7 +9,7 @@ import cv2
 from PIL import Image
 from skimage import exposure
 from blendmodes.blend import blendLayers, BlendType
-from modules import shared, devices, images, sd_models, sd_samplers, sd_hijack_hypertile, processing_vae
+from modules import shared, devices, images, sd_models, sd_samplers, sd_hijack_hypertile, processing_vae, sd_vae_planner
 
 
 debug = shared.log.trace if os.environ.get('SD_PROCESS_DEBUG', None) is not None else lambda *args, **kwargs: None
@@ -52,6 +52,92 @@ def apply_overlay(image: Image, paste_loc, index, overlays):
     return image
 
 
+def to_array(image):
+    """rgb uint8 array of image or None if image cannot be processed as part of batch"""
+    if isinstance(image, Image.Image):
+        return np.asarray(image) if image.mode == 'RGB' else None
+    if isinstance(image, np.ndarray) and image.dtype == np.uint8 and image.ndim == 3 and image.shape[2] == 3:
+        return image
+    return None
+
+
+def to_image(image):
+    return image if isinstance(image, Image.Image) else Image.fromarray(image)
+
+
+def match_histograms_batch(source, templates):
+    """
+    exposure.match_histograms for batch of uint8 images with one template each, source is (n, pixels, channels)
+    lookup tables are built per image and channel same as skimage does for uint8 inputs and applied to entire batch at once
+    """
+    n, pixels, channels = source.shape
+    rows = np.ascontiguousarray(source.transpose(0, 2, 1)).reshape(n * channels, pixels)
+    offsets = (np.arange(n * channels, dtype=np.int64) * 256)[:, None]
+    src_counts = np.bincount((rows + offsets).ravel(), minlength=n * channels * 256).reshape(n * channels, 256)
+    src_quantiles = np.cumsum(src_counts, axis=1) / pixels
+    lut = np.empty((n * channels, 256), dtype=np.uint8)
+    for i in range(n):
+        template = np.asarray(templates[i]).reshape(-1, channels)
+        for c in range(channels):
+            tmpl_counts = np.bincount(template[:, c], minlength=256)
+            tmpl_values = np.nonzero(tmpl_counts)[0]
+            tmpl_quantiles = np.cumsum(tmpl_counts[tmpl_values]) / template.shape[0]
+            lut[i * channels + c] = np.interp(src_quantiles[i * channels + c], tmpl_quantiles, tmpl_values) # assignment truncates same as match_histograms
+    matched = np.take_along_axis(lut, rows.astype(np.intp), axis=1)
+    return np.ascontiguousarray(matched.reshape(n, channels, pixels).transpose(0, 2, 1))
+
+
+def apply_color_correction_batch(corrections, samples):
+    """color correction of entire batch at once, returns list of arrays or images if batch falls back to per-image correction"""
+    arrays = [to_array(sample) for sample in samples]
+    if len(arrays) == 0 or any(a is None for a in arrays) or len({a.shape for a in arrays}) != 1:
+        return [apply_color_correction(correction, to_image(sample)) for correction, sample in zip(corrections, samples)]
+    n, h, w = len(arrays), arrays[0].shape[0], arrays[0].shape[1]
+    shared.log.debug(f"Applying color correction: batch={n} image={w}x{h}")
+    stacked = np.concatenate(arrays, axis=0) # single tall image since color conversion and blending are per-pixel
+    np_recolor = cv2.cvtColor(stacked, cv2.COLOR_RGB2LAB).reshape(n, h * w, 3)
+    np_match = match_histograms_batch(np_recolor, corrections)
+    np_output = cv2.cvtColor(np_match.reshape(n * h, w, 3), cv2.COLOR_LAB2RGB)
+    image = blendLayers(Image.fromarray(np_output), Image.fromarray(stacked), BlendType.LUMINOSITY)
+    return list(np.asarray(image.convert('RGB')).reshape(n, h, w, 3))
+
+
+def alpha_composite(dst, src):
+    """numpy equivalent of pil alpha_composite of rgba overlays onto opaque rgb images, integer math matches pil exactly"""
+    sa = src[..., 3:].astype(np.uint32)
+    coef1 = sa * 128 # pil computes sa * 255 * 255 * 128 // outa255 where outa255 is 255 * 255 for opaque destination
+    coef2 = 255 * 128 - coef1
+    tmp = src[..., :3].astype(np.uint32) * coef1 + dst.astype(np.uint32) * coef2 + (0x80 << 7)
+    out = ((((tmp >> 8) + tmp) >> 8) >> 7).astype(np.uint8)
+    return np.where(sa == 0, dst, out)
+
+
+def apply_overlay_batch(samples, paste_loc, overlays):
+    """overlay compositing of entire batch, images which must be resized and pasted use per-image path"""
+    samples = list(samples)
+    if overlays is None:
+        return samples
+    groups = {}
+    for i, sample in enumerate(samples[:len(overlays)]):
+        array = to_array(sample)
+        overlay = overlays[i]
+        if paste_loc is not None:
+            x, y, w, h = paste_loc
+            if array is None or array.shape[1] != w or array.shape[0] != h or x != 0 or y != 0:
+                array = None
+        if array is None or overlay.size != (array.shape[1], array.shape[0]):
+            samples[i] = apply_overlay(to_image(sample), paste_loc, i, overlays)
+        else:
+            groups.setdefault(array.shape, []).append(i)
+    for indices in groups.values():
+        debug(f'Apply overlay: batch={len(indices)} loc={paste_loc}')
+        dst = np.stack([to_array(samples[i]) for i in indices])
+        src = np.stack([np.asarray(overlays[i].convert('RGBA')) for i in indices])
+        for i, composed in zip(indices, alpha_composite(dst, src)):
+            samples[i] = composed
+    return samples
+
+
 def create_binary_mask(image):
     if image.mode == 'RGBA' and image.getextrema()[-1] != (255, 255):
         image = image.split()[-1].convert("L").point(lambda x: 255 if x > 128 else 0)
@@ -103,7 +189,82 @@ def slerp(val, low, high): # from https://discuss.pytorch.org/t/help-regarding-s
     return res
 
 
+noise_generators = {} # reusable per-device generators so seeding does not construct generators or reseed global state per image
+
+
+def noise_generator(device):
+    key = str(device)
+    if key not in noise_generators:
+        noise_generators[key] = torch.Generator(device=device)
+    return noise_generators[key]
+
+
+def randn_into(out, seed, generator):
+    generator.manual_seed(seed)
+    return torch.randn(out.shape, generator=generator, device=out.device, out=out)
+
+
+def restore_global_rng(seed, generator, device):
+    """leave global rng in same state as per-image torch.manual_seed would so samplers drawing from global rng afterwards are unchanged"""
+    torch.manual_seed(seed)
+    if device.type == 'cuda':
+        torch.cuda.default_generators[device.index if device.index is not None else torch.cuda.current_device()].set_state(generator.get_state())
+    else:
+        torch.default_generator.set_state(generator.get_state())
+
+
 def create_random_tensors(shape, seeds, subseeds=None, subseed_strength=0.0, seed_resize_from_h=0, seed_resize_from_w=0, p=None):
+    """
+    batched noise for all seeds, results are identical to create_random_tensors_legacy including state of global rng
+    each seed keeps its own stream since torch has no batched per-seed generator, but all draws go into preallocated batch buffers,
+    generators are reused and subseed noise is not drawn when it has no effect
+    """
+    if devices.device.type not in ['cpu', 'cuda', 'mps']: # device generators may not be available
+        return create_random_tensors_legacy(shape, seeds, subseeds, subseed_strength, seed_resize_from_h, seed_resize_from_w, p)
+    eta_noise_seed_delta = shared.opts.eta_noise_seed_delta or 0
+    noise_shape = shape if seed_resize_from_h <= 0 or seed_resize_from_w <= 0 else (shape[0], seed_resize_from_h//8, seed_resize_from_w//8)
+    rng_device = devices.cpu if devices.device.type == 'mps' else devices.device # mps draws on cpu same as devices.randn
+    generator = noise_generator(rng_device)
+    x = torch.empty((len(seeds), *shape), device=rng_device)
+    resized = torch.empty(noise_shape, device=rng_device) if noise_shape != shape else None
+    cnt = p.sampler.number_of_needed_noises(p) if p is not None and p.sampler is not None and ((len(seeds) > 1 and shared.opts.enable_batch_seeds) or eta_noise_seed_delta > 0) else 0
+    sampler_noises = torch.empty((cnt, len(seeds), *noise_shape), device=rng_device) if cnt > 0 else None
+    last_seed = None
+    for i, seed in enumerate(seeds):
+        noise = resized if resized is not None else x[i]
+        subnoise = None
+        if subseeds is not None and subseed_strength != 0: # slerp with zero strength returns noise unchanged
+            subseed = 0 if i >= len(subseeds) else subseeds[i]
+            subnoise = randn_into(torch.empty(noise_shape, device=rng_device), subseed, generator)
+        randn_into(noise, seed, generator)
+        last_seed = seed
+        if subnoise is not None:
+            noise.copy_(slerp(subseed_strength, noise, subnoise))
+        if resized is not None:
+            randn_into(x[i], seed, generator)
+            dx = (shape[2] - noise_shape[2]) // 2
+            dy = (shape[1] - noise_shape[1]) // 2
+            w = noise_shape[2] if dx >= 0 else noise_shape[2] + 2 * dx
+            h = noise_shape[1] if dy >= 0 else noise_shape[1] + 2 * dy
+            tx = 0 if dx < 0 else dx
+            ty = 0 if dy < 0 else dy
+            dx = max(-dx, 0)
+            dy = max(-dy, 0)
+            x[i, :, ty:ty+h, tx:tx+w] = noise[:, dy:dy+h, dx:dx+w]
+        if sampler_noises is not None:
+            if eta_noise_seed_delta > 0:
+                generator.manual_seed(seed + eta_noise_seed_delta)
+                last_seed = seed + eta_noise_seed_delta
+            for j in range(cnt):
+                torch.randn(noise_shape, generator=generator, device=rng_device, out=sampler_noises[j, i])
+    if last_seed is not None:
+        restore_global_rng(last_seed, generator, rng_device)
+    if sampler_noises is not None:
+        p.sampler.sampler_noises = list(sampler_noises.to(shared.device))
+    return x.to(shared.device)
+
+
+def create_random_tensors_legacy(shape, seeds, subseeds=None, subseed_strength=0.0, seed_resize_from_h=0, seed_resize_from_w=0, p=None):
     eta_noise_seed_delta = shared.opts.eta_noise_seed_delta or 0
     xs = []
     # if we have multiple seeds, this means we are working with batch size>1; this then
@@ -162,7 +323,9 @@ def decode_first_stage(model, x, full_quality=True):
     with devices.autocast(disable = x.dtype==devices.dtype_vae):
         try:
             if full_quality:
-                if hasattr(model, 'decode_first_stage'):
+                if hasattr(model, 'decode_first_stage') and sd_vae_planner.enabled():
+                    x_sample = sd_vae_planner.decode(model.decode_first_stage, x, dtype=devices.dtype_vae, device=x.device)
+                elif hasattr(model, 'decode_first_stage'):
                     x_sample = model.decode_first_stage(x)
                 elif hasattr(model, 'vae'):
                     x_sample = model.vae(x)
@@ -325,6 +488,34 @@ def validate_sample(tensor):
     return cast
 
 
+def validate_samples(samples):
+    """vectorized validate_sample of entire batch, returns list of uint8 arrays or None if samples cannot be stacked"""
+    if isinstance(samples, (list, tuple)):
+        if len(samples) == 0 or not all(isinstance(s, (np.ndarray, torch.Tensor)) for s in samples) or len({tuple(s.shape) for s in samples}) != 1:
+            return None
+        if all(isinstance(s, torch.Tensor) for s in samples):
+            samples = torch.stack(samples)
+        else:
+            samples = np.stack([s.detach().cpu().numpy() if isinstance(s, torch.Tensor) else s for s in samples])
+    if isinstance(samples, torch.Tensor):
+        if samples.dtype == torch.bfloat16: # numpy does not support bf16
+            samples = samples.to(torch.float16)
+        samples = samples.detach().cpu().numpy()
+    if not isinstance(samples, np.ndarray) or samples.ndim != 4:
+        return None
+    sample = 255.0 * np.moveaxis(samples, 1, 3) if shared.backend == shared.Backend.ORIGINAL else 255.0 * samples
+    with warnings.catch_warnings(record=True) as w:
+        cast = sample.astype(np.uint8)
+    if len(w) > 0:
+        nans = np.isnan(sample).sum()
+        shared.log.error(f'Failed to validate samples: sample={sample.shape} invalid={nans}')
+        cast = np.nan_to_num(sample)
+        minimum, maximum, mean = np.min(cast), np.max(cast), np.mean(cast)
+        cast = cast.astype(np.uint8)
+        shared.log.warning(f'Attempted to correct samples: min={minimum:.2f} max={maximum:.2f} mean={mean:.2f}')
+    return list(cast)
+
+
 def resize_init_images(p):
     if getattr(p, 'image', None) is not None and getattr(p, 'init_images', None) is None:
         p.init_images = [p.image]
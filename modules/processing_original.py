@@ -1,7 +1,7 @@
 import torch
 import numpy as np
 from PIL import Image
-from modules import shared, devices, processing, images, sd_models, sd_vae, sd_samplers, processing_helpers, prompt_parser
+from modules import shared, devices, processing, images, sd_models, sd_vae, sd_samplers, processing_helpers, processing_pipeline, prompt_parser
 from modules.sd_hijack_hypertile import hypertile_set
 
 
@@ -37,11 +37,21 @@ def process_original(p: processing.StableDiffusionProcessing):
     c = get_conds_with_caching(prompt_parser.get_multicond_learned_conditioning, p.prompts, p.steps * step_multiplier, cached_c)
     with devices.without_autocast() if devices.unet_needs_upcast else devices.autocast():
         samples_ddim = p.sample(conditioning=c, unconditional_conditioning=uc, seeds=p.seeds, subseeds=p.subseeds, subseed_strength=p.subseed_strength, prompts=p.prompts)
+    if getattr(p, 'defer_decode', False):
+        batch = processing_pipeline.snapshot(p) # main thread modifies p while next batch is sampled
+        return processing_pipeline.DeferredDecode(lambda: decode_samples(batch, samples_ddim, rollback=False))
+    return decode_samples(p, samples_ddim)
+
+
+def decode_samples(p: processing.StableDiffusionProcessing, samples_ddim, rollback=True): # rollback reloads vae so it is not allowed while unet is sampling in parallel
     x_samples_ddim = [processing.decode_first_stage(p.sd_model, samples_ddim[i:i+1].to(dtype=devices.dtype_vae), p.full_quality)[0].cpu() for i in range(samples_ddim.size(0))]
     try:
         for x in x_samples_ddim:
             devices.test_for_nans(x, "vae")
     except devices.NansException as e:
+        if not rollback and shared.cmd_opts.rollback_vae:
+            shared.log.warning('Tensor with all NaNs was produced in VAE: rollback is not available with processing pipeline')
+            raise e
         if not shared.opts.no_half and not shared.opts.no_half_vae and shared.cmd_opts.rollback_vae:
             shared.log.warning('Tensor with all NaNs was produced in VAE')
             devices.dtype_vae = torch.bfloat16
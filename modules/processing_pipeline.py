@@ -0,0 +1,112 @@
+import copy
+import time
+import concurrent.futures
+import torch
+from modules import shared, devices, processing_helpers
+
+
+class DeferredDecode:
+    """decode returned by backend instead of images so it can run in pipeline worker while next batch is sampled"""
+    def __init__(self, fn):
+        self.fn = fn
+
+    def __call__(self):
+        return self.fn()
+
+
+def enabled(p):
+    """pipelining requires vae and unet to be resident on device at the same time"""
+    if not shared.opts.processing_pipeline or p.n_iter < 2:
+        return False
+    if shared.cmd_opts.lowvram or shared.cmd_opts.medvram:
+        return False
+    if shared.backend == shared.Backend.DIFFUSERS and (shared.opts.diffusers_move_unet or shared.opts.diffusers_model_cpu_offload or shared.opts.diffusers_seq_cpu_offload):
+        return False
+    return True
+
+
+def snapshot(p):
+    """shallow copy of processing object for pipelined batch, mutable fields which main thread changes while sampling next batch are copied"""
+    batch = copy.copy(p)
+    batch.extra_generation_params = dict(p.extra_generation_params)
+    batch.ops = list(p.ops)
+    return batch
+
+
+def decode(deferred, quantize):
+    """runs in worker: vae decode and optionally quantize of batch, returns (decoded, quantized or None)"""
+    decoded = deferred()
+    return decoded, processing_helpers.validate_samples(decoded) if quantize else None
+
+
+def overrides(p, *names):
+    """check if any always-on script overrides given hooks"""
+    from modules import scripts
+    if p.scripts is None or not isinstance(p.scripts, scripts.ScriptRunner):
+        return False
+    return any(getattr(type(script), name) is not getattr(scripts.Script, name) for script in p.scripts.alwayson_scripts for name in names)
+
+
+class Pipeline:
+    """
+    runs decode of a batch in worker thread while next batch is sampled on main thread
+    script hooks, face restore and saving use models and shared script state so they run on main thread when batch is joined
+    at most one batch is in flight and batches are finished in submit order so output order, seeds and infotexts are preserved
+    """
+    def __init__(self):
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='processing-pipeline')
+        self.future = None
+        self.finish = None
+        self.batches = 0
+        self.busy = 0 # time worker spent on decode and postprocess
+        self.wait = 0 # time main thread spent waiting for worker
+
+    def submit(self, fn, finish, *args):
+        """fn(*args) runs in worker and returns tuple, finish(*result) runs on main thread at join"""
+        event = None
+        if torch.cuda.is_available() and devices.device is not None and devices.device.type == 'cuda':
+            event = torch.cuda.Event()
+            event.record() # worker stream must not start before sampling results are ready
+        self.join()
+        self.future = self.executor.submit(self.run, event, fn, *args)
+        self.finish = finish
+        self.batches += 1
+
+    def run(self, event, fn, *args):
+        t0 = time.time()
+        with devices.inference_context(): # grad mode is thread-local
+            if event is not None:
+                stream = torch.cuda.Stream()
+                stream.wait_event(event)
+                with torch.cuda.stream(stream):
+                    result = fn(*args)
+                stream.synchronize()
+            else:
+                result = fn(*args)
+        self.busy += time.time() - t0
+        return result
+
+    def join(self):
+        if self.future is None:
+            return
+        t0 = time.time()
+        finish = self.finish
+        try:
+            result = self.future.result()
+        finally:
+            self.future = None
+            self.finish = None
+            self.wait += time.time() - t0
+        finish(*result)
+
+    def close(self):
+        try:
+            self.join()
+        finally:
+            self.executor.shutdown(wait=True)
+
+    def overlap(self):
+        return max(0, self.busy - self.wait)
+
+    def stats(self):
+        return f'batches={self.batches} decode={self.busy:.2f} wait={self.wait:.2f} overlap={self.overlap():.2f}'
@@ -2,7 +2,7 @@ import os
 import time
 import torch
 import torchvision.transforms.functional as TF
-from modules import shared, devices, sd_models, sd_vae, sd_vae_taesd
+from modules import shared, devices, sd_models, sd_vae, sd_vae_taesd, sd_vae_planner
 
 
 debug = shared.log.trace if os.environ.get('SD_VAE_DEBUG', None) is not None else lambda *args, **kwargs: None
@@ -46,7 +46,11 @@ def full_vae_decode(latents, model):
         model.upcast_vae()
         latents = latents.to(next(iter(model.vae.post_quant_conv.parameters())).dtype)
 
-    decoded = model.vae.decode(latents / model.vae.config.scaling_factor, return_dict=False)[0]
+    if sd_vae_planner.enabled():
+        vae_dtype = next(iter(model.vae.post_quant_conv.parameters())).dtype
+        decoded = sd_vae_planner.decode(lambda x: model.vae.decode(x, return_dict=False)[0], latents / model.vae.config.scaling_factor, dtype=vae_dtype, device=devices.device) # plan for execution device since offloaded vae stays on cpu until its hook moves it
+    else:
+        decoded = model.vae.decode(latents / model.vae.config.scaling_factor, return_dict=False)[0]
 
     # Delete PyTorch VAE after OpenVINO compile
     if shared.opts.cuda_compile and shared.opts.cuda_compile_backend == "openvino_fx" and shared.compiled_model_state.first_pass_vae:
@@ -70,7 +74,17 @@ def full_vae_encode(image, model):
         sd_models.move_model(model.unet, devices.cpu)
     if not shared.cmd_opts.lowvram and not shared.opts.diffusers_seq_cpu_offload and hasattr(model, 'vae'):
         sd_models.move_model(model.vae, devices.device)
-    encoded = model.vae.encode(image.to(model.vae.device, model.vae.dtype)).latent_dist.sample()
+    image = image.to(model.vae.device, model.vae.dtype)
+    if sd_vae_planner.enabled():
+        distribution = []
+        def encode_parameters(x): # blend distribution parameters across tiles and sample once
+            latent_dist = model.vae.encode(x).latent_dist
+            distribution.append(type(latent_dist))
+            return latent_dist.parameters
+        parameters = sd_vae_planner.encode(encode_parameters, image, dtype=model.vae.dtype, device=devices.device)
+        encoded = distribution[0](parameters).sample()
+    else:
+        encoded = model.vae.encode(image).latent_dist.sample()
     if shared.opts.diffusers_move_unet and not getattr(model, 'has_accelerate', False) and hasattr(model, 'unet'):
         sd_models.move_model(model.unet, unet_device)
     return encoded
@@ -80,7 +94,9 @@ def taesd_vae_decode(latents):
     debug(f'VAE decode: name=TAESD images={len(latents)} latents={latents.shape} slicing={shared.opts.diffusers_vae_slicing}')
     if len(latents) == 0:
         return []
-    if shared.opts.diffusers_vae_slicing:
+    if sd_vae_planner.enabled():
+        decoded = sd_vae_planner.decode(sd_vae_taesd.decode, latents, dtype=devices.dtype_vae, device=devices.device, factor=sd_vae_planner.taesd_factor, tiling=False) # taesd is small enough that batch slicing is sufficient
+    elif shared.opts.diffusers_vae_slicing:
         decoded = torch.zeros((len(latents), 3, latents.shape[2] * 8, latents.shape[3] * 8), dtype=devices.dtype_vae, device=devices.device)
         for i in range(latents.shape[0]):
             decoded[i] = sd_vae_taesd.decode(latents[i])
@@ -3,6 +3,7 @@ import io
 import time
 from pydantic import BaseModel, Field # pylint: disable=no-name-in-module
 import modules.shared as shared
+from modules import live_preview
 
 
 current_task = None
@@ -77,15 +78,16 @@ def progressapi(req: ProgressRequest):
     # shared.log.debug(f'Progress: step={step_x}:{step_y} batch={batch_x}:{batch_y} current={current} total={total} progress={progress} elapsed={elapsed} eta={eta}')
 
     id_live_preview = req.id_live_preview
-    live_preview = None
+    preview_data = None
+    live_preview.previewer.subscribe()
     shared.state.set_current_image()
     if shared.opts.live_previews_enable and (shared.state.id_live_preview != req.id_live_preview) and (shared.state.current_image is not None):
         buffered = io.BytesIO()
         shared.state.current_image.save(buffered, format='jpeg')
-        live_preview = f'data:image/jpeg;base64,{base64.b64encode(buffered.getvalue()).decode("ascii")}'
+        preview_data = f'data:image/jpeg;base64,{base64.b64encode(buffered.getvalue()).decode("ascii")}'
         id_live_preview = shared.state.id_live_preview
 
-    res = InternalProgressResponse(job=shared.state.job, active=active, queued=queued, paused=paused, completed=completed, progress=progress, eta=eta, live_preview=live_preview, id_live_preview=id_live_preview, textinfo=shared.state.textinfo)
+    res = InternalProgressResponse(job=shared.state.job, active=active, queued=queued, paused=paused, completed=completed, progress=progress, eta=eta, live_preview=preview_data, id_live_preview=id_live_preview, textinfo=shared.state.textinfo)
     return res
 
 
@@ -0,0 +1,156 @@
+from collections import OrderedDict
+import torch
+from modules import shared, devices
+
+
+state_callbacks = {} # name -> function returning hashable state of anything that modifies text encoder outputs, e.g. loaded lora networks
+
+
+def register_state(name, fn):
+    """register function that returns current state of a component that changes text encoder outputs so cache is invalidated when it changes"""
+    state_callbacks[name] = fn
+
+
+def tensors_size(item) -> int:
+    if isinstance(item, torch.Tensor):
+        return item.numel() * item.element_size()
+    if isinstance(item, (list, tuple)): # includes ScheduledPromptConditioning namedtuples
+        return sum(tensors_size(x) for x in item)
+    if isinstance(item, dict):
+        return sum(tensors_size(x) for x in item.values())
+    return 0
+
+
+def tensors_device(item):
+    """device of first tensor in cached value"""
+    if isinstance(item, torch.Tensor):
+        return item.device
+    items = item.values() if isinstance(item, dict) else item if isinstance(item, (list, tuple)) else []
+    return next((device for device in (tensors_device(x) for x in items) if device is not None), None)
+
+
+def tensors_to(item, device):
+    """copy of cached value with all tensors moved to device, keeps list, tuple, namedtuple and dict structure"""
+    if isinstance(item, torch.Tensor):
+        return item.to(device)
+    if isinstance(item, tuple) and hasattr(item, '_fields'):
+        return type(item)(*[tensors_to(x, device) for x in item])
+    if isinstance(item, (list, tuple)):
+        return type(item)(tensors_to(x, device) for x in item)
+    if isinstance(item, dict):
+        return {k: tensors_to(v, device) for k, v in item.items()}
+    return item
+
+
+def embedding_db():
+    if shared.backend == shared.Backend.DIFFUSERS:
+        return getattr(shared.sd_model, 'embedding_db', None)
+    from modules import sd_hijack
+    return getattr(sd_hijack.model_hijack, 'embedding_db', None)
+
+
+class PromptCache:
+    """
+    LRU cache of text encoder outputs shared between requests and limited by total tensor size
+    entries are stored in system memory so cache does not hold gpu memory and are moved back to original device on hit
+    entries are keyed by prompt text and all settings that affect encoding, cache is cleared when model, text encoders, embeddings or registered states change
+    """
+    def __init__(self):
+        self.items = OrderedDict()
+        self.size = 0
+        self.state = None
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self.items)
+
+    def budget(self):
+        return shared.opts.prompt_cache * 1024 * 1024
+
+    def current_state(self):
+        model = shared.sd_model
+        checkpoint_info = getattr(model, 'sd_checkpoint_info', None)
+        if shared.backend == shared.Backend.DIFFUSERS:
+            encoders = tuple(id(getattr(model, name, None)) for name in ['text_encoder', 'text_encoder_2'])
+        else:
+            encoders = (id(getattr(model, 'cond_stage_model', None)),)
+        db = embedding_db()
+        embeddings = tuple((name, id(embedding)) for name, embedding in db.word_embeddings.items()) if db is not None else ()
+        states = tuple((name, fn()) for name, fn in state_callbacks.items())
+        return (id(model), getattr(checkpoint_info, 'title', None), encoders, hash(embeddings), states)
+
+    def validate(self):
+        state = self.current_state()
+        if state != self.state:
+            if len(self.items) > 0:
+                self.invalidations += 1
+            self.clear()
+            self.state = state
+
+    def key(self, *texts, **kwargs):
+        settings = (shared.opts.prompt_attention, shared.opts.prompt_mean_norm, shared.opts.comma_padding_backtrack, shared.opts.diffusers_pooled, shared.opts.data.get('clip_skip', 1))
+        return texts + tuple(sorted(kwargs.items())) + settings
+
+    def get(self, key):
+        """returns cached value and restores list of used embeddings so infotext matches uncached run"""
+        if self.budget() == 0:
+            return None
+        try:
+            self.validate()
+        except Exception as e:
+            shared.log.error(f'Prompt cache: {e}')
+            self.clear()
+            return None
+        item = self.items.get(key, None)
+        if item is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.items.move_to_end(key)
+        value, embeddings_used, device = item
+        db = embedding_db()
+        if db is not None:
+            db.embeddings_used = list(embeddings_used)
+        return tensors_to(value, device) if device is not None else value
+
+    def put(self, key, value):
+        if self.budget() == 0:
+            return
+        size = tensors_size(value)
+        if size > self.budget():
+            return
+        db = embedding_db()
+        embeddings_used = list(db.embeddings_used) if db is not None else []
+        device = tensors_device(value)
+        self.pop(key)
+        self.items[key] = (tensors_to(value, devices.cpu), embeddings_used, device)
+        self.size += size
+        while self.size > self.budget():
+            self.pop(next(iter(self.items)))
+
+    def pop(self, key):
+        item = self.items.pop(key, None)
+        if item is not None:
+            self.size -= tensors_size(item[0])
+        return item
+
+    def clear(self, *args): # pylint: disable=unused-argument
+        self.items.clear()
+        self.size = 0
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'items': len(self.items),
+            'size': round(self.size / 1024 / 1024, 2),
+            'budget': shared.opts.prompt_cache,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 3) if total > 0 else 0,
+            'invalidations': self.invalidations,
+        }
+
+
+cache = PromptCache()
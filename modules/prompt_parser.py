@@ -9,12 +9,14 @@ sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
 import os
 import re
+import functools
 from collections import namedtuple
 from typing import List
 import lark
 import torch
 from compel import Compel
 from modules.shared import opts, log, backend, Backend
+from modules import prompt_cache
 
 # a prompt like this: "fantasy landscape with a [mountain:lake:0.25] and [an oak:a christmas tree:0.75][ in foreground::0.6][ in background:0.25] [shoddy:masterful:0.5]"
 # will be represented with prompt_schedule like this (assuming steps=100):
@@ -72,6 +74,7 @@ re_attention_v1 = re.compile(r"""
 debug_output = os.environ.get('SD_PROMPT_DEBUG', None)
 debug = log.trace if debug_output is not None else lambda *args, **kwargs: None
 debug('Trace: PROMPT')
+cache_size = 1024 # number of memoized prompt schedules and attention parses
 
 
 def get_learned_conditioning_prompt_schedules(prompts, steps):
@@ -102,6 +105,13 @@ def get_learned_conditioning_prompt_schedules(prompts, steps):
     >>> g("[a|(b:1.1)]")
     [[1, 'a'], [2, '(b:1.1)'], [3, 'a'], [4, '(b:1.1)'], [5, 'a'], [6, '(b:1.1)'], [7, 'a'], [8, '(b:1.1)'], [9, 'a'], [10, '(b:1.1)']]
     """
+    promptdict = {prompt: [list(x) for x in get_schedule(prompt, steps)] for prompt in set(prompts)}
+    return [promptdict[prompt] for prompt in prompts]
+
+
+@functools.lru_cache(maxsize=cache_size)
+def get_schedule(prompt, steps):
+    """parses prompt and returns its schedule as tuple of (end_at_step, text), memoized since same prompts are parsed on every request"""
 
     def collect_steps(steps, tree):
         res = [steps]
@@ -139,15 +149,11 @@ def get_learned_conditioning_prompt_schedules(prompts, steps):
                     yield child
         return AtStep().transform(tree)
 
-    def get_schedule(prompt):
-        try:
-            tree = schedule_parser.parse(prompt)
-        except lark.exceptions.LarkError:
-            return [[steps, prompt]]
-        return [[t, at_step(t, tree)] for t in collect_steps(steps, tree)]
-
-    promptdict = {prompt: get_schedule(prompt) for prompt in set(prompts)}
-    return [promptdict[prompt] for prompt in prompts]
+    try:
+        tree = schedule_parser.parse(prompt)
+    except lark.exceptions.LarkError:
+        return ((steps, prompt),)
+    return tuple((t, at_step(t, tree)) for t in collect_steps(steps, tree))
 
 
 def get_learned_conditioning(model, prompts, steps):
@@ -172,14 +178,21 @@ def get_learned_conditioning(model, prompts, steps):
         if cached is not None:
             res.append(cached)
             continue
+        cache_key = prompt_cache.cache.key(prompt, steps=steps)
+        cached = prompt_cache.cache.get(cache_key)
+        if cached is not None:
+            cache[prompt] = cached
+            res.append(cached)
+            continue
         texts = [x[1] for x in prompt_schedule]
         conds = model.get_learned_conditioning(texts)
         cond_schedule = []
         for i, (end_at_step, _text) in enumerate(prompt_schedule):
             cond_schedule.append(ScheduledPromptConditioning(end_at_step, conds[i]))
         cache[prompt] = cond_schedule
+        prompt_cache.cache.put(cache_key, cond_schedule)
         res.append(cond_schedule)
-    return res
+    return ScheduledConditioningBatch(res)
 
 
 def get_multicond_prompt_list(prompts):
@@ -203,6 +216,11 @@ def get_multicond_prompt_list(prompts):
     return res_indexes, prompt_flat_list, prompt_indexes
 
 
+class ScheduledConditioningBatch(list):
+    """list of per-prompt ScheduledPromptConditioning schedules which holds last reconstructed batch so it is released together with conds"""
+    cache = None # (schedule indexes, batch tensor) of last reconstruct_cond_batch call
+
+
 class ComposableScheduledPromptConditioning:
     def __init__(self, schedules, weight=1.0):
         self.schedules: List[ScheduledPromptConditioning] = schedules
@@ -213,6 +231,7 @@ class MulticondLearnedConditioning:
     def __init__(self, shape, batch):
         self.shape: tuple = shape  # the shape field is needed to send this object to DDIM/PLMS
         self.batch: List[List[ComposableScheduledPromptConditioning]] = batch
+        self.cache = None # (schedule indexes, conds_list, batch tensor) of last reconstruct_multicond_batch call
 
 
 def get_multicond_learned_conditioning(model, prompts, steps) -> MulticondLearnedConditioning:
@@ -228,33 +247,40 @@ def get_multicond_learned_conditioning(model, prompts, steps) -> MulticondLearne
     return MulticondLearnedConditioning(shape=(len(prompts),), batch=res)
 
 
+def schedule_index(schedule, current_step):
+    for current, entry in enumerate(schedule):
+        if current_step <= entry.end_at_step:
+            return current
+    return 0
+
+
 def reconstruct_cond_batch(c: List[List[ScheduledPromptConditioning]], current_step):
+    indexes = tuple(schedule_index(cond_schedule, current_step) for cond_schedule in c)
+    cached = getattr(c, 'cache', None)
+    if cached is not None and cached[0] == indexes:
+        return cached[1]
     param = c[0][0].cond
     res = torch.zeros((len(c),) + param.shape, device=param.device, dtype=param.dtype)
     for i, cond_schedule in enumerate(c):
-        target_index = 0
-        for current, (end_at, _cond) in enumerate(cond_schedule):
-            if current_step <= end_at:
-                target_index = current
-                break
-        res[i] = cond_schedule[target_index].cond
+        res[i] = cond_schedule[indexes[i]].cond
+    if isinstance(c, ScheduledConditioningBatch): # plain lists built by callers are not cached
+        c.cache = (indexes, res)
     return res
 
 
 def reconstruct_multicond_batch(c: MulticondLearnedConditioning, current_step):
+    indexes = tuple(schedule_index(composable_prompt.schedules, current_step) for composable_prompts in c.batch for composable_prompt in composable_prompts)
+    cached = getattr(c, 'cache', None)
+    if cached is not None and cached[0] == indexes:
+        return cached[1], cached[2]
     param = c.batch[0][0].schedules[0].cond
     tensors = []
     conds_list = []
     for composable_prompts in c.batch:
         conds_for_batch = []
         for composable_prompt in composable_prompts:
-            target_index = 0
-            for current, entry in enumerate(composable_prompt.schedules):
-                if current_step <= entry.end_at_step:
-                    target_index = current
-                    break
             conds_for_batch.append((len(tensors), composable_prompt.weight))
-            tensors.append(composable_prompt.schedules[target_index].cond)
+            tensors.append(composable_prompt.schedules[indexes[len(tensors)]].cond)
         conds_list.append(conds_for_batch)
     # if prompts have wildly different lengths above the limit we'll get tensors fo different shapes and won't be able to torch.stack them. So this fixes that.
     token_count = max([x.shape[0] for x in tensors])
@@ -263,7 +289,9 @@ def reconstruct_multicond_batch(c: MulticondLearnedConditioning, current_step):
             last_vector = tensors[i][-1:]
             last_vector_repeated = last_vector.repeat([token_count - tensors[i].shape[0], 1])
             tensors[i] = torch.vstack([tensors[i], last_vector_repeated])
-    return conds_list, torch.stack(tensors).to(device=param.device, dtype=param.dtype)
+    res = torch.stack(tensors).to(device=param.device, dtype=param.dtype)
+    c.cache = (indexes, conds_list, res)
+    return conds_list, res
 
 
 def parse_prompt_attention(text):
@@ -300,23 +328,29 @@ def parse_prompt_attention(text):
      ['sky', 1.4641000000000006],
      ['.', 1.1]]
     """
+    return [list(x) for x in parse_attention(text, opts.prompt_attention, backend)]
+
+
+@functools.lru_cache(maxsize=cache_size)
+def parse_attention(text, parser, backend): # pylint: disable=redefined-outer-name
+    """memoized implementation of parse_prompt_attention for specific parser and backend, returns tuple of (text, weight)"""
     res = []
     round_brackets = []
     square_brackets = []
-    if opts.prompt_attention == 'Fixed attention':
+    if parser == 'Fixed attention':
         res = [[text, 1.0]]
-        debug(f'Prompt: parser={opts.prompt_attention} {res}')
-        return res
-    elif opts.prompt_attention == 'Compel parser':
+        debug(f'Prompt: parser={parser} {res}')
+        return tuple(tuple(x) for x in res)
+    elif parser == 'Compel parser':
         conjunction = Compel.parse_prompt_string(text)
         if conjunction is None or conjunction.prompts is None or conjunction.prompts is None or len(conjunction.prompts[0].children) == 0:
-            return [["", 1.0]]
+            return (("", 1.0),)
         res = []
         for frag in conjunction.prompts[0].children:
             res.append([frag.text, frag.weight])
-        debug(f'Prompt: parser={opts.prompt_attention} {res}')
-        return res
-    elif opts.prompt_attention == 'A1111 parser':
+        debug(f'Prompt: parser={parser} {res}')
+        return tuple(tuple(x) for x in res)
+    elif parser == 'A1111 parser':
         re_attention = re_attention_v1
         whitespace = ''
     else:
@@ -355,7 +389,7 @@ def parse_prompt_attention(text):
                 for i, part in enumerate(parts):
                     if i > 0:
                         res.append(["BREAK", -1])
-                    if opts.prompt_attention == 'Full parser':
+                    if parser == 'Full parser':
                         part = re_clean.sub("", part)
                         part = re_whitespace.sub(" ", part).strip()
                         if len(part) == 0:
@@ -377,8 +411,8 @@ def parse_prompt_attention(text):
             res.pop(i + 1)
         else:
             i += 1
-    debug(f'Prompt: parser={opts.prompt_attention} {res}')
-    return res
+    debug(f'Prompt: parser={parser} {res}')
+    return tuple(tuple(x) for x in res)
 
 if __name__ == "__main__":
     input_text = '[black] [[grey]] (white) ((gray)) ((orange:1.1) yellow) ((purple) and [dark] red:1.1) [mouse:0.2] [(cat:1.1):0.5]'
@@ -1,11 +1,12 @@
 import os
+import math
 import time
 import typing
 import torch
 from compel import ReturnedEmbeddingsType
-from compel.embeddings_provider import BaseTextualInversionManager, EmbeddingsProvider
+from compel.embeddings_provider import BaseTextualInversionManager, EmbeddingsProvider, DownweightMode
 from transformers import PreTrainedTokenizer
-from modules import shared, prompt_parser, devices
+from modules import shared, prompt_parser, prompt_cache, devices
 
 debug = shared.log.trace if os.environ.get('SD_PROMPT_DEBUG', None) is not None else lambda *args, **kwargs: None
 debug('Trace: PROMPT')
@@ -15,6 +16,7 @@ CLIP_SKIP_MAPPING = {
     1: ReturnedEmbeddingsType.LAST_HIDDEN_STATES_NORMALIZED,
     2: ReturnedEmbeddingsType.PENULTIMATE_HIDDEN_STATES_NORMALIZED,
 }
+max_batch_chunks = 32 # max number of 77-token chunks encoded in single text encoder pass
 
 
 # from https://github.com/damian0815/compel/blob/main/src/compel/diffusers_textual_inversion_manager.py
@@ -82,33 +84,45 @@ def encode_prompts(pipe, p, prompts: list, negative_prompts: list, steps: int,
         return None, None, None, None
     else:
         t0 = time.time()
-        positive_schedule, scheduled = get_prompt_schedule(prompts[0], steps)
-        negative_schedule, neg_scheduled = get_prompt_schedule(negative_prompts[0], steps)
-        p.scheduled_prompt = scheduled or neg_scheduled
+        negative_prompts = [negative_prompts[i % len(negative_prompts)] for i in range(len(prompts))]
+        positive_schedules, scheduled = zip(*[get_prompt_schedule(prompt, steps) for prompt in prompts])
+        negative_schedules, neg_scheduled = zip(*[get_prompt_schedule(prompt, steps) for prompt in negative_prompts])
+        p.scheduled_prompt = any(scheduled) or any(neg_scheduled)
         p.prompt_embeds = []
         p.positive_pooleds = []
         p.negative_embeds = []
         p.negative_pooleds = []
 
         cache = {}
-        for i in range(max(len(positive_schedule), len(negative_schedule))):
-            positive_prompt = positive_schedule[i % len(positive_schedule)]
-            negative_prompt = negative_schedule[i % len(negative_schedule)]
-            results = cache.get(positive_prompt + negative_prompt, None)
-
-            if results is None:
-                results = get_weighted_text_embeddings(pipe, positive_prompt, negative_prompt, clip_skip)
-                cache[positive_prompt + negative_prompt] = results
-
-            prompt_embed, positive_pooled, negative_embed, negative_pooled = results
-            if prompt_embed is not None:
-                p.prompt_embeds.append(torch.cat([prompt_embed] * len(prompts), dim=0))
-            if negative_embed is not None:
-                p.negative_embeds.append(torch.cat([negative_embed] * len(negative_prompts), dim=0))
-            if positive_pooled is not None:
-                p.positive_pooleds.append(torch.cat([positive_pooled] * len(prompts), dim=0))
-            if negative_pooled is not None:
-                p.negative_pooleds.append(torch.cat([negative_pooled] * len(negative_prompts), dim=0))
+        encoders = (id(getattr(pipe, 'text_encoder', None)), id(getattr(pipe, 'text_encoder_2', None)))
+        for i in range(max(len(schedule) for schedule in positive_schedules + negative_schedules)):
+            batch = [(positive_schedule[i % len(positive_schedule)], negative_schedule[i % len(negative_schedule)]) for positive_schedule, negative_schedule in zip(positive_schedules, negative_schedules)]
+            missing = []
+            for pair in dict.fromkeys(batch): # unique pairs in batch order
+                if pair in cache:
+                    continue
+                results = prompt_cache.cache.get(prompt_cache.cache.key(*pair, encoders=encoders, clip_skip=clip_skip))
+                if results is None:
+                    missing.append(pair)
+                else:
+                    cache[pair] = results
+            if len(missing) > 0: # all distinct prompts in batch are encoded together
+                for pair, results in zip(missing, get_batched_text_embeddings(pipe, missing, clip_skip)):
+                    prompt_cache.cache.put(prompt_cache.cache.key(*pair, encoders=encoders, clip_skip=clip_skip), results)
+                    cache[pair] = results
+
+            prompt_embeds, positive_pooleds, negative_embeds, negative_pooleds = zip(*[cache[pair] for pair in batch])
+            if len({x.shape[1] for x in prompt_embeds + negative_embeds}) > 1: # distinct prompts can have different number of chunks
+                embeds = pad_to_same_length(pipe, list(prompt_embeds + negative_embeds))
+                prompt_embeds, negative_embeds = embeds[:len(batch)], embeds[len(batch):]
+            if prompt_embeds[0] is not None:
+                p.prompt_embeds.append(torch.cat(prompt_embeds, dim=0))
+            if negative_embeds[0] is not None:
+                p.negative_embeds.append(torch.cat(negative_embeds, dim=0))
+            if positive_pooleds[0] is not None:
+                p.positive_pooleds.append(torch.cat(positive_pooleds, dim=0))
+            if negative_pooleds[0] is not None:
+                p.negative_pooleds.append(torch.cat(negative_pooleds, dim=0))
         debug(f"Prompt Parser: Elapsed Time {time.time() - t0}")
         return
 
@@ -123,7 +137,12 @@ def get_prompts_with_weights(prompt: str):
     return texts, text_weights
 
 
+def encoders_key(pipe):
+    return tuple(id(getattr(pipe, name, None)) for name in ['tokenizer', 'text_encoder', 'tokenizer_2', 'text_encoder_2'])
+
+
 def prepare_embedding_providers(pipe, clip_skip):
+    """providers only hold references to tokenizers and text encoders so they are created once and stored on pipeline per text encoders, embedding type and device"""
     device = pipe.device if str(pipe.device) != 'meta' else devices.device
     embeddings_providers = []
     if 'XL' in pipe.__class__.__name__:
@@ -133,6 +152,10 @@ def prepare_embedding_providers(pipe, clip_skip):
             shared.log.warning(f"Prompt parser unsupported: clip_skip={clip_skip}")
             clip_skip = 2
         embedding_type = CLIP_SKIP_MAPPING[clip_skip]
+    key = (encoders_key(pipe), embedding_type, str(device))
+    cached = getattr(pipe, 'embedding_providers', None) or {}
+    if key in cached:
+        return cached[key]
     if hasattr(pipe, "tokenizer") and hasattr(pipe, "text_encoder"):
         provider = EmbeddingsProvider(tokenizer=pipe.tokenizer, text_encoder=pipe.text_encoder, truncate=False,
                                       returned_embeddings_type=embedding_type, device=device)
@@ -141,99 +164,201 @@ def prepare_embedding_providers(pipe, clip_skip):
         provider = EmbeddingsProvider(tokenizer=pipe.tokenizer_2, text_encoder=pipe.text_encoder_2, truncate=False,
                                       returned_embeddings_type=embedding_type, device=device)
         embeddings_providers.append(provider)
+    pipe.embedding_providers = {k: v for k, v in cached.items() if k[0] == key[0]} # drop providers for replaced text encoders
+    pipe.embedding_providers[key] = embeddings_providers
     return embeddings_providers
 
 
-def pad_to_same_length(pipe, embeds):
+def get_empty_embeds(pipe, kind, fn):
+    """
+    encoded empty prompt only depends on text encoders so it is calculated once and stored on pipeline
+    invalidated together with prompt cache when model, text encoders, embeddings or loaded networks change
+    """
+    device = pipe.device if str(pipe.device) != 'meta' else devices.device
+    state = (encoders_key(pipe), str(device), prompt_cache.cache.current_state())
+    cached = getattr(pipe, 'empty_embeds', None)
+    if cached is None or cached[0] != state:
+        cached = (state, {})
+        pipe.empty_embeds = cached
+    if kind not in cached[1]:
+        cached[1][kind] = fn()
+    return cached[1][kind]
+
+
+def encode_empty_prompt(pipe):
     device = pipe.device if str(pipe.device) != 'meta' else devices.device
     try:  # SDXL
-        empty_embed = pipe.encode_prompt("")
+        return pipe.encode_prompt("")
     except TypeError:  # SD1.5
-        empty_embed = pipe.encode_prompt("", device, 1, False)
+        return pipe.encode_prompt("", device, 1, False)
+
+
+def pad_to_same_length(pipe, embeds):
+    empty_embed = get_empty_embeds(pipe, 'prompt', lambda: encode_empty_prompt(pipe))
     max_token_count = max([embed.shape[1] for embed in embeds])
-    repeats = max_token_count - min([embed.shape[1] for embed in embeds])
-    empty_batched = empty_embed[0].to(embeds[0].device).repeat(embeds[0].shape[0], repeats // empty_embed[0].shape[1], 1)
     for i, embed in enumerate(embeds):
         if embed.shape[1] < max_token_count:
-            embed = torch.cat([embed, empty_batched], dim=1)
-            embeds[i] = embed
+            repeats = max_token_count - embed.shape[1]
+            empty_batched = empty_embed[0].to(embed.device).repeat(embed.shape[0], repeats // empty_embed[0].shape[1], 1)
+            embeds[i] = torch.cat([embed, empty_batched], dim=1)
     return embeds
 
 
+def get_pooled_embeds(pipe, provider, text, device):
+    if text == '':
+        return get_empty_embeds(pipe, ('pooled', id(provider)), lambda: provider.get_pooled_embeddings(texts=[text], device=device))
+    return provider.get_pooled_embeddings(texts=[text], device=device)
+
+
+def encode_sections(provider: EmbeddingsProvider, sections: list, device):
+    """
+    batched equivalent of compel get_embeddings_for_weighted_prompt_fragments for list of (fragments, weights) sections
+    all 77-token chunks of all sections including masked variants used for downweighted fragments are encoded together
+    in as few text encoder passes as possible and results are weighted and blended per section exactly like compel does
+    returns list of (embeds, tokens) per section
+    """
+    if len(sections) == 0:
+        return []
+    private = hasattr(provider, '_get_token_ranges_for_fragments') and hasattr(provider, '_encode_token_ids_to_embeddings') # batching relies on compel internals
+    if provider.downweight_mode != DownweightMode.MASK or not private:
+        return [provider.get_embeddings_for_weighted_prompt_fragments(text_batch=[fragments], fragment_weights_batch=[weights], device=device, should_return_tokens=True) for fragments, weights in sections]
+    chunk_length = provider.max_token_count
+    empty_ids = torch.tensor([provider.tokenizer.bos_token_id] + [provider.tokenizer.eos_token_id] + [provider.tokenizer.pad_token_id] * (chunk_length - 2), dtype=torch.long, device=device)
+    rows_ids = [empty_ids.unsqueeze(0)]
+    rows_mask = [torch.ones_like(empty_ids).unsqueeze(0)]
+    jobs = []
+    for fragments, weights in sections:
+        tokens, per_token_weights, mask = provider.get_token_ids_and_expand_weights(fragments, weights, device=device)
+        variants = [(mask, 1.0)]
+        ranges = provider._get_token_ranges_for_fragments(tokens.tolist(), fragments) # pylint: disable=protected-access
+        for index, (start, end) in enumerate(ranges):
+            if weights[index] >= 1:
+                continue
+            mask_without_fragment = mask.clone()
+            mask_without_fragment[start:end + 1] = 0
+            if not provider.truncate_to_model_max_length: # do not mask chunk-delimiting bos/eos markers
+                mask_without_fragment[0::chunk_length] = 1
+                mask_without_fragment[chunk_length - 1::chunk_length] = 1
+            variants.append((mask_without_fragment, math.tan((1.0 - max(1e-5, weights[index])) * math.pi / 2)))
+        jobs.append((tokens, per_token_weights, variants, sum(x.shape[0] for x in rows_ids)))
+        for variant_mask, _lerp_weight in variants:
+            rows_ids.append(tokens.view(-1, chunk_length))
+            rows_mask.append(variant_mask.view(-1, chunk_length))
+    ids = torch.cat(rows_ids, dim=0)
+    masks = torch.cat(rows_mask, dim=0)
+    z = torch.cat([provider._encode_token_ids_to_embeddings(ids[i:i + max_batch_chunks], masks[i:i + max_batch_chunks]) for i in range(0, ids.shape[0], max_batch_chunks)], dim=0) # pylint: disable=protected-access
+    empty_z = z[0:1]
+    results = []
+    for tokens, per_token_weights, variants, row in jobs:
+        chunks = tokens.shape[0] // chunk_length
+        weights_expanded = per_token_weights.view(chunks, chunk_length, 1).expand(chunks, chunk_length, z.shape[-1]).to(z)
+        embeddings = []
+        for k in range(len(variants)):
+            variant_z = z[row + k * chunks:row + (k + 1) * chunks]
+            weighted_z = empty_z + ((variant_z - empty_z) * weights_expanded)
+            embeddings.append(weighted_z.reshape(1, -1, z.shape[-1]))
+        embeddings = torch.stack(embeddings, dim=1)
+        lerped = provider.apply_embedding_weights(embeddings, [lerp_weight for _mask, lerp_weight in variants], normalize=True).squeeze(0)
+        results.append((lerped.unsqueeze(0), tokens.unsqueeze(0)))
+    return results
+
+
 def get_weighted_text_embeddings(pipe, prompt: str = "", neg_prompt: str = "", clip_skip: int = None):
+    return get_batched_text_embeddings(pipe, [(prompt, neg_prompt)], clip_skip)[0]
+
+
+def get_batched_text_embeddings(pipe, pairs: list, clip_skip: int = None):
+    """
+    encodes list of (prompt, negative prompt) pairs: all sections of all prompts are encoded with one batched pass per text encoder
+    returns list of (prompt_embeds, pooled_prompt_embeds, negative_prompt_embeds, negative_pooled_prompt_embeds) per pair
+    """
     device = pipe.device if str(pipe.device) != 'meta' else devices.device
-    prompt_2 = prompt.split("TE2:")[-1]
-    neg_prompt_2 = neg_prompt.split("TE2:")[-1]
-    prompt = prompt.split("TE2:")[0]
-    neg_prompt = neg_prompt.split("TE2:")[0]
-
-    ps = [get_prompts_with_weights(p) for p in [prompt, prompt_2]]
-    positives, positive_weights = zip(*ps)
-    ns = [get_prompts_with_weights(p) for p in [neg_prompt, neg_prompt_2]]
-    negatives, negative_weights = zip(*ns)
-    if hasattr(pipe, "tokenizer_2") and not hasattr(pipe, "tokenizer"):
-        positives.pop(0)
-        positive_weights.pop(0)
-        negatives.pop(0)
-        negative_weights.pop(0)
+    parsed = []
+    for prompt, neg_prompt in pairs:
+        prompt_2 = prompt.split("TE2:")[-1]
+        neg_prompt_2 = neg_prompt.split("TE2:")[-1]
+        prompt = prompt.split("TE2:")[0]
+        neg_prompt = neg_prompt.split("TE2:")[0]
+        ps = [get_prompts_with_weights(p) for p in [prompt, prompt_2]]
+        ns = [get_prompts_with_weights(p) for p in [neg_prompt, neg_prompt_2]]
+        if hasattr(pipe, "tokenizer_2") and not hasattr(pipe, "tokenizer"):
+            ps = ps[1:]
+            ns = ns[1:]
+        parsed.append((prompt_2, neg_prompt_2, ps, ns))
 
     embedding_providers = prepare_embedding_providers(pipe, clip_skip)
-    prompt_embeds = []
-    negative_prompt_embeds = []
-    pooled_prompt_embeds = None
-    negative_pooled_prompt_embeds = None
-    for i in range(len(embedding_providers)):
-        # add BREAK keyword that splits the prompt into multiple fragments
-        text = list(positives[i])
-        weights = list(positive_weights[i])
-        text.append('BREAK')
-        weights.append(-1)
-        provider_embed = []
-        while 'BREAK' in text:
-            pos = text.index('BREAK')
-            debug(f'Prompt: section="{text[:pos]}" len={len(text[:pos])} weights={weights[:pos]}')
-            if len(text[:pos]) > 0:
-                embed, ptokens = embedding_providers[i].get_embeddings_for_weighted_prompt_fragments(
-                    text_batch=[text[:pos]], fragment_weights_batch=[weights[:pos]], device=device,
-                    should_return_tokens=True)
-                provider_embed.append(embed)
-            text = text[pos + 1:]
-            weights = weights[pos + 1:]
-        prompt_embeds.append(torch.cat(provider_embed, dim=1))
-        debug(f'Prompt: positive unpadded shape = {prompt_embeds[0].shape}')
-        # negative prompt has no keywords
-        embed, ntokens = embedding_providers[i].get_embeddings_for_weighted_prompt_fragments(text_batch=[negatives[i]],
-                                                                                             fragment_weights_batch=[
-                                                                                                 negative_weights[i]],
-                                                                                             device=device,
-                                                                                             should_return_tokens=True)
-        negative_prompt_embeds.append(embed)
-
-    if prompt_embeds[-1].shape[-1] > 768:
+    prompt_embeds = [[] for _pair in pairs]
+    negative_prompt_embeds = [[] for _pair in pairs]
+    ptokens = [None for _pair in pairs]
+    ntokens = [None for _pair in pairs]
+    for i, provider in enumerate(embedding_providers):
+        sections = []
+        positive_sections = []
+        negative_sections = []
+        for _prompt_2, _neg_prompt_2, ps, ns in parsed:
+            # add BREAK keyword that splits the prompt into multiple fragments
+            text = list(ps[i][0])
+            weights = list(ps[i][1])
+            text.append('BREAK')
+            weights.append(-1)
+            indexes = []
+            while 'BREAK' in text:
+                pos = text.index('BREAK')
+                debug(f'Prompt: section="{text[:pos]}" len={len(text[:pos])} weights={weights[:pos]}')
+                if len(text[:pos]) > 0:
+                    indexes.append(len(sections))
+                    sections.append((text[:pos], weights[:pos]))
+                text = text[pos + 1:]
+                weights = weights[pos + 1:]
+            positive_sections.append(indexes)
+            # negative prompt has no keywords
+            if ''.join(ns[i][0]) == '' and all(w == 1 for w in ns[i][1]):
+                negative_sections.append(None)
+            else:
+                negative_sections.append(len(sections))
+                sections.append((list(ns[i][0]), list(ns[i][1])))
+        encoded = encode_sections(provider, sections, device)
+        for j, _pair in enumerate(pairs):
+            prompt_embeds[j].append(torch.cat([encoded[k][0] for k in positive_sections[j]], dim=1))
+            ptokens[j] = encoded[positive_sections[j][-1]][1]
+            debug(f'Prompt: positive unpadded shape = {prompt_embeds[j][0].shape}')
+            if negative_sections[j] is None:
+                embed, ntokens[j] = get_empty_embeds(pipe, ('negative', i, id(provider)), lambda provider=provider: encode_sections(provider, [([''], [1.0])], device)[0])
+            else:
+                embed, ntokens[j] = encoded[negative_sections[j]]
+            negative_prompt_embeds[j].append(embed)
+
+    pooled_prompt_embeds = [None for _pair in pairs]
+    negative_pooled_prompt_embeds = [None for _pair in pairs]
+    if prompt_embeds[0][-1].shape[-1] > 768:
         if shared.opts.diffusers_pooled == "weighted":
-            pooled_prompt_embeds = prompt_embeds[-1][
-                torch.arange(prompt_embeds[-1].shape[0], device=device),
-                (ptokens.to(dtype=torch.int, device=device) == 49407)
-                .int()
-                .argmax(dim=-1),
-            ]
-            negative_pooled_prompt_embeds = negative_prompt_embeds[-1][
-                torch.arange(negative_prompt_embeds[-1].shape[0], device=device),
-                (ntokens.to(dtype=torch.int, device=device) == 49407)
-                .int()
-                .argmax(dim=-1),
-            ]
+            for j, _pair in enumerate(pairs):
+                pooled_prompt_embeds[j] = prompt_embeds[j][-1][
+                    torch.arange(prompt_embeds[j][-1].shape[0], device=device),
+                    (ptokens[j].to(dtype=torch.int, device=device) == 49407)
+                    .int()
+                    .argmax(dim=-1),
+                ]
+                negative_pooled_prompt_embeds[j] = negative_prompt_embeds[j][-1][
+                    torch.arange(negative_prompt_embeds[j][-1].shape[0], device=device),
+                    (ntokens[j].to(dtype=torch.int, device=device) == 49407)
+                    .int()
+                    .argmax(dim=-1),
+                ]
         else:
-            pooled_prompt_embeds = embedding_providers[-1].get_pooled_embeddings(texts=[prompt_2], device=device) if \
-                prompt_embeds[-1].shape[-1] > 768 else None
-            negative_pooled_prompt_embeds = embedding_providers[-1].get_pooled_embeddings(texts=[neg_prompt_2],
-                                                                                          device=device) if \
-                negative_prompt_embeds[-1].shape[-1] > 768 else None
-
-    prompt_embeds = torch.cat(prompt_embeds, dim=-1) if len(prompt_embeds) > 1 else prompt_embeds[0]
-    negative_prompt_embeds = torch.cat(negative_prompt_embeds, dim=-1) if len(negative_prompt_embeds) > 1 else \
-        negative_prompt_embeds[0]
-    debug(f'Prompt: shape={prompt_embeds.shape} negative={negative_prompt_embeds.shape}')
-    if prompt_embeds.shape[1] != negative_prompt_embeds.shape[1]:
-        [prompt_embeds, negative_prompt_embeds] = pad_to_same_length(pipe, [prompt_embeds, negative_prompt_embeds])
-    return prompt_embeds, pooled_prompt_embeds, negative_prompt_embeds, negative_pooled_prompt_embeds
+            texts = list(dict.fromkeys([x for prompt_2, neg_prompt_2, _ps, _ns in parsed for x in [prompt_2, neg_prompt_2] if x != '']))
+            pooled = embedding_providers[-1].get_pooled_embeddings(texts=texts, device=device) if len(texts) > 0 else None
+            pooled = {text: pooled[k:k + 1] for k, text in enumerate(texts)}
+            for j, (prompt_2, neg_prompt_2, _ps, _ns) in enumerate(parsed):
+                pooled_prompt_embeds[j] = pooled[prompt_2] if prompt_2 != '' else get_pooled_embeds(pipe, embedding_providers[-1], prompt_2, device)
+                negative_pooled_prompt_embeds[j] = pooled[neg_prompt_2] if neg_prompt_2 != '' else get_pooled_embeds(pipe, embedding_providers[-1], neg_prompt_2, device)
+
+    results = []
+    for j, _pair in enumerate(pairs):
+        positive = torch.cat(prompt_embeds[j], dim=-1) if len(prompt_embeds[j]) > 1 else prompt_embeds[j][0]
+        negative = torch.cat(negative_prompt_embeds[j], dim=-1) if len(negative_prompt_embeds[j]) > 1 else negative_prompt_embeds[j][0]
+        debug(f'Prompt: shape={positive.shape} negative={negative.shape}')
+        if positive.shape[1] != negative.shape[1]:
+            [positive, negative] = pad_to_same_length(pipe, [positive, negative])
+        results.append((positive, pooled_prompt_embeds[j], negative, negative_pooled_prompt_embeds[j]))
+    return results
@@ -17,7 +17,7 @@ with contextlib.redirect_stdout(stdout):
     import ldm.modules.encoders.modules
 
 import modules.textual_inversion.textual_inversion
-from modules import devices, sd_hijack_optimizations
+from modules import devices, sd_hijack_optimizations, sd_hijack_autotune
 from modules import sd_hijack_clip, sd_hijack_open_clip, sd_hijack_unet, sd_hijack_xlmr, xlmr
 from modules.hypernetworks import hypernetwork
 
@@ -75,6 +75,10 @@ def apply_optimizations():
     if shared.opts.cross_attention_optimization == "InvokeAI's":
         ldm.modules.attention.CrossAttention.forward = sd_hijack_optimizations.split_cross_attention_forward_invokeAI
         optimization_method = 'invokeai'
+    if shared.opts.cross_attention_optimization == "Autotune":
+        ldm.modules.attention.CrossAttention.forward = sd_hijack_autotune.autotune_attention_forward
+        ldm.modules.diffusionmodules.model.AttnBlock.forward = sd_hijack_optimizations.sdp_attnblock_forward if can_use_sdp else sd_hijack_optimizations.cross_attention_attnblock_forward
+        optimization_method = 'autotune'
     if shared.opts.cross_attention_optimization == "Doggettx's":
         ldm.modules.attention.CrossAttention.forward = sd_hijack_optimizations.split_cross_attention_forward
         ldm.modules.diffusionmodules.model.AttnBlock.forward = sd_hijack_optimizations.cross_attention_attnblock_forward
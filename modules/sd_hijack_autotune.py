@@ -0,0 +1,98 @@
+"""
+attention backend autotuner
+available attention implementations and sub-quadratic chunk sizes are benchmarked on first call with given shape and winner is used for all following calls with same shape
+winners are persisted in cache file per device, dtype and shape so tuning runs only once
+"""
+import time
+import functools
+import torch
+from modules import shared, devices, hashes, sd_hijack_optimizations
+
+
+repeats = 3
+q_chunk_sizes = [256, 512, 1024, 2048]
+fallback_order = ['sdp', 'xformers', f'sub-quadratic-{q_chunk_sizes[1]}', 'doggettx']
+available = None
+
+
+def candidates():
+    global available # pylint: disable=global-statement
+    if available is None:
+        available = {}
+        if hasattr(torch.nn.functional, "scaled_dot_product_attention") and devices.device.type != 'cpu':
+            available['sdp'] = sd_hijack_optimizations.scaled_dot_product_attention_forward
+            if devices.device.type == 'cuda':
+                available['sdp-no-mem'] = sd_hijack_optimizations.scaled_dot_product_no_mem_attention_forward
+        if shared.xformers_available and devices.device.type != 'cpu':
+            available['xformers'] = sd_hijack_optimizations.xformers_attention_forward
+        available['doggettx'] = sd_hijack_optimizations.split_cross_attention_forward
+        available['invokeai'] = sd_hijack_optimizations.split_cross_attention_forward_invokeAI
+        available['v1'] = sd_hijack_optimizations.split_cross_attention_forward_v1
+        for size in q_chunk_sizes:
+            available[f'sub-quadratic-{size}'] = functools.partial(sd_hijack_optimizations.sub_quad_attention_forward, q_chunk_size=size)
+        shared.log.debug(f'Attention autotune: candidates={list(available)}')
+    return available
+
+
+def fallback():
+    fns = candidates()
+    return next(name for name in fallback_order if name in fns)
+
+
+def masked_attention_forward(self, x, context, mask):
+    """sdp is only implementation which applies mask and torch sdpa also works on cpu where it is not a candidate, others ignore mask and sub-quadratic asserts"""
+    if hasattr(torch.nn.functional, "scaled_dot_product_attention"):
+        return sd_hijack_optimizations.scaled_dot_product_attention_forward(self, x, context, mask)
+    return sd_hijack_optimizations.split_cross_attention_forward(self, x, context, mask) # mask is ignored same as without autotune
+
+
+def device_name(device):
+    if device.type == 'cuda':
+        return torch.cuda.get_device_name(device)
+    return device.type
+
+
+def shape_key(self, x, context):
+    tokens = context.shape[1] if context is not None else x.shape[1]
+    dtype = torch.get_autocast_gpu_dtype() if torch.is_autocast_enabled() else x.dtype
+    return f'{device_name(x.device)}:{torch.__version__}:{dtype}:{x.shape[0]}x{x.shape[1]}x{x.shape[2]}:{tokens}:{self.heads}'
+
+
+def synchronize(device):
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+
+
+def tune(self, x, context, mask, key):
+    results = {}
+    for name, fn in candidates().items():
+        try:
+            fn(self, x, context, mask) # warmup
+            synchronize(x.device)
+            t0 = time.perf_counter()
+            for _i in range(repeats):
+                fn(self, x, context, mask)
+            synchronize(x.device)
+            results[name] = (time.perf_counter() - t0) / repeats
+        except Exception as e: # e.g. oom or unsupported shape
+            shared.log.debug(f'Attention autotune: shape={key} candidate={name} {e}')
+            devices.torch_gc()
+    winner = min(results, key=results.get) if len(results) > 0 else fallback()
+    shared.log.info(f'Attention autotune: shape={key} winner={winner} time={1000 * results.get(winner, 0):.2f}ms candidates={len(results)}')
+    winners = hashes.cache('attention-autotune')
+    winners[key] = winner
+    hashes.dump_cache()
+    return winner
+
+
+def autotune_attention_forward(self, x, context=None, mask=None):
+    fns = candidates()
+    if mask is not None: # winners are tuned without mask and may not support it
+        return masked_attention_forward(self, x, context, mask)
+    key = shape_key(self, x, context)
+    name = hashes.cache('attention-autotune').get(key, None)
+    if name not in fns:
+        if torch.is_grad_enabled(): # timings under autograd do not represent inference
+            return fns[fallback()](self, x, context, mask)
+        name = tune(self, x, context, mask, key)
+    return fns[name](self, x, context, mask)
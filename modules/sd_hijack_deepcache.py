@@ -0,0 +1,97 @@
+# credits: DeepCache <https://github.com/horseee/DeepCache>
+# deep unet blocks are computed every n-th unet call and their outputs reused in between so only shallow blocks run
+
+from contextlib import contextmanager
+import torch
+from modules import shared
+
+
+class DeepCache:
+    def __init__(self, unet, interval=3, depth=1):
+        down_blocks = list(unet.down_blocks)
+        up_blocks = list(unet.up_blocks)
+        self.unet = unet
+        self.interval = max(1, int(interval))
+        self.depth = min(max(1, int(depth)), len(down_blocks) - 1) # number of shallow down and up blocks which always run
+        self.blocks = down_blocks[self.depth:] + [unet.mid_block] + up_blocks[:len(up_blocks) - self.depth]
+        self.blocks = [block for block in self.blocks if block is not None]
+        self.cache = {}
+        self.calls = 0 # calls since cache was reset
+        self.total = 0
+        self.skipped = 0
+        self.skip = False
+        self.shape = None
+        self.timestep = None
+        self.handle = None
+        self.hijacked = {} # index: instance-level forward which block had before wrap, e.g. from another hijack
+
+    def pre_hook(self, _module, args, kwargs):
+        sample = args[0] if len(args) > 0 else kwargs.get('sample')
+        timestep = args[1] if len(args) > 1 else kwargs.get('timestep')
+        timestep = float(timestep.flatten()[0]) if torch.is_tensor(timestep) else float(timestep)
+        restart = self.timestep is not None and timestep > self.timestep # timesteps only decrease during denoise so increase means new pass
+        if restart or sample.shape != self.shape:
+            self.cache.clear()
+            self.calls = 0
+        self.skip = self.calls % self.interval != 0 and len(self.cache) == len(self.blocks)
+        self.shape = sample.shape
+        self.timestep = timestep
+        self.calls += 1
+        self.total += 1
+        self.skipped += 1 if self.skip else 0
+
+    def wrap(self, index, block):
+        forward = block.forward
+        if 'forward' in block.__dict__:
+            self.hijacked[index] = forward
+
+        def cached_forward(*args, **kwargs):
+            if self.skip:
+                result = self.cache[index]
+                return result.clone() if torch.is_tensor(result) else result # following blocks may modify their input in-place, e.g. freeu
+            result = forward(*args, **kwargs)
+            self.cache[index] = result
+            return result
+
+        block.forward = cached_forward
+
+    def apply(self):
+        for i, block in enumerate(self.blocks):
+            self.wrap(i, block)
+        self.handle = self.unet.register_forward_pre_hook(self.pre_hook, with_kwargs=True)
+
+    def remove(self):
+        for i, block in enumerate(self.blocks):
+            if i in self.hijacked:
+                block.forward = self.hijacked[i]
+            elif 'forward' in block.__dict__:
+                del block.forward
+        self.hijacked.clear()
+        if self.handle is not None:
+            self.handle.remove()
+            self.handle = None
+        self.cache.clear()
+
+    def stats(self):
+        return f'interval={self.interval} depth={self.depth} blocks={len(self.blocks)} calls={self.total} skipped={self.skipped}'
+
+
+@contextmanager
+def context_deepcache(p):
+    unet = getattr(p.sd_model, 'unet', None) if shared.backend == shared.Backend.DIFFUSERS else None
+    if not shared.opts.deepcache_enabled or unet is None or not hasattr(unet, 'down_blocks') or len(unet.down_blocks) < 2:
+        yield None
+        return
+    if shared.opts.cuda_compile:
+        shared.log.warning('DeepCache is not compatible with model compile')
+        yield None
+        return
+    cache = DeepCache(unet, shared.opts.deepcache_interval, shared.opts.deepcache_depth)
+    shared.log.info(f'Applying DeepCache: interval={cache.interval} depth={cache.depth}')
+    p.extra_generation_params['DeepCache'] = f'{cache.interval}/{cache.depth}'
+    cache.apply()
+    try:
+        yield cache
+    finally:
+        cache.remove()
+        shared.log.debug(f'DeepCache: {cache.stats()}')
@@ -6,6 +6,7 @@ from typing import Callable
 from functools import wraps, cache
 from contextlib import contextmanager, nullcontext
 import random
+import time
 import math
 import torch
 import torch.nn as nn
@@ -20,6 +21,8 @@ max_h = 0
 max_w = 0
 error_reported = False
 reset_needed = False
+autotune_profiles = {} # in-progress autotune profiles keyed by model type, resolution and device, kept between generations until all candidates are measured
+autotune_failed = set() # keys where untiled reference does not fit in memory so candidates cannot be compared and default tiling is used
 
 
 def iterative_closest_divisors(hw:int, aspect_ratio:float) -> tuple[int, int]:
@@ -93,6 +96,12 @@ def split_attention(layer: nn.Module, tile_size: int=256, min_tile_size: int=128
         ar = height / width # Aspect ratio
         nws = possible_tile_sizes(width, tile_size, min_tile_size, swap_size)
 
+    def set_tiling(new_tile_size: int, new_depth: int):
+        nonlocal tile_size, depth
+        tile_size, depth = new_tile_size, new_depth
+        reset_nhs()
+        reset_nws()
+
     def self_attn_forward(forward: Callable) -> Callable:
         @wraps(forward)
         def wrapper(*args, **kwargs):
@@ -162,7 +171,7 @@ def split_attention(layer: nn.Module, tile_size: int=256, min_tile_size: int=128
                     continue
                 setattr(module, "_original_forward", module.forward) # save original forward for recovery later # noqa: B010
                 setattr(module, "forward", self_attn_forward(module.forward)) # noqa: B010
-        yield
+        yield set_tiling
     finally:
         for _name, module in layer.named_modules():
             if hasattr(module, "_original_forward"): # remove hijack
@@ -217,11 +226,161 @@ def context_hypertile_unet(p):
         return nullcontext()
     else:
         tile_size = shared.opts.hypertile_unet_tile if shared.opts.hypertile_unet_tile > 0 else max(128, 64 * min(p.width // 128, p.height // 128))
+        if shared.opts.hypertile_unet_autotune:
+            shared.log.info('Applying hypertile: unet=autotune')
+            p.extra_generation_params['Hypertile UNet'] = 'autotune'
+            return autotune_unet(unet, tile_size=tile_size)
         shared.log.info(f'Applying hypertile: unet={tile_size}')
         p.extra_generation_params['Hypertile UNet'] = tile_size
         return split_attention(unet, tile_size=tile_size, min_tile_size=128, swap_size=1)
 
 
+class Autotune:
+    """
+    first unet calls at new resolution are used to profile candidate tilings, each profiling call runs untiled reference and candidate on same inputs and returns reference
+    fastest candidate whose output stays within similarity threshold of reference is stored per model type, resolution and device and used for all later calls
+    profiling that does not complete within one generation continues with remaining candidates on next generation with same key
+    candidates that fail, e.g. oom, are rejected and if untiled reference fails profiling is abandoned and default tiling is used
+    """
+    tile_sizes = [128, 192, 256, 384, 512]
+    depths = [0, 1]
+    repeats = 2
+
+    def __init__(self, set_tiling, tile_size):
+        from modules import shared
+        self.set_tiling = set_tiling
+        self.default = (tile_size, 0)
+        self.current = None
+        self.threshold = shared.opts.hypertile_autotune_similarity
+
+    def key(self, sample):
+        from modules import shared
+        device = torch.cuda.get_device_name(sample.device) if sample.device.type == 'cuda' else sample.device.type
+        return f'{shared.sd_model_type}:{8 * sample.shape[-1]}x{8 * sample.shape[-2]}:{device}'
+
+    def candidates(self, h, w):
+        tilings = {}
+        for depth in self.depths:
+            for tile in self.tile_sizes:
+                if tile >= max(h, w):
+                    continue
+                nhs, nws = tuple(possible_tile_sizes(h, tile, 128, 1)), tuple(possible_tile_sizes(w, tile, 128, 1))
+                if nhs[0] * nws[0] > 1:
+                    tilings.setdefault((nhs, nws, depth), (tile, depth)) # skip tile sizes which result in same split
+        return [(0, 0)] + list(tilings.values()) # 0 is untiled
+
+    def apply(self, tiling):
+        if tiling == self.current:
+            return
+        tile, depth = tiling
+        self.set_tiling(tile if tile > 0 else 1 << 16, depth)
+        self.current = tiling
+
+    def timed(self, forward, args, kwargs):
+        device = next((a.device for a in list(args) + list(kwargs.values()) if torch.is_tensor(a)), None)
+        if device is not None and device.type == 'cuda':
+            torch.cuda.synchronize(device)
+        t0 = time.perf_counter()
+        out = forward(*args, **kwargs)
+        if device is not None and device.type == 'cuda':
+            torch.cuda.synchronize(device)
+        return out, time.perf_counter() - t0
+
+    @staticmethod
+    def output(result):
+        if hasattr(result, 'sample'):
+            return result.sample
+        return result[0] if isinstance(result, tuple) else result
+
+    def profile(self, key, sample, forward, args, kwargs):
+        from modules import shared, devices
+        state = autotune_profiles.get(key, None)
+        if state is None:
+            candidates = self.candidates(8 * sample.shape[-2], 8 * sample.shape[-1])
+            state = { 'pending': candidates[1:] * self.repeats, 'times': {}, 'similarity': {}, 'failed': set() }
+            autotune_profiles[key] = state
+        candidate = state['pending'].pop(0)
+        try:
+            self.apply((0, 0))
+            reference, t_reference = self.timed(forward, args, kwargs)
+        except RuntimeError as e: # typically oom since hypertile is used where untiled attention does not fit
+            shared.log.warning(f'Hypertile autotune: key="{key}" untiled failed, using default tile={self.default[0]} {e}')
+            devices.torch_gc()
+            autotune_failed.add(key)
+            del autotune_profiles[key]
+            self.apply(self.default)
+            return forward(*args, **kwargs)
+        state['times'][(0, 0)] = min(t_reference, state['times'].get((0, 0), t_reference))
+        if candidate in state['failed']:
+            result = None
+        else:
+            try:
+                self.apply(candidate)
+                result, t_candidate = self.timed(forward, args, kwargs)
+            except RuntimeError as e:
+                shared.log.debug(f'Hypertile autotune: key="{key}" tile={candidate[0]} depth={candidate[1]} failed {e}')
+                devices.torch_gc()
+                state['failed'].add(candidate)
+                state['times'].pop(candidate, None)
+                result = None
+        if result is None:
+            if len(state['pending']) == 0:
+                self.finish(key, state)
+            return reference
+        state['times'][candidate] = min(t_candidate, state['times'].get(candidate, t_candidate))
+        similarity = torch.nn.functional.cosine_similarity(self.output(reference).flatten().float(), self.output(result).flatten().float(), dim=0).item()
+        state['similarity'][candidate] = min(similarity, state['similarity'].get(candidate, similarity))
+        if len(state['pending']) == 0:
+            self.finish(key, state)
+        return reference
+
+    def finish(self, key, state):
+        from modules import shared, hashes
+        accepted = { tiling: t for tiling, t in state['times'].items() if tiling == (0, 0) or state['similarity'].get(tiling, 0) >= self.threshold }
+        tile, depth = min(accepted, key=accepted.get)
+        profile = hashes.cache('hypertile-autotune')
+        profile[key] = { 'tile': tile, 'depth': depth, 'time': round(accepted[(tile, depth)], 4), 'untiled': round(state['times'][(0, 0)], 4) }
+        hashes.dump_cache()
+        rejected = len(state['times']) - len(accepted) + len(state['failed'])
+        shared.log.info(f'Hypertile autotune: key="{key}" tile={tile} depth={depth} time={accepted[(tile, depth)]:.3f} untiled={state["times"][(0, 0)]:.3f} candidates={len(state["times"]) + len(state["failed"])} rejected={rejected}')
+        del autotune_profiles[key]
+
+    def wrap(self, forward):
+        from modules import hashes
+
+        @wraps(forward)
+        def wrapper(*args, **kwargs):
+            sample = args[0] if len(args) > 0 else kwargs.get('sample', kwargs.get('x', None))
+            if not torch.is_tensor(sample) or sample.ndim != 4 or torch.is_grad_enabled():
+                self.apply(self.default)
+                return forward(*args, **kwargs)
+            key = self.key(sample)
+            if key in autotune_failed:
+                self.apply(self.default)
+                return forward(*args, **kwargs)
+            winner = hashes.cache('hypertile-autotune').get(key, None)
+            if winner is not None:
+                self.apply((winner['tile'], winner['depth']))
+                return forward(*args, **kwargs)
+            return self.profile(key, sample, forward, args, kwargs)
+        return wrapper
+
+
+@contextmanager
+def autotune_unet(unet: nn.Module, tile_size: int):
+    with split_attention(unet, tile_size=tile_size, min_tile_size=128, swap_size=1) as set_tiling:
+        tuner = Autotune(set_tiling, tile_size)
+        hijacked = unet.__dict__.get('forward', None) # e.g. offload hooks
+        unet.forward = tuner.wrap(unet.forward)
+        try:
+            yield
+        finally:
+            if hijacked is not None:
+                unet.forward = hijacked
+            else:
+                del unet.forward
+
+
 def hypertile_set(p, hr=False):
     from modules import shared
     global height, width, error_reported, reset_needed # pylint: disable=global-statement
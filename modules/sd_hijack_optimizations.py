@@ -15,7 +15,7 @@ from modules.hypernetworks import hypernetwork
 from .sub_quadratic_attention import efficient_dot_product_attention # pylint: disable=relative-beyond-top-level
 
 
-if shared.opts.cross_attention_optimization == "xFormers":
+if shared.opts.cross_attention_optimization in ["xFormers", "Autotune"]:
     try:
         import xformers.ops # pylint: disable=import-error
         shared.xformers_available = True
@@ -241,7 +241,7 @@ def split_cross_attention_forward_invokeAI(self, x, context=None, mask=None): #
 
 # Based on Birch-san's modified implementation of sub-quadratic attention from https://github.com/Birch-san/diffusers/pull/1
 # The sub_quad_attention_forward function is under the MIT License listed under Memory Efficient Attention in the Licenses section of the web UI interface
-def sub_quad_attention_forward(self, x, context=None, mask=None):
+def sub_quad_attention_forward(self, x, context=None, mask=None, q_chunk_size=None):
     assert mask is None, "attention-mask not currently implemented for SubQuadraticCrossAttnProcessor."
 
     h = self.heads
@@ -265,7 +265,7 @@ def sub_quad_attention_forward(self, x, context=None, mask=None):
     if shared.opts.upcast_attn:
         q, k = q.float(), k.float()
 
-    x = sub_quad_attention(q, k, v, q_chunk_size=shared.opts.sub_quad_q_chunk_size, kv_chunk_size=shared.opts.sub_quad_kv_chunk_size, chunk_threshold=shared.opts.sub_quad_chunk_threshold, use_checkpoint=self.training)
+    x = sub_quad_attention(q, k, v, q_chunk_size=q_chunk_size or shared.opts.sub_quad_q_chunk_size, kv_chunk_size=shared.opts.sub_quad_kv_chunk_size, chunk_threshold=shared.opts.sub_quad_chunk_threshold, use_checkpoint=self.training)
 
     x = x.to(dtype)
 
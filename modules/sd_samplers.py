@@ -1,4 +1,5 @@
 import os
+import time
 from modules import shared
 from modules.sd_samplers_common import samples_to_image_grid, sample_to_image # pylint: disable=unused-import
 
@@ -62,11 +63,13 @@ def create_sampler(name, model):
         shared.log.debug(f'Sampler: sampler="{name}" config={config.options}')
         return sampler
     elif shared.backend == shared.Backend.DIFFUSERS:
+        from modules import sd_samplers_diffusers
+        t0 = time.time()
         sampler = config.constructor(model)
         if not hasattr(model, 'scheduler_config'):
             model.scheduler_config = sampler.sampler.config.copy()
         model.scheduler = sampler.sampler
-        shared.log.debug(f'Sampler: sampler="{sampler.name}" config={sampler.config}')
+        shared.log.debug(f'Sampler: sampler="{sampler.name}" config={sampler.config} time={time.time() - t0:.3f} construct={getattr(sampler, "time", 0):.3f} cache={sd_samplers_diffusers.schedulers_stats}')
         return sampler.sampler
     else:
         return None
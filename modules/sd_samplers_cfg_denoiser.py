@@ -55,6 +55,7 @@ class CFGDenoiser(torch.nn.Module):
 
         self.step = 0
         self.image_cfg_scale = None
+        self.cond_batch = None
         self.padded_cond_uncond = False
         self.sampler = sampler
         self.model_wrap = None
@@ -66,6 +67,8 @@ class CFGDenoiser(torch.nn.Module):
         raise NotImplementedError
 
     def combine_denoised(self, x_out, conds_list, uncond, cond_scale):
+        if self.cond_batch is not None and self.cond_batch.key == tuple(tuple(conds) for conds in conds_list):
+            return self.cond_batch.combine(x_out, uncond, cond_scale)
         denoised_uncond = x_out[-uncond.shape[0]:]
         denoised = torch.clone(denoised_uncond)
 
@@ -113,7 +116,8 @@ class CFGDenoiser(torch.nn.Module):
             x = self.init_latent * self.mask + self.nmask * x
 
         batch_size = len(conds_list)
-        repeats = [len(conds_list[i]) for i in range(batch_size)]
+        self.cond_batch = sd_samplers_common.CondBatch.get(self.cond_batch, conds_list, x.device)
+        cond_batch = self.cond_batch
 
         if shared.sd_model.model.conditioning_key == "crossattn-adm":
             image_uncond = torch.zeros_like(image_cond)
@@ -126,13 +130,13 @@ class CFGDenoiser(torch.nn.Module):
                 make_condition_dict = lambda c_crossattn, c_concat: {"c_crossattn": [c_crossattn], "c_concat": [c_concat]} # pylint: disable=unnecessary-lambda-assignment
 
         if not is_edit_model:
-            x_in = torch.cat([torch.stack([x[i] for _ in range(n)]) for i, n in enumerate(repeats)] + [x])
-            sigma_in = torch.cat([torch.stack([sigma[i] for _ in range(n)]) for i, n in enumerate(repeats)] + [sigma])
-            image_cond_in = torch.cat([torch.stack([image_cond[i] for _ in range(n)]) for i, n in enumerate(repeats)] + [image_uncond])
+            x_in = torch.cat([cond_batch.repeat(x), x])
+            sigma_in = torch.cat([cond_batch.repeat(sigma), sigma])
+            image_cond_in = torch.cat([cond_batch.repeat(image_cond), image_uncond])
         else:
-            x_in = torch.cat([torch.stack([x[i] for _ in range(n)]) for i, n in enumerate(repeats)] + [x] + [x])
-            sigma_in = torch.cat([torch.stack([sigma[i] for _ in range(n)]) for i, n in enumerate(repeats)] + [sigma] + [sigma])
-            image_cond_in = torch.cat([torch.stack([image_cond[i] for _ in range(n)]) for i, n in enumerate(repeats)] + [image_uncond] + [torch.zeros_like(self.init_latent)])
+            x_in = torch.cat([cond_batch.repeat(x), x, x])
+            sigma_in = torch.cat([cond_batch.repeat(sigma), sigma, sigma])
+            image_cond_in = torch.cat([cond_batch.repeat(image_cond), image_uncond, torch.zeros_like(self.init_latent)])
 
         denoiser_params = CFGDenoiserParams(x_in, image_cond_in, sigma_in, state.sampling_step, state.sampling_steps, tensor, uncond)
         cfg_denoiser_callback(denoiser_params)
@@ -194,9 +198,8 @@ class CFGDenoiser(torch.nn.Module):
             if not skip_uncond:
                 x_out[-uncond.shape[0]:] = self.inner_model(x_in[-uncond.shape[0]:], sigma_in[-uncond.shape[0]:], cond=make_condition_dict(uncond, image_cond_in[-uncond.shape[0]:]))
 
-        denoised_image_indexes = [x[0][0] for x in conds_list]
         if skip_uncond:
-            fake_uncond = torch.cat([x_out[i:i+1] for i in denoised_image_indexes])
+            fake_uncond = cond_batch.images(x_out)
             x_out = torch.cat([x_out, fake_uncond])  # we skipped uncond denoising, so we put cond-denoised image to where the uncond-denoised image should be
 
         denoised_params = CFGDenoisedParams(x_out, state.sampling_step, state.sampling_steps, self.inner_model)
@@ -214,14 +217,14 @@ class CFGDenoiser(torch.nn.Module):
         if not self.mask_before_denoising and self.mask is not None:
             denoised = self.init_latent * self.mask + self.nmask * denoised
 
-        self.sampler.last_latent = self.get_pred_x0(torch.cat([x_in[i:i + 1] for i in denoised_image_indexes]), torch.cat([x_out[i:i + 1] for i in denoised_image_indexes]), sigma)
+        self.sampler.last_latent = self.get_pred_x0(cond_batch.images(x_in), cond_batch.images(x_out), sigma)
 
         if opts.live_preview_content == "Prompt":
             preview = self.sampler.last_latent
         elif opts.live_preview_content == "Negative prompt":
             preview = self.get_pred_x0(x_in[-uncond.shape[0]:], x_out[-uncond.shape[0]:], sigma)
         else:
-            preview = self.get_pred_x0(torch.cat([x_in[i:i+1] for i in denoised_image_indexes]), torch.cat([denoised[i:i+1] for i in denoised_image_indexes]), sigma)
+            preview = self.get_pred_x0(cond_batch.images(x_in), torch.cat([denoised[i:i+1] for i in cond_batch.denoised_image_indexes]), sigma)
 
         sd_samplers_common.store_latent(preview)
 
@@ -3,7 +3,7 @@ from collections import namedtuple
 import torch
 import torchvision.transforms as T
 from PIL import Image
-from modules import shared, devices, processing, images, sd_vae_approx, sd_vae_taesd, sd_samplers
+from modules import shared, devices, processing, images, sd_vae_approx, sd_vae_taesd, sd_samplers, live_preview
 
 
 SamplerData = namedtuple('SamplerData', ['name', 'constructor', 'aliases', 'options'])
@@ -110,8 +110,9 @@ def store_latent(decoded):
     shared.state.current_latent = decoded
     if shared.opts.live_previews_enable and shared.opts.show_progress_every_n_steps > 0 and shared.state.sampling_step % shared.opts.show_progress_every_n_steps == 0:
         if not shared.parallel_processing_allowed:
-            image = sample_to_image(decoded)
-            shared.state.assign_current_image(image)
+            image = live_preview.previewer.decode_inline(decoded)
+            if image is not None:
+                shared.state.assign_current_image(image)
 
 
 def is_sampler_using_eta_noise_seed_delta(p):
@@ -131,5 +132,42 @@ def is_sampler_using_eta_noise_seed_delta(p):
     return True
 
 
+class CondBatch:
+    """
+    index tensors describing how cond batch maps to images for given conds_list so denoiser inputs are assembled and combined with single gather/scatter ops
+    conds_list is a list of (cond_index, weight) per image as returned by prompt_parser.reconstruct_multicond_batch
+    """
+    def __init__(self, conds_list, device):
+        self.key = tuple(tuple(conds) for conds in conds_list)
+        self.device = device
+        self.batch_size = len(conds_list)
+        self.repeat_index = torch.tensor([i for i, conds in enumerate(conds_list) for _ in conds], dtype=torch.long, device=device) # image index for each cond
+        self.cond_index = torch.tensor([cond_index for conds in conds_list for cond_index, _weight in conds], dtype=torch.long, device=device)
+        self.weights = torch.tensor([weight for conds in conds_list for _cond_index, weight in conds], dtype=torch.float32, device=device)
+        self.image_index = torch.tensor([conds[0][0] for conds in conds_list], dtype=torch.long, device=device) # first cond of each image
+        self.denoised_image_indexes = [conds[0][0] for conds in conds_list]
+
+    @staticmethod
+    def get(cached, conds_list, device):
+        """returns cached instance if conds_list and device did not change, otherwise creates new one"""
+        if cached is not None and cached.device == device and cached.key == tuple(tuple(conds) for conds in conds_list):
+            return cached
+        return CondBatch(conds_list, device)
+
+    def repeat(self, tensor):
+        """repeat each image of batch once per its cond"""
+        return tensor.index_select(0, self.repeat_index)
+
+    def images(self, tensor):
+        """select output of first cond of each image"""
+        return tensor.index_select(0, self.image_index)
+
+    def combine(self, x_out, uncond, cond_scale):
+        denoised_uncond = x_out[-uncond.shape[0]:]
+        weights = (self.weights * cond_scale).to(dtype=x_out.dtype).view((-1,) + (1,) * (x_out.dim() - 1))
+        delta = (x_out.index_select(0, self.cond_index) - denoised_uncond.index_select(0, self.repeat_index)) * weights
+        return torch.clone(denoised_uncond).index_add_(0, self.repeat_index, delta)
+
+
 class InterruptedException(BaseException):
     pass
@@ -1,5 +1,10 @@
 import os
+import copy
+import json
+import time
 import inspect
+import functools
+from collections import OrderedDict
 from modules import shared
 from modules import sd_samplers_common
 
@@ -52,6 +57,32 @@ config = {
     'SA Solver': {'predictor_order': 2, 'corrector_order': 2, 'thresholding': False, 'lower_order_final': True, 'use_karras_sigmas': False, 'timestep_spacing': 'linspace'},
 }
 
+schedulers = OrderedDict() # pristine scheduler instances keyed by sampler name, effective config and model scheduler config
+schedulers_size = 16
+schedulers_stats = { 'hits': 0, 'misses': 0 }
+
+
+@functools.lru_cache(maxsize=None)
+def constructor_parameters(constructor):
+    return tuple(inspect.signature(constructor, follow_wrapped=True).parameters.keys())
+
+
+def get_scheduler(name, constructor, scheduler_config, orig_config):
+    """returns copy of cached scheduler so each request starts from clean state without recomputing betas and sigmas"""
+    key = (name, json.dumps(scheduler_config, sort_keys=True, default=str), json.dumps(dict(orig_config), sort_keys=True, default=str))
+    scheduler = schedulers.get(key, None)
+    if scheduler is None:
+        schedulers_stats['misses'] += 1
+        scheduler = constructor(**scheduler_config)
+        schedulers[key] = scheduler
+        if len(schedulers) > schedulers_size:
+            schedulers.popitem(last=False)
+    else:
+        schedulers_stats['hits'] += 1
+        schedulers.move_to_end(key)
+    return copy.deepcopy(scheduler) # cached instance is never used directly so it never holds per-request state
+
+
 samplers_data_diffusers = [
     sd_samplers_common.SamplerData('Default', None, [], {}),
     sd_samplers_common.SamplerData('UniPC', lambda model: DiffusionSampler('UniPC', UniPCMultistepScheduler, model), [], {}),
@@ -127,12 +158,13 @@ class DiffusionSampler:
         if name == 'DEIS':
             self.config['algorithm_type'] = 'deis'
         # validate all config params
-        signature = inspect.signature(constructor, follow_wrapped=True)
-        possible = signature.parameters.keys()
+        possible = constructor_parameters(constructor)
         debug(f'Sampler: sampler="{name}" config={self.config} signature={possible}')
         for key in self.config.copy().keys():
             if key not in possible:
                 shared.log.warning(f'Sampler: sampler="{name}" config={self.config} invalid={key}')
                 del self.config[key]
-        self.sampler = constructor(**self.config)
+        t0 = time.time()
+        self.sampler = get_scheduler(name, constructor, self.config, orig_config)
         self.sampler.name = name
+        self.time = time.time() - t0
@@ -78,8 +78,11 @@ class CFGDenoiser(torch.nn.Module):
         self.init_latent = None
         self.step = 0
         self.image_cfg_scale = None
+        self.cond_batch = None
 
     def combine_denoised(self, x_out, conds_list, uncond, cond_scale):
+        if self.cond_batch is not None and self.cond_batch.key == tuple(tuple(conds) for conds in conds_list):
+            return self.cond_batch.combine(x_out, uncond, cond_scale)
         denoised_uncond = x_out[-uncond.shape[0]:]
         denoised = torch.clone(denoised_uncond)
         for i, conds in enumerate(conds_list):
@@ -108,7 +111,8 @@ class CFGDenoiser(torch.nn.Module):
         uncond = prompt_parser.reconstruct_cond_batch(uncond, self.step)
         assert not is_edit_model or all(len(conds) == 1 for conds in conds_list), "AND is not supported for InstructPix2Pix checkpoint (unless using Image CFG scale = 1.0)"
         batch_size = len(conds_list)
-        repeats = [len(conds_list[i]) for i in range(batch_size)]
+        self.cond_batch = sd_samplers_common.CondBatch.get(self.cond_batch, conds_list, x.device)
+        cond_batch = self.cond_batch
         if shared.sd_model.model.conditioning_key == "crossattn-adm":
             image_uncond = torch.zeros_like(image_cond)
             make_condition_dict = lambda c_crossattn, c_adm: {"c_crossattn": c_crossattn, "c_adm": c_adm} # pylint: disable=C3001
@@ -116,13 +120,13 @@ class CFGDenoiser(torch.nn.Module):
             image_uncond = image_cond
             make_condition_dict = lambda c_crossattn, c_concat: {"c_crossattn": c_crossattn, "c_concat": [c_concat]} # pylint: disable=C3001
         if not is_edit_model:
-            x_in = torch.cat([torch.stack([x[i] for _ in range(n)]) for i, n in enumerate(repeats)] + [x])
-            sigma_in = torch.cat([torch.stack([sigma[i] for _ in range(n)]) for i, n in enumerate(repeats)] + [sigma])
-            image_cond_in = torch.cat([torch.stack([image_cond[i] for _ in range(n)]) for i, n in enumerate(repeats)] + [image_uncond])
+            x_in = torch.cat([cond_batch.repeat(x), x])
+            sigma_in = torch.cat([cond_batch.repeat(sigma), sigma])
+            image_cond_in = torch.cat([cond_batch.repeat(image_cond), image_uncond])
         else:
-            x_in = torch.cat([torch.stack([x[i] for _ in range(n)]) for i, n in enumerate(repeats)] + [x] + [x])
-            sigma_in = torch.cat([torch.stack([sigma[i] for _ in range(n)]) for i, n in enumerate(repeats)] + [sigma] + [sigma])
-            image_cond_in = torch.cat([torch.stack([image_cond[i] for _ in range(n)]) for i, n in enumerate(repeats)] + [image_uncond] + [torch.zeros_like(self.init_latent)])
+            x_in = torch.cat([cond_batch.repeat(x), x, x])
+            sigma_in = torch.cat([cond_batch.repeat(sigma), sigma, sigma])
+            image_cond_in = torch.cat([cond_batch.repeat(image_cond), image_uncond, torch.zeros_like(self.init_latent)])
         denoiser_params = CFGDenoiserParams(x_in, image_cond_in, sigma_in, shared.state.sampling_step, shared.state.sampling_steps, tensor, uncond)
         cfg_denoiser_callback(denoiser_params)
         x_in = denoiser_params.x
@@ -174,15 +178,14 @@ class CFGDenoiser(torch.nn.Module):
                 x_out[a:b] = self.inner_model(x_in[a:b], sigma_in[a:b], cond=make_condition_dict(c_crossattn, image_cond_in[a:b]))
             if not skip_uncond:
                 x_out[-uncond.shape[0]:] = self.inner_model(x_in[-uncond.shape[0]:], sigma_in[-uncond.shape[0]:], cond=make_condition_dict([uncond], image_cond_in[-uncond.shape[0]:]))
-        denoised_image_indexes = [x[0][0] for x in conds_list]
         if skip_uncond:
-            fake_uncond = torch.cat([x_out[i:i+1] for i in denoised_image_indexes])
+            fake_uncond = cond_batch.images(x_out)
             x_out = torch.cat([x_out, fake_uncond])  # we skipped uncond denoising, so we put cond-denoised image to where the uncond-denoised image should be
         denoised_params = CFGDenoisedParams(x_out, shared.state.sampling_step, shared.state.sampling_steps, self.inner_model)
         cfg_denoised_callback(denoised_params)
         devices.test_for_nans(x_out, "unet")
         if shared.opts.live_preview_content == "Prompt":
-            sd_samplers_common.store_latent(torch.cat([x_out[i:i+1] for i in denoised_image_indexes]))
+            sd_samplers_common.store_latent(cond_batch.images(x_out))
         elif shared.opts.live_preview_content == "Negative prompt":
             sd_samplers_common.store_latent(x_out[-uncond.shape[0]:])
         if is_edit_model:
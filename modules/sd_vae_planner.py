@@ -0,0 +1,130 @@
+"""
+Memory-aware VAE decode/encode planner
+picks batch slicing, tile size and tile overlap for each call based on image size, dtype and free memory of target device
+tiles are blended with linear ramps across overlaps so result matches full decode within tolerance
+"""
+import math
+from collections import namedtuple
+import psutil
+import torch
+from modules import shared
+
+
+Plan = namedtuple('Plan', ['batch', 'tile', 'overlap']) # batch slice size, tile size and overlap in input pixels, tile=0 means no tiling
+
+# estimated peak bytes per output pixel per byte of dtype, includes activations of widest decoder blocks and conv workspaces
+decode_factor = 128 * 12
+encode_factor = 128 * 8
+taesd_factor = 64 * 4
+headroom = 0.8 # fraction of free memory plan may use
+min_tile = 32 # in latent pixels
+
+
+def available_memory(device):
+    if device is None or device.type in ['cpu', 'mps']: # mps uses unified memory
+        return psutil.virtual_memory().available
+    try:
+        free, _total = torch.cuda.mem_get_info(device)
+        if device.type == 'cuda':
+            free += torch.cuda.memory_reserved(device) - torch.cuda.memory_allocated(device) # cached blocks can be reused by allocator
+        return free
+    except Exception:
+        return None
+
+
+def estimate(pixels, dtype, factor):
+    return pixels * factor * torch.tensor([], dtype=dtype).element_size()
+
+
+def plan(shape, dtype, device, factor=decode_factor, scale=8, tiling=True):
+    """shape is input tensor shape, scale is ratio of output pixels to input pixels along each side for decode or inverse for encode, tiling=False limits plan to batch slicing"""
+    n, _c, h, w = shape
+    out_pixels = h * w * scale * scale if scale >= 1 else h * w
+    memory = available_memory(device)
+    if memory is None:
+        return Plan(n, 0, 0)
+    budget = memory * headroom
+    per_image = estimate(out_pixels, dtype, factor)
+    if per_image * n <= budget:
+        return Plan(n, 0, 0)
+    if per_image <= budget or not tiling:
+        return Plan(max(1, int(budget // per_image)), 0, 0)
+    latent_scale = scale if scale >= 1 else 1 / scale # input pixels per latent pixel is 1 for decode and 8 for encode
+    latent_side = math.sqrt(budget / estimate(64, dtype, factor)) # largest square tile in latent pixels
+    tile = max(min_tile, int(latent_side) // 8 * 8)
+    if tile >= max(h, w) / (1 if scale >= 1 else latent_scale):
+        return Plan(1, 0, 0)
+    overlap = max(8, tile // 4)
+    input_scale = 1 if scale >= 1 else int(latent_scale)
+    return Plan(1, tile * input_scale, overlap * input_scale)
+
+
+def tile_starts(size, tile, stride):
+    if size <= tile:
+        return [0]
+    starts = list(range(0, size - tile, stride))
+    return starts + [size - tile]
+
+
+def ramp(size, overlap, first, last, device):
+    mask = torch.ones(size, device=device)
+    overlap = min(overlap, size // 2)
+    if overlap > 0:
+        values = torch.arange(1, overlap + 1, device=device, dtype=torch.float32) / (overlap + 1)
+        if not first:
+            mask[:overlap] = values
+        if not last:
+            mask[-overlap:] = values.flip(0)
+    return mask
+
+
+def tiled(fn, x, tile, overlap):
+    """run fn on overlapping tiles of x and blend results, output may have different resolution and channels than input"""
+    _n, _c, h, w = x.shape
+    stride = max(1, tile - overlap)
+    ys = tile_starts(h, tile, stride)
+    xs = tile_starts(w, tile, stride)
+    out, weights, dtype = None, None, None
+    for y in ys:
+        for x0 in xs:
+            result = fn(x[:, :, y:y + tile, x0:x0 + tile])
+            if out is None:
+                scale = result.shape[2] / min(tile, h)
+                dtype = result.dtype
+                out = torch.zeros((result.shape[0], result.shape[1], round(h * scale), round(w * scale)), dtype=torch.float32, device=result.device)
+                weights = torch.zeros((1, 1, out.shape[2], out.shape[3]), dtype=torch.float32, device=result.device)
+            oy, ox = round(y * scale), round(x0 * scale)
+            th, tw = result.shape[2], result.shape[3]
+            mask = ramp(th, round(overlap * scale), y == ys[0], y == ys[-1], result.device).view(1, 1, -1, 1) * ramp(tw, round(overlap * scale), x0 == xs[0], x0 == xs[-1], result.device).view(1, 1, 1, -1)
+            out[:, :, oy:oy + th, ox:ox + tw] += result.float() * mask
+            weights[:, :, oy:oy + th, ox:ox + tw] += mask
+            del result
+    return (out / weights).to(dtype)
+
+
+def run(fn, x, p: Plan):
+    results = []
+    for i in range(0, x.shape[0], p.batch):
+        batch = x[i:i + p.batch]
+        results.append(tiled(fn, batch, p.tile, p.overlap) if p.tile > 0 else fn(batch))
+    return torch.cat(results) if len(results) > 1 else results[0]
+
+
+def decode(fn, latents, dtype=None, device=None, factor=decode_factor, tiling=True):
+    """decode latents with fn using batch slices and tiles chosen for available memory"""
+    p = plan(latents.shape, dtype or latents.dtype, device or latents.device, factor=factor, scale=8, tiling=tiling)
+    if p.batch < latents.shape[0] or p.tile > 0:
+        shared.log.debug(f'VAE decode plan: latents={list(latents.shape)} batch={p.batch} tile={p.tile} overlap={p.overlap}')
+    return run(fn, latents, p)
+
+
+def encode(fn, image, dtype=None, device=None, factor=encode_factor, tiling=True):
+    """encode image with fn using batch slices and tiles chosen for available memory, fn must return tensor which can be blended, e.g. distribution parameters"""
+    p = plan(image.shape, dtype or image.dtype, device or image.device, factor=factor, scale=1/8, tiling=tiling)
+    if p.batch < image.shape[0] or p.tile > 0:
+        shared.log.debug(f'VAE encode plan: image={list(image.shape)} batch={p.batch} tile={p.tile} overlap={p.overlap}')
+    return run(fn, image, p)
+
+
+def enabled():
+    return shared.opts.sd_vae_planner
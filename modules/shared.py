@@ -330,6 +330,7 @@ options_templates.update(options_section(('sd', "Execution & Models"), {
     "prompt_attention": OptionInfo("Full parser", "Prompt attention parser", gr.Radio, {"choices": ["Full parser", "Compel parser", "A1111 parser", "Fixed attention"] }),
     "prompt_mean_norm": OptionInfo(True, "Prompt attention normalization", gr.Checkbox, {"visible": backend == Backend.ORIGINAL }),
     "comma_padding_backtrack": OptionInfo(20, "Prompt padding", gr.Slider, {"minimum": 0, "maximum": 74, "step": 1, "visible": backend == Backend.ORIGINAL }),
+    "prompt_cache": OptionInfo(256, "Prompt embeddings cache in MB (0=disabled)", gr.Slider, {"minimum": 0, "maximum": 4096, "step": 32}),
     "sd_checkpoint_cache": OptionInfo(0, "Cached models", gr.Slider, {"minimum": 0, "maximum": 10, "step": 1, "visible": backend == Backend.ORIGINAL }),
     "sd_vae_checkpoint_cache": OptionInfo(0, "Cached VAEs", gr.Slider, {"minimum": 0, "maximum": 10, "step": 1, "visible": False}),
     "sd_disable_ckpt": OptionInfo(False, "Disallow models in ckpt format"),
@@ -411,13 +412,22 @@ options_templates.update(options_section(('advanced', "Inference Settings"), {
     "hypertile_sep": OptionInfo("<h2>HyperTile</h2>", "", gr.HTML),
     "hypertile_unet_enabled": OptionInfo(False, "HyperTile UNet"),
     "hypertile_unet_tile": OptionInfo(256, "HyperTile UNet tile size", gr.Slider, {"minimum": 0, "maximum": 1024, "step": 8}),
+    "hypertile_unet_autotune": OptionInfo(False, "HyperTile UNet autotune tile size"),
+    "hypertile_autotune_similarity": OptionInfo(0.98, "HyperTile autotune minimum similarity to untiled", gr.Slider, {"minimum": 0.8, "maximum": 1.0, "step": 0.005}),
     "hypertile_vae_enabled": OptionInfo(False, "HyperTile VAE", gr.Checkbox),
     "hypertile_vae_tile": OptionInfo(128, "HyperTile VAE tile size", gr.Slider, {"minimum": 0, "maximum": 1024, "step": 8}),
 
+    "deepcache_sep": OptionInfo("<h2>DeepCache</h2>", "", gr.HTML),
+    "deepcache_enabled": OptionInfo(False, "DeepCache UNet feature reuse"),
+    "deepcache_interval": OptionInfo(3, "DeepCache full compute interval", gr.Slider, {"minimum": 1, "maximum": 10, "step": 1}),
+    "deepcache_depth": OptionInfo(1, "DeepCache shallow blocks", gr.Slider, {"minimum": 1, "maximum": 3, "step": 1}),
+
     "inference_other_sep": OptionInfo("<h2>Other</h2>", "", gr.HTML),
     "batch_frame_mode": OptionInfo(False, "Parallel process images in batch"),
+    "processing_pipeline": OptionInfo(False, "Overlap decode of batch with sampling of next batch"),
     "inference_mode": OptionInfo("no-grad", "Torch inference mode", gr.Radio, {"choices": ["no-grad", "inference-mode", "none"]}),
     "sd_vae_sliced_encode": OptionInfo(False, "VAE sliced encode"),
+    "sd_vae_planner": OptionInfo(True, "VAE memory-aware batch slicing and tiling"),
 }))
 
 options_templates.update(options_section(('diffusers', "Diffusers Settings"), {
@@ -577,6 +587,8 @@ options_templates.update(options_section(('live-preview', "Live Previews"), {
     "show_progress_type": OptionInfo("Approximate", "Live preview method", gr.Radio, {"choices": ["Simple", "Approximate", "TAESD", "Full VAE"]}),
     "live_preview_content": OptionInfo("Combined", "Live preview subject", gr.Radio, {"choices": ["Combined", "Prompt", "Negative prompt"], "visible": False}),
     "live_preview_refresh_period": OptionInfo(500, "Progress update period", gr.Slider, {"minimum": 0, "maximum": 5000, "step": 25}),
+    "live_preview_max_rate": OptionInfo(4, "Live preview max rate (previews/s, 0=unlimited)", gr.Slider, {"minimum": 0, "maximum": 30, "step": 0.5}),
+    "live_preview_async": OptionInfo(True, "Decode live previews in background"),
     "logmonitor_show": OptionInfo(True, "Show log view"),
     "logmonitor_refresh_period": OptionInfo(5000, "Log view update period", gr.Slider, {"minimum": 0, "maximum": 30000, "step": 25}),
 }))
@@ -660,6 +672,9 @@ options_templates.update(options_section(('control', "Control Options"), {
 options_templates.update(options_section(('training', "Training"), {
     "unload_models_when_training": OptionInfo(False, "Move VAE and CLIP to RAM when training"),
     "pin_memory": OptionInfo(True, "Pin training dataset to memory"),
+    "training_latent_cache": OptionInfo(True, "Cache encoded dataset latents on disk"),
+    "training_latent_cache_dir": OptionInfo(os.path.join(paths.data_path, 'cache', 'latents'), "Folder for cached dataset latents", folder=True),
+    "training_prefetch": OptionInfo(2, "Training batches to prefetch", gr.Slider, {"minimum": 0, "maximum": 16, "step": 1}),
     "save_optimizer_state": OptionInfo(False, "Save resumable optimizer state when training"),
     "save_training_settings_to_txt": OptionInfo(True, "Save training settings to a text file"),
     "dataset_filename_word_regex": OptionInfo("", "Filename word regex"),
@@ -708,6 +723,13 @@ options_templates.update(options_section(('extra_networks', "Extra Networks"), {
     "lora_force_diffusers": OptionInfo(False if not cmd_opts.use_openvino else True, "LoRA use alternative loading method"),
     "lora_fuse_diffusers": OptionInfo(False if not cmd_opts.use_openvino else True, "LoRA use merge when using alternative method"),
     "lora_in_memory_limit": OptionInfo(1 if not cmd_opts.use_openvino else 0, "LoRA memory cache", gr.Slider, {"minimum": 0, "maximum": 24, "step": 1}),
+    "lora_cache_budget": OptionInfo(0, "LoRA memory cache budget in MB (0=unlimited)", gr.Slider, {"minimum": 0, "maximum": 16384, "step": 64}),
+    "lora_cache_pinned": OptionInfo("", "LoRA always keep in memory cache"),
+    "lora_delta_cache": OptionInfo(0, "LoRA calculated weights cache in MB (0=disabled)", gr.Slider, {"minimum": 0, "maximum": 16384, "step": 64}),
+    "lora_prefetch": OptionInfo(True, "LoRA prefetch networks for queued requests"),
+    "lora_apply_mode": OptionInfo("fuse", "LoRA apply method", gr.Radio, {"choices": ["fuse", "runtime", "auto"]}),
+    "lora_batch_apply": OptionInfo(True, "LoRA apply weights in batches when loaded"),
+    "lora_restore_mode": OptionInfo("backup", "LoRA restore original weights from", gr.Radio, {"choices": ["backup", "checkpoint"]}),
     "lora_functional": OptionInfo(False, "Use Kohya method for handling multiple LoRA", gr.Checkbox, { "visible": False }),
     "sd_hypernetwork": OptionInfo("None", "Add hypernetwork to prompt", gr.Dropdown, { "choices": ["None"], "visible": False }),
 }))
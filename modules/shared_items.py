@@ -21,7 +21,8 @@ def list_crossattention():
         "Doggettx's",
         "InvokeAI's",
         "Sub-quadratic",
-        "Split attention"
+        "Split attention",
+        "Autotune",
     ]
 
 def get_pipelines():
@@ -61,6 +61,7 @@ class State:
 
     def begin(self, title="", api=None):
         import modules.devices
+        import modules.live_preview
         self.total_jobs += 1
         self.current_image = None
         self.current_image_sampling_step = 0
@@ -77,17 +78,21 @@ class State:
         self.textinfo = None
         self.api = api if api is not None else self.api
         self.time_start = time.time()
+        modules.live_preview.previewer.reset()
         if self.debug_output:
             log.debug(f'State begin: {self.job}')
         modules.devices.torch_gc()
 
     def end(self, api=None):
         import modules.devices
+        import modules.live_preview
         if self.time_start is None: # someone called end before being
             log.debug(f'Access state.end: {sys._getframe().f_back.f_code.co_name}') # pylint: disable=protected-access
             self.time_start = time.time()
         if self.debug_output:
             log.debug(f'State end: {self.job} time={time.time() - self.time_start:.2f}')
+        if modules.live_preview.previewer.submitted > 0 or modules.live_preview.previewer.decoded > 0:
+            log.debug(f'Live preview: {modules.live_preview.previewer.stats()}')
         self.job = ""
         self.job_count = 0
         self.job_no = 0
@@ -110,6 +115,11 @@ class State:
             return
         from modules.shared import opts
         import modules.sd_samplers # pylint: disable=W0621
+        import modules.live_preview
+        if modules.live_preview.enabled():
+            if modules.live_preview.previewer.submit(self.current_latent, self.sampling_step):
+                self.current_image_sampling_step = self.sampling_step
+            return
         try:
             image = modules.sd_samplers.samples_to_image_grid(self.current_latent) if opts.show_progress_grid else modules.sd_samplers.sample_to_image(self.current_latent)
             self.assign_current_image(image)
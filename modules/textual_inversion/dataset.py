@@ -1,7 +1,13 @@
+import io
 import os
 import re
+import math
+import time
+import queue
 import random
-from collections import defaultdict
+import threading
+import concurrent.futures
+from collections import defaultdict, deque
 import numpy as np
 import torch
 from PIL import Image
@@ -10,16 +16,56 @@ from torchvision import transforms
 import tqdm
 from ldm.modules.distributions.distributions import DiagonalGaussianDistribution
 from modules import devices, shared
+from modules.textual_inversion.latent_cache import LatentCache
 
 re_numbers_at_start = re.compile(r"^[-\d]+\s*")
 
 
+def aspect_buckets(width, height, step=64, max_ratio=4.0):
+    """sizes with sides multiple of step and area not larger than width*height, one per aspect ratio"""
+    area = width * height
+    buckets = set()
+    for w in range(step, area // step + 1, step):
+        h = (area // w) // step * step
+        if h >= step and max(w, h) / min(w, h) <= max_ratio:
+            buckets.add((w, h))
+    return sorted(buckets)
+
+
+def nearest_bucket(size, buckets):
+    aspect = math.log(size[0] / size[1])
+    return min(buckets, key=lambda b: (abs(aspect - math.log(b[0] / b[1])), -b[0] * b[1]))
+
+
+def resize_to_bucket(image, size):
+    """resize to cover bucket size and center crop"""
+    w, h = size
+    scale = max(w / image.width, h / image.height)
+    image = image.resize((max(w, round(image.width * scale)), max(h, round(image.height * scale))), Image.Resampling.BICUBIC)
+    left = (image.width - w) // 2
+    top = (image.height - h) // 2
+    return image.crop((left, top, left + w, top + h))
+
+
+def prefetch(fn, items, workers, depth):
+    """map fn over items in worker threads keeping at most depth results in flight, results are returned in order"""
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = deque()
+        for item in items:
+            futures.append(executor.submit(fn, item))
+            if len(futures) >= depth:
+                yield futures.popleft().result()
+        while len(futures) > 0:
+            yield futures.popleft().result()
+
+
 class DatasetEntry:
-    def __init__(self, filename=None, filename_text=None, latent_dist=None, latent_sample=None, cond=None, cond_text=None, pixel_values=None, weight=None):
+    def __init__(self, filename=None, filename_text=None, latent_dist=None, latent_sample=None, cond=None, cond_text=None, pixel_values=None, weight=None, latent_cached=None):
         self.filename = filename
         self.filename_text = filename_text
         self.weight = weight
         self.latent_dist = latent_dist
+        self.latent_cached = latent_cached # (kind, memory-mapped tensor) from latent cache, distribution is created on access
         self.latent_sample = latent_sample
         self.cond = cond
         self.cond_text = cond_text
@@ -45,20 +91,30 @@ class PersonalizedBase(Dataset):
         self.shuffle_tags = shuffle_tags
         self.tag_drop_out = tag_drop_out
         groups = defaultdict(list)
-        shared.log.info(f"TI Training: Preparing dataset: {data_root}")
-        for path in tqdm.tqdm(self.image_paths):
+        latent_cache = LatentCache(model)
+        buckets = aspect_buckets(width, height) if varsize else None
+
+        def load_image(path): # runs in worker threads so image decode overlaps with vae encode
             alpha_channel = None
-            if shared.state.interrupted:
-                raise RuntimeError("interrupted")
             try:
-                image = Image.open(path)
+                with open(path, 'rb') as f:
+                    content = f.read()
+                image = Image.open(io.BytesIO(content))
                 if use_weight and 'A' in image.getbands():
                     alpha_channel = image.getchannel('A')
-                image = image.convert('RGB')
-                if not varsize:
-                    image = image.resize((width, height), Image.Resampling.BICUBIC)
+                size = nearest_bucket(image.size, buckets) if varsize else (width, height)
+                key = latent_cache.key(content, size) if latent_cache.enabled else None
+                cached = latent_cache.load(key) if key is not None else None
+                npimage = None
+                if cached is None: # decode and resize image only if it needs to be encoded
+                    image = image.convert('RGB')
+                    image = resize_to_bucket(image, size) if varsize else image.resize((width, height), Image.Resampling.BICUBIC)
+                    npimage = np.array(image).astype(np.uint8)
+                    npimage = (npimage / 127.5 - 1.0).astype(np.float32)
+                if alpha_channel is not None and varsize:
+                    alpha_channel = resize_to_bucket(alpha_channel, size)
             except Exception:
-                continue
+                return None
 
             text_filename = f"{os.path.splitext(path)[0]}.txt"
             filename = os.path.basename(path)
@@ -72,16 +128,28 @@ class PersonalizedBase(Dataset):
                 if re_word:
                     tokens = re_word.findall(filename_text)
                     filename_text = (shared.opts.dataset_filename_join_string or "").join(tokens)
+            return path, size, key, cached, npimage, alpha_channel, filename_text
 
-            npimage = np.array(image).astype(np.uint8)
-            npimage = (npimage / 127.5 - 1.0).astype(np.float32)
+        shared.log.info(f"TI Training: Preparing dataset: {data_root}")
+        workers = max(1, shared.max_workers)
+        for item in tqdm.tqdm(prefetch(load_image, self.image_paths, workers, depth=4 * workers), total=len(self.image_paths)):
+            if shared.state.interrupted:
+                raise RuntimeError("interrupted")
+            if item is None:
+                continue
+            path, size, key, cached, npimage, alpha_channel, filename_text = item
 
-            torchdata = torch.from_numpy(npimage).permute(2, 0, 1).to(device=device, dtype=torch.float32)
+            if cached is None:
+                torchdata = torch.from_numpy(npimage).permute(2, 0, 1).to(device=device, dtype=torch.float32)
+                with devices.autocast():
+                    latent_dist = model.encode_first_stage(torchdata.unsqueeze(dim=0))
+                del torchdata
+                cached = latent_cache.save(key, latent_dist) if key is not None else None
+            latent_cache.track(path, key)
+            if cached is not None:
+                latent_dist = LatentCache.distribution(cached, device)
             latent_sample = None
 
-            with devices.autocast():
-                latent_dist = model.encode_first_stage(torchdata.unsqueeze(dim=0))
-
             if latent_sampling_method == "deterministic":
                 if isinstance(latent_dist, DiagonalGaussianDistribution):
                     latent_dist.std = torch.exp(0 * latent_dist.logvar)
@@ -104,7 +172,9 @@ class PersonalizedBase(Dataset):
             else:
                 weight = None
 
-            if latent_sampling_method == "random":
+            if latent_sampling_method == "random" and cached is not None:
+                entry = DatasetEntry(filename=path, filename_text=filename_text, latent_cached=cached, weight=weight)
+            elif latent_sampling_method == "random":
                 entry = DatasetEntry(filename=path, filename_text=filename_text, latent_dist=latent_dist, weight=weight)
             else:
                 entry = DatasetEntry(filename=path, filename_text=filename_text, latent_sample=latent_sample, weight=weight)
@@ -115,9 +185,9 @@ class PersonalizedBase(Dataset):
             if include_cond and not (self.tag_drop_out != 0 or self.shuffle_tags):
                 with devices.autocast():
                     entry.cond = cond_model([entry.cond_text]).to(devices.cpu).squeeze(0)
-            groups[image.size].append(len(self.dataset))
+            groups[size].append(len(self.dataset))
             self.dataset.append(entry)
-            del torchdata
+            del npimage
             del latent_dist
             del latent_sample
             del weight
@@ -125,6 +195,9 @@ class PersonalizedBase(Dataset):
         self.length = len(self.dataset)
         self.groups = list(groups.values())
         assert self.length > 0, "No images have been found in the dataset."
+        if latent_cache.enabled:
+            latent_cache.flush()
+            shared.log.info(f"TI Training: Latent cache: {latent_cache.stats()}")
         self.batch_size = min(batch_size, self.length)
         self.gradient_step = min(gradient_step, self.length // self.batch_size)
         self.latent_sampling_method = latent_sampling_method
@@ -154,7 +227,8 @@ class PersonalizedBase(Dataset):
         if self.tag_drop_out != 0 or self.shuffle_tags:
             entry.cond_text = self.create_text(entry.filename_text)
         if self.latent_sampling_method == "random":
-            entry.latent_sample = shared.sd_model.get_first_stage_encoding(entry.latent_dist).to(devices.cpu)
+            latent_dist = LatentCache.distribution(entry.latent_cached, devices.device) if entry.latent_cached is not None else entry.latent_dist
+            entry.latent_sample = shared.sd_model.get_first_stage_encoding(latent_dist).to(devices.cpu)
         return entry
 
 
@@ -193,12 +267,76 @@ class GroupedBatchSampler(Sampler):
 
 
 class PersonalizedDataLoader(DataLoader):
-    def __init__(self, dataset, latent_sampling_method="once", batch_size=1, pin_memory=False):
-        super(PersonalizedDataLoader, self).__init__(dataset, batch_sampler=GroupedBatchSampler(dataset, batch_size), pin_memory=pin_memory)
+    """
+    batches are assembled in background thread and prefetched into bounded queue so training step does not wait on text templating and latent sampling
+    dataset entries hold model tensors so thread is used instead of worker processes
+    """
+    def __init__(self, dataset, latent_sampling_method="once", batch_size=1, pin_memory=False, prefetch_batches=None):
+        super(PersonalizedDataLoader, self).__init__(dataset, batch_sampler=GroupedBatchSampler(dataset, batch_size), pin_memory=pin_memory, num_workers=0)
         if latent_sampling_method == "random":
             self.collate_fn = collate_wrapper_random
         else:
             self.collate_fn = collate_wrapper
+        self.prefetch_batches = prefetch_batches if prefetch_batches is not None else shared.opts.training_prefetch
+        self.images = 0
+        self.stall = 0
+        self.t0 = None
+
+    def __iter__(self):
+        if self.t0 is None:
+            self.t0 = time.time()
+        if self.prefetch_batches <= 0:
+            batches = DataLoader.__iter__(self)
+            while True:
+                t0 = time.time()
+                batch = next(batches, None)
+                self.stall += time.time() - t0
+                if batch is None:
+                    return
+                self.images += len(batch.cond_text)
+                yield batch
+        end = object()
+        batches = queue.Queue(maxsize=self.prefetch_batches)
+        stop = threading.Event()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def producer():
+            try:
+                for batch in DataLoader.__iter__(self):
+                    if not put(batch):
+                        return
+            except Exception as e:
+                put(e)
+            put(end)
+
+        thread = threading.Thread(target=producer, name='training-dataloader', daemon=True)
+        thread.start()
+        try:
+            while True:
+                t0 = time.time()
+                batch = batches.get()
+                self.stall += time.time() - t0
+                if batch is end:
+                    break
+                if isinstance(batch, Exception):
+                    raise batch
+                self.images += len(batch.cond_text)
+                yield batch
+        finally:
+            stop.set()
+            thread.join()
+
+    def stats(self):
+        elapsed = time.time() - self.t0 if self.t0 is not None else 0
+        return f'images={self.images} rate={self.images / elapsed if elapsed > 0 else 0:.2f}/s stall={self.stall:.2f}s prefetch={self.prefetch_batches}'
 
 
 class BatchLoader:
@@ -0,0 +1,115 @@
+import os
+import hashlib
+import numpy as np
+import torch
+from ldm.modules.distributions.distributions import DiagonalGaussianDistribution
+from modules import shared, devices, sd_vae, hashes
+
+
+class LatentCache:
+    """
+    on-disk cache of vae encoded training images stored as numpy files which are memory-mapped while training
+    items are keyed by image content hash, resolution, flip and vae identity so unchanged images are reused between runs and changed images are encoded again
+    current key of each source image is recorded so item superseded by edited image or changed model is removed
+    """
+    def __init__(self, model, folder=None):
+        self.folder = folder if folder is not None else shared.opts.training_latent_cache_dir
+        self.enabled = shared.opts.training_latent_cache and self.folder is not None and len(self.folder) > 0
+        self.vae = self.vae_identity(model)
+        self.hits = 0
+        self.misses = 0
+        self.removed = 0
+        self.changed = False
+        if self.enabled:
+            os.makedirs(self.folder, exist_ok=True)
+
+    def vae_identity(self, model):
+        checkpoint_info = getattr(model, 'sd_checkpoint_info', None)
+        checkpoint = getattr(checkpoint_info, 'sha256', None) or getattr(checkpoint_info, 'title', None)
+        path = getattr(checkpoint_info, 'path', None)
+        mtime = os.path.getmtime(path) if path is not None and os.path.exists(path) else 0
+        return f'{checkpoint}:{mtime}:{sd_vae.loaded_vae_file}:{devices.dtype_vae}'
+
+    def key(self, content: bytes, size, flip=False):
+        content_hash = hashlib.sha256(content).hexdigest()
+        return hashlib.sha256(f'{content_hash}:{size[0]}x{size[1]}:{flip}:{self.vae}'.encode()).hexdigest()[:32]
+
+    def filename(self, key, kind):
+        return os.path.join(self.folder, f'{key}-{kind}.npy')
+
+    def load(self, key):
+        """returns (kind, memory-mapped tensor) or None if item is not cached or invalid in which case it is removed"""
+        if not self.enabled:
+            return None
+        for kind in ['dist', 'tensor']:
+            fn = self.filename(key, kind)
+            if not os.path.isfile(fn):
+                continue
+            try:
+                data = np.load(fn, mmap_mode='c') # copy-on-write so tensor is writable while pages stay backed by file
+                if data.ndim != 4 or data.shape[0] != 1 or data.size == 0:
+                    raise ValueError(f'shape={data.shape}')
+                self.hits += 1
+                return kind, torch.from_numpy(data)
+            except Exception as e:
+                shared.log.warning(f'Training latent cache: invalid item="{fn}" {e}')
+                try:
+                    os.remove(fn)
+                except OSError:
+                    pass
+        self.misses += 1
+        return None
+
+    def save(self, key, latent_dist):
+        """store encoded result and return it as memory-mapped tensor, returns None if cache is disabled"""
+        if not self.enabled:
+            return None
+        kind = 'dist' if isinstance(latent_dist, DiagonalGaussianDistribution) else 'tensor'
+        tensor = latent_dist.parameters if kind == 'dist' else latent_dist
+        fn = self.filename(key, kind)
+        tmp = f'{fn}.tmp'
+        try:
+            with open(tmp, 'wb') as f:
+                np.save(f, tensor.detach().to(devices.cpu, dtype=torch.float32).numpy())
+            os.replace(tmp, fn)
+        except Exception as e:
+            shared.log.error(f'Training latent cache: save item="{fn}" {e}')
+            return None
+        data = np.load(fn, mmap_mode='c')
+        return kind, torch.from_numpy(data)
+
+    def track(self, path, key):
+        """record key used for source image and remove item it superseded unless another image still uses it"""
+        if not self.enabled or key is None:
+            return
+        index = hashes.cache('training-latent-cache')
+        path = os.path.abspath(path)
+        previous = index.get(path, None)
+        if previous == key:
+            return
+        index[path] = key
+        self.changed = True
+        if previous is None or previous in index.values():
+            return
+        for kind in ['dist', 'tensor']:
+            fn = self.filename(previous, kind)
+            try:
+                if os.path.isfile(fn):
+                    os.remove(fn)
+                    self.removed += 1
+            except OSError as e:
+                shared.log.warning(f'Training latent cache: remove item="{fn}" {e}')
+
+    def flush(self):
+        if self.changed:
+            hashes.dump_cache()
+            self.changed = False
+
+    @staticmethod
+    def distribution(cached, device=None):
+        kind, tensor = cached
+        tensor = tensor.to(device) if device is not None else tensor
+        return DiagonalGaussianDistribution(tensor) if kind == 'dist' else tensor
+
+    def stats(self):
+        return f'hits={self.hits} misses={self.misses} removed={self.removed} folder="{self.folder}"'
@@ -3,6 +3,7 @@ import csv
 import html
 import os
 import time
+import concurrent.futures
 from collections import namedtuple
 import torch
 from tqdm import tqdm
@@ -87,13 +88,31 @@ class DirWithTextualInversionEmbeddings:
     def __init__(self, path):
         self.path = path
         self.mtime = None
+        self.files = {} # filename -> (mtime, size) as of last update
 
     def has_changed(self):
         if not os.path.isdir(self.path):
             return False
         return directory_mtime(self.path) != self.mtime
 
-    def update(self):
+    def scan(self):
+        """returns current files and lists of added, removed and modified files since last update compared by mtime and size"""
+        files = {}
+        if os.path.isdir(self.path):
+            for fn in list_embeddings(self.path):
+                try:
+                    stat = os.stat(fn)
+                    files[fn] = (stat.st_mtime, stat.st_size)
+                except OSError:
+                    pass
+        added = [fn for fn in files if fn not in self.files]
+        removed = [fn for fn in self.files if fn not in files]
+        modified = [fn for fn in files if fn in self.files and files[fn] != self.files[fn]]
+        return files, added, removed, modified
+
+    def update(self, files=None):
+        if files is not None:
+            self.files = files
         if not os.path.isdir(self.path):
             return
         self.mtime = directory_mtime(self.path)
@@ -123,6 +142,7 @@ class EmbeddingDatabase:
         self.embedding_dirs = {}
         self.previously_displayed_embeddings = ()
         self.embeddings_used = []
+        self.model_state = None # model and text encoders embeddings were loaded into, full reload is needed if it changes
 
     def add_embedding_dir(self, path):
         self.embedding_dirs[path] = DirWithTextualInversionEmbeddings(path)
@@ -144,6 +164,34 @@ class EmbeddingDatabase:
         self.ids_lookup[first_id] = sorted(self.ids_lookup[first_id] + [(ids, embedding)], key=lambda x: len(x[0]), reverse=True)
         return embedding
 
+    def unregister_embedding(self, embedding):
+        if self.word_embeddings.get(embedding.name, None) is embedding:
+            del self.word_embeddings[embedding.name]
+        for first_id in list(self.ids_lookup):
+            self.ids_lookup[first_id] = [x for x in self.ids_lookup[first_id] if x[1] is not embedding]
+            if len(self.ids_lookup[first_id]) == 0:
+                del self.ids_lookup[first_id]
+
+    def remove_files(self, filenames):
+        """unregister embeddings loaded from given files, tokens added to diffusers tokenizers are kept and updated if file is loaded again"""
+        filenames = set(filenames)
+        for embedding in [e for e in self.word_embeddings.values() if e.filename in filenames]:
+            self.unregister_embedding(embedding)
+        for name in [name for name, e in self.skipped_embeddings.items() if e.filename in filenames]:
+            del self.skipped_embeddings[name]
+
+    def read_files(self, fn, filenames):
+        """run fn for each file in parallel as load time is dominated by file reads, exceptions are returned in place of results"""
+        def read(filename):
+            try:
+                return fn(filename)
+            except Exception as e:
+                return e
+        if len(filenames) < 2:
+            return { filename: read(filename) for filename in filenames }
+        with concurrent.futures.ThreadPoolExecutor(max_workers=shared.max_workers) as executor:
+            return dict(zip(filenames, executor.map(read, filenames)))
+
     def get_expected_shape(self):
         if shared.backend == shared.Backend.DIFFUSERS:
             return 0
@@ -175,6 +223,7 @@ class EmbeddingDatabase:
         exts = [".SAFETENSORS", '.BIN', '.PT', '.PNG', '.WEBP', '.JXL', '.AVIF'] # SDXL only uses safetensors
         filename_paths = zip(filenames, len(filenames) * [path] if (isinstance(path, str) or path is None) else path)
         unk_token_id = tokenizer.convert_tokens_to_ids(tokenizer.unk_token)
+        added_vocab = tokenizer.get_added_vocab() # tokens added by previous loads are updated in place instead of being treated as already loaded
         for filename, fullname in filename_paths:
             debug(f'Embedding check: {filename}')
             if fullname is None:
@@ -186,7 +235,7 @@ class EmbeddingDatabase:
             try:
                 if ext.upper() not in exts:
                     raise ValueError(f'extension `{ext}` is invalid, expected one of: {exts}')
-                if name in tokenizer.get_vocab() or f"{name}_1" in tokenizer.get_vocab():
+                if (name in tokenizer.get_vocab() or f"{name}_1" in tokenizer.get_vocab()) and name not in added_vocab:
                     loaded_embeddings[name] = embedding
                     debug(f'Embedding already loaded: {name}')
                 embeddings_to_load.append(embedding)
@@ -198,19 +247,15 @@ class EmbeddingDatabase:
 
         tokens_to_add = {}
         tokenizer_vocab = tokenizer.get_vocab()
+        files = self.read_files(self.read_diffusers_file, [e.filename for e in embeddings_to_load if e.name not in loaded_embeddings])
         for embedding in embeddings_to_load:
             try:
                 debug(f'Embedding load: {embedding.name} file={embedding.filename}')
                 if embedding.name in tokens_to_add or embedding.name in loaded_embeddings:
                     raise ValueError('duplicate token')
-                embeddings_dict = {}
-                _, ext = os.path.splitext(embedding.filename)
-                if ext.upper() in ['.SAFETENSORS']:
-                    with safetensors.torch.safe_open(embedding.filename, framework="pt") as f: # type: ignore
-                        for k in f.keys():
-                            embeddings_dict[k] = f.get_tensor(k)
-                else:  # fallback for sd1.5 pt embeddings
-                    embeddings_dict["clip_l"] = self.load_from_file(embedding.filename, embedding.filename)
+                embeddings_dict = files[embedding.filename]
+                if isinstance(embeddings_dict, Exception):
+                    raise embeddings_dict
                 if 'clip_l' not in embeddings_dict:
                     raise ValueError('Invalid Embedding, dict missing required key `clip_l`')
                 if 'clip_g' not in embeddings_dict and model_type == "SDXL" and shared.opts.diffusers_convert_embed:
@@ -225,7 +270,7 @@ class EmbeddingDatabase:
                 for i in range(len(embeddings_dict["clip_l"])):
                     if len(clip_l.get_input_embeddings().weight.data[0]) == len(embeddings_dict["clip_l"][i]):
                         token = embedding.name if i == 0 else f"{embedding.name}_{i}"
-                        if token in tokenizer_vocab:
+                        if token in tokenizer_vocab and token not in added_vocab:
                             raise RuntimeError(f'Multi-Vector Embedding would add pre-existing Token in Vocabulary: {token}')
                         if token in tokens_to_add:
                             raise RuntimeError(f'Multi-Vector Embedding would add duplicate Token to Add: {token}')
@@ -236,7 +281,7 @@ class EmbeddingDatabase:
                 if not _tokens_to_add:
                     raise ValueError('no valid tokens to add')
                 tokens_to_add.update(_tokens_to_add)
-                loaded_embeddings[name] = embedding
+                loaded_embeddings[embedding.name] = embedding
             except Exception as e:
                 debug(f"Embedding loading: {embedding.filename} {e}")
                 continue
@@ -273,26 +318,46 @@ class EmbeddingDatabase:
             pass
         return len(self.word_embeddings) - _loaded_pre
 
-    def load_from_file(self, path, filename):
-        name, ext = os.path.splitext(filename)
+    def read_diffusers_file(self, filename):
+        embeddings_dict = {}
+        _, ext = os.path.splitext(filename)
+        if ext.upper() in ['.SAFETENSORS']:
+            with safetensors.torch.safe_open(filename, framework="pt") as f: # type: ignore
+                for k in f.keys():
+                    embeddings_dict[k] = f.get_tensor(k)
+        else:  # fallback for sd1.5 pt embeddings
+            embeddings_dict["clip_l"] = self.load_from_file(filename, filename)
+        return embeddings_dict
+
+    def read_from_file(self, path, filename):
+        """read embedding data from file, returns None if file does not contain embedding"""
+        _name, ext = os.path.splitext(filename)
         ext = ext.upper()
-
         if ext in ['.PNG', '.WEBP', '.JXL', '.AVIF']:
             if '.preview' in filename.lower():
-                return
+                return None
             embed_image = Image.open(path)
             if hasattr(embed_image, 'text') and 'sd-ti-embedding' in embed_image.text:
                 data = embedding_from_b64(embed_image.text['sd-ti-embedding'])
             else:
                 data = extract_image_data_embed(embed_image)
                 if not data: # if data is None, means this is not an embeding, just a preview image
-                    return
+                    return None
         elif ext in ['.BIN', '.PT']:
             data = torch.load(path, map_location="cpu")
         elif ext in ['.SAFETENSORS']:
             data = safetensors.torch.load_file(path, device="cpu")
         else:
+            return None
+        return data
+
+    def load_from_file(self, path, filename):
+        return self.load_from_data(path, filename, self.read_from_file(path, filename))
+
+    def load_from_data(self, path, filename, data):
+        if data is None:
             return
+        name, _ext = os.path.splitext(filename)
 
         # textual inversion embeddings
         if 'string_to_param' in data:
@@ -328,44 +393,70 @@ class EmbeddingDatabase:
         else:
             self.skipped_embeddings[name] = embedding
 
+    def load_files(self, file_paths):
+        if shared.backend == shared.Backend.DIFFUSERS:
+            self.load_diffusers_embedding(file_paths)
+            return
+        files = self.read_files(lambda fn: self.read_from_file(fn, os.path.basename(fn)), file_paths)
+        for file_path in file_paths:
+            fn = os.path.basename(file_path)
+            try:
+                if isinstance(files[file_path], Exception):
+                    raise files[file_path]
+                self.load_from_data(file_path, fn, files[file_path])
+            except Exception as e:
+                errors.display(e, f'Load embeding={fn}')
+                continue
+
     def load_from_dir(self, embdir):
         if sd_models.model_data.sd_model is None:
             shared.log.info('Skipping embeddings load: model not loaded')
             return
         if not os.path.isdir(embdir.path):
             return
-        file_paths = list_embeddings(embdir.path)
-        if shared.backend == shared.Backend.DIFFUSERS:
-            self.load_diffusers_embedding(file_paths)
-        else:
-            for file_path in file_paths:
-                try:
-                    fn = os.path.basename(file_path)
-                    self.load_from_file(file_path, fn)
-                except Exception as e:
-                    errors.display(e, f'Load embeding={fn}')
-                    continue
+        self.load_files(list_embeddings(embdir.path))
+
+    def current_model_state(self):
+        model = shared.sd_model
+        checkpoint_info = getattr(model, 'sd_checkpoint_info', None)
+        encoders = tuple(id(getattr(model, name, None)) for name in ['cond_stage_model', 'tokenizer', 'tokenizer_2', 'text_encoder', 'text_encoder_2'])
+        return (id(model), getattr(checkpoint_info, 'title', None), encoders)
 
     def load_textual_inversion_embeddings(self, force_reload=False):
+        """
+        loads only added, removed and modified files if embeddings were already loaded into current model, full reload is done only if model changed
+        without force_reload files are checked only in folders whose mtime changed
+        """
         if shared.sd_model is None:
             return
+        if sd_models.model_data.sd_model is None:
+            shared.log.info('Skipping embeddings load: model not loaded')
+            return
         t0 = time.time()
-        if not force_reload:
-            need_reload = False
+        model_state = self.current_model_state()
+        full_reload = model_state != self.model_state
+        if full_reload:
+            self.ids_lookup.clear()
+            self.word_embeddings.clear()
+            self.skipped_embeddings.clear()
+            self.embeddings_used.clear()
+            self.expected_shape = self.get_expected_shape()
             for embdir in self.embedding_dirs.values():
-                if embdir.has_changed():
-                    need_reload = True
-                    break
-            if not need_reload:
-                return
-        self.ids_lookup.clear()
-        self.word_embeddings.clear()
-        self.skipped_embeddings.clear()
-        self.embeddings_used.clear()
-        self.expected_shape = self.get_expected_shape()
+                embdir.files = {}
+            self.model_state = model_state
+        added, removed, modified = [], [], []
         for embdir in self.embedding_dirs.values():
-            self.load_from_dir(embdir)
-            embdir.update()
+            if not (full_reload or force_reload or embdir.has_changed()):
+                continue
+            files, dir_added, dir_removed, dir_modified = embdir.scan()
+            added += dir_added
+            removed += dir_removed
+            modified += dir_modified
+            embdir.update(files)
+        if len(added) + len(removed) + len(modified) == 0:
+            return
+        self.remove_files(removed + modified)
+        self.load_files(added + modified)
 
         # re-sort word_embeddings because load_from_dir may not load in alphabetic order.
         # using a temporary copy so we don't reinitialize self.word_embeddings in case other objects have a reference to it.
@@ -377,7 +468,7 @@ class EmbeddingDatabase:
         if self.previously_displayed_embeddings != displayed_embeddings:
             self.previously_displayed_embeddings = displayed_embeddings
             t1 = time.time()
-            shared.log.info(f"Load embeddings: loaded={len(self.word_embeddings)} skipped={len(self.skipped_embeddings)} time={t1-t0:.2f}")
+            shared.log.info(f"Load embeddings: loaded={len(self.word_embeddings)} skipped={len(self.skipped_embeddings)} added={len(added)} removed={len(removed)} modified={len(modified)} time={t1-t0:.2f}")
 
 
     def find_embedding_at_position(self, tokens, offset):
@@ -734,6 +825,7 @@ Last saved image: {html.escape(last_saved_image)}<br/>
     finally:
         pbar.leave = False
         pbar.close()
+        shared.log.info(f'TI Training: dataloader {dl.stats()}')
         shared.sd_model.first_stage_model.to(devices.device)
         shared.parallel_processing_allowed = old_parallel_processing_allowed
         sd_hijack_checkpoint.remove()